@@ -0,0 +1,212 @@
+"""Customer and admin authentication.
+
+Tokens are HS256 JWTs signed with JWT_SECRET, so verifying one is a CPU-only
+check with no database round-trip. Decoded claims are kept in an LRU keyed by
+the raw token, so a client pays for signature verification once; expiry and
+revocation are still checked on every request.
+
+Revoked token ids (jti) live in `revoked_tokens`, TTL-indexed on the token's
+own expiry. They are mirrored in an in-memory set that is reloaded every
+AUTH_REVOCATION_REFRESH_SECONDS. A logout takes effect at once on the worker
+that handled it, and on the others after their next reload.
+
+Passwords are hashed with bcrypt in a small thread pool (bcrypt releases the
+GIL), so logins and registrations never block the event loop.
+"""
+import asyncio
+import logging
+import secrets
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, Optional, Set
+
+import bcrypt
+import jwt
+from fastapi import Depends, HTTPException
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from pydantic import BaseModel, Field, field_validator
+from pymongo import ASCENDING
+
+from cache import LRUCache
+from config import settings
+from write_concerns import collection
+
+logger = logging.getLogger(__name__)
+
+ALGORITHM = "HS256"
+ADMIN = "admin"
+CUSTOMER = "customer"
+USERS_COLLECTION = "users"
+REVOKED_COLLECTION = "revoked_tokens"
+MAX_PASSWORD_BYTES = 72  # bcrypt ignores anything longer
+
+if settings.JWT_SECRET:
+    _secret = settings.JWT_SECRET
+elif settings.APP_ENV == "development":
+    _secret = secrets.token_urlsafe(32)
+    logger.warning("JWT_SECRET is not set; using a random key, tokens won't survive a restart or work across workers")
+else:
+    # A per-process key would make tokens fail at random behind more than one worker
+    raise RuntimeError("JWT_SECRET must be set (or APP_ENV=development for a throwaway key)")
+
+_claims = LRUCache(maxsize=settings.AUTH_CACHE_SIZE)
+_revoked: Set[str] = set()
+_hash_pool = ThreadPoolExecutor(max_workers=settings.AUTH_HASH_THREADS, thread_name_prefix="password-hash")
+# Compared against for unknown emails so response time doesn't reveal which accounts exist;
+# hashed on first use rather than at import
+_dummy_hash: Optional[bytes] = None
+
+_bearer = HTTPBearer(auto_error=False)
+
+
+class Credentials(BaseModel):
+    email: str = Field(pattern=r"^[^@\s]+@[^@\s]+\.[^@\s]+$", max_length=254)
+    password: str = Field(min_length=8)
+
+    @field_validator("email")
+    @classmethod
+    def normalize_email(cls, email: str) -> str:
+        return email.strip().lower()
+
+    @field_validator("password")
+    @classmethod
+    def bcrypt_length(cls, password: str) -> str:
+        if len(password.encode()) > MAX_PASSWORD_BYTES:
+            raise ValueError(f"password must be at most {MAX_PASSWORD_BYTES} bytes")
+        return password
+
+
+class RegisterRequest(Credentials):
+    name: str = Field(min_length=1, max_length=100)
+
+
+def public_user(user: Dict[str, Any]) -> Dict[str, Any]:
+    return {"id": user["_id"], "email": user["email"], "name": user.get("name"), "roles": user.get("roles", [])}
+
+
+async def hash_password(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    salt = bcrypt.gensalt(settings.PASSWORD_HASH_ROUNDS)
+    hashed = await loop.run_in_executor(_hash_pool, bcrypt.hashpw, password.encode(), salt)
+    return hashed.decode()
+
+
+async def verify_password(password: str, hashed: bytes) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_pool, bcrypt.checkpw, password.encode(), hashed)
+
+
+def issue_token(user: Dict[str, Any]) -> str:
+    now = int(time.time())
+    return jwt.encode({
+        "sub": user["_id"],
+        "email": user["email"],
+        "roles": user.get("roles", []),
+        "iat": now,
+        "exp": now + settings.JWT_TTL_MINUTES * 60,
+        "jti": uuid.uuid4().hex,
+    }, _secret, algorithm=ALGORITHM)
+
+
+def decode(token: str) -> Optional[Dict[str, Any]]:
+    """Claims of a valid, unexpired, unrevoked token, else None"""
+    claims = _claims.get(token)
+    if claims is None:
+        try:
+            claims = jwt.decode(token, _secret, algorithms=[ALGORITHM], options={"require": ["exp", "sub", "jti"]})
+        except jwt.InvalidTokenError:
+            return None
+        _claims.set(token, claims)
+    if claims["exp"] <= time.time() or claims["jti"] in _revoked:
+        return None
+    return claims
+
+
+async def revoke(db, claims: Dict[str, Any]) -> None:
+    _revoked.add(claims["jti"])
+    await collection(db, REVOKED_COLLECTION).update_one(
+        {"_id": claims["jti"]},
+        {"$set": {"exp": datetime.utcfromtimestamp(claims["exp"])}},
+        upsert=True,
+    )
+
+
+async def refresh_revocations(db) -> int:
+    global _revoked
+    docs = await db[REVOKED_COLLECTION].find({"exp": {"$gt": datetime.utcnow()}}, {"_id": 1}).to_list(None)
+    _revoked = {doc["_id"] for doc in docs}
+    return len(_revoked)
+
+
+async def ensure_indexes(db) -> None:
+    await db[USERS_COLLECTION].create_index([("email", ASCENDING)], name="email", unique=True)
+    await db[REVOKED_COLLECTION].create_index("exp", expireAfterSeconds=0)
+
+
+async def create_user(db, email: str, password: str, name: str, roles=(CUSTOMER,)) -> Dict[str, Any]:
+    """Insert a user; raises pymongo DuplicateKeyError if the email is taken"""
+    user = {
+        "_id": uuid.uuid4().hex,
+        "email": email,
+        "name": name,
+        "ph": await hash_password(password),
+        "roles": list(roles),
+        "ca": datetime.utcnow(),
+    }
+    await collection(db, USERS_COLLECTION).insert_one(user)
+    return user
+
+
+async def dummy_hash() -> bytes:
+    global _dummy_hash
+    if _dummy_hash is None:
+        _dummy_hash = (await hash_password("dummy-password")).encode()
+    return _dummy_hash
+
+
+async def authenticate(db, email: str, password: str) -> Optional[Dict[str, Any]]:
+    user = await db[USERS_COLLECTION].find_one({"email": email})
+    hashed = user["ph"].encode() if user else await dummy_hash()
+    if not await verify_password(password, hashed) or user is None:
+        return None
+    return user
+
+
+async def ensure_admin(db, email: str, password: str) -> None:
+    """Create the bootstrap admin from ADMIN_EMAIL/ADMIN_PASSWORD if missing"""
+    email = email.strip().lower()
+    if await db[USERS_COLLECTION].find_one({"email": email}, {"_id": 1}) is None:
+        await create_user(db, email, password, "Admin", roles=(ADMIN,))
+        logger.info(f"Created admin user {email}")
+
+
+def optional_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer)) -> Optional[Dict[str, Any]]:
+    """Claims for a valid Bearer token; None when the request is anonymous"""
+    if credentials is None:
+        return None
+    claims = decode(credentials.credentials)
+    if claims is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired token", headers={"WWW-Authenticate": "Bearer"})
+    return claims
+
+
+def current_user(claims: Optional[Dict[str, Any]] = Depends(optional_user)) -> Dict[str, Any]:
+    if claims is None:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    return claims
+
+
+def is_admin(claims: Dict[str, Any]) -> bool:
+    return ADMIN in claims.get("roles", [])
+
+
+def require_role(role: str):
+    def dependency(claims: Dict[str, Any] = Depends(current_user)) -> Dict[str, Any]:
+        if role not in claims.get("roles", []):
+            raise HTTPException(status_code=403, detail="Forbidden")
+        return claims
+
+    dependency.__name__ = f"require_{role}"
+    return dependency
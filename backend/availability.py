@@ -0,0 +1,134 @@
+"""Short-TTL stock layer joined onto long-TTL cached products.
+
+Product records stay cached for a long time. Stock (availableForSale and
+quantityAvailable) is held separately per variant id and kept fresh in two
+ways: a poller re-reads variants of recently served products, and Shopify
+products/update webhooks push new quantities. Any change invalidates the
+cached responses that embed the product, so nothing else is thrown away.
+"""
+import copy
+import logging
+from typing import Any, Dict, Iterable, List
+
+import catalog
+from cache import LRUCache
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+POLL_BATCH_SIZE = 250
+
+VARIANTS_QUERY = """
+query variantAvailability($ids: [ID!]!) {
+    nodes(ids: $ids) {
+        ... on ProductVariant {
+            id
+            availableForSale
+            quantityAvailable
+            product {
+                handle
+            }
+        }
+    }
+}
+"""
+
+# variant id -> {"availableForSale": bool, "quantityAvailable": int | None}
+stock = LRUCache(maxsize=settings.AVAILABILITY_CACHE_SIZE, ttl=settings.AVAILABILITY_TTL_SECONDS)
+
+# Bumped whenever a stored level changes, so priced carts can key on it
+version = 0
+
+# Handles served recently; only these are polled
+_hot = LRUCache(maxsize=settings.AVAILABILITY_HOT_PRODUCTS, ttl=settings.AVAILABILITY_HOT_SECONDS)
+
+
+def _variants(product: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [edge["node"] for edge in product.get("variants", {}).get("edges", [])]
+
+
+def touch(handles: Iterable[str]) -> None:
+    for handle in handles:
+        _hot.set(handle, True)
+
+
+def record(products: Iterable[Dict[str, Any]]) -> int:
+    """Feed stock from freshly fetched product nodes into the layer"""
+    levels, handles = {}, {}
+    for product in products:
+        for variant in _variants(product):
+            levels[variant["id"]] = {
+                "availableForSale": variant.get("availableForSale"),
+                "quantityAvailable": variant.get("quantityAvailable"),
+            }
+            handles[variant["id"]] = product["handle"]
+    return update(levels, handles)
+
+
+def apply(product: Dict[str, Any]) -> Dict[str, Any]:
+    """Product with fresh per-variant stock joined in (copied only if it differs)"""
+    joined = None
+    for i, variant in enumerate(_variants(product)):
+        level = stock.get(variant["id"])
+        if level is None or all(variant.get(key) == value for key, value in level.items()):
+            continue
+        if joined is None:
+            joined = copy.deepcopy(product)
+        _variants(joined)[i].update(level)
+    return joined or product
+
+
+def update(levels: Dict[str, Dict[str, Any]], handles_by_variant: Dict[str, str]) -> int:
+    """Store new stock levels and invalidate responses for products whose stock moved"""
+    global version
+    changed_handles = set()
+    for variant_id, level in levels.items():
+        if stock.get(variant_id) != level:
+            version += 1
+            if variant_id in handles_by_variant:
+                changed_handles.add(handles_by_variant[variant_id])
+        # Re-set even when unchanged to extend its freshness
+        stock.set(variant_id, level)
+    if changed_handles:
+        catalog.invalidate_handles(changed_handles)
+    return len(changed_handles)
+
+
+def apply_webhook(payload: Dict[str, Any]) -> int:
+    """Shopify products/update webhook body -> stock updates"""
+    levels, handles = {}, {}
+    for variant in payload.get("variants", []):
+        variant_id = variant.get("admin_graphql_api_id") or f"gid://shopify/ProductVariant/{variant['id']}"
+        quantity = variant.get("inventory_quantity")
+        levels[variant_id] = {
+            "availableForSale": (quantity or 0) > 0 or variant.get("inventory_policy") == "continue",
+            "quantityAvailable": quantity,
+        }
+        if payload.get("handle"):
+            handles[variant_id] = payload["handle"]
+    return update(levels, handles)
+
+
+async def poll_once() -> int:
+    variant_handles: Dict[str, str] = {}
+    for handle in _hot.keys():
+        product = catalog.product_cache.get(handle)
+        if product is not None:
+            for variant in _variants(product):
+                variant_handles[variant["id"]] = handle
+
+    ids = list(variant_handles)
+    changed = 0
+    for i in range(0, len(ids), POLL_BATCH_SIZE):
+        data = await catalog.storefront(VARIANTS_QUERY, {"ids": ids[i:i + POLL_BATCH_SIZE]})
+        nodes = [node for node in data["nodes"] if node]
+        levels = {
+            node["id"]: {
+                "availableForSale": node.get("availableForSale"),
+                "quantityAvailable": node.get("quantityAvailable"),
+            }
+            for node in nodes
+        }
+        changed += update(levels, {node["id"]: node["product"]["handle"] for node in nodes})
+    return changed
+
@@ -0,0 +1,38 @@
+"""Checkout body validation throughput.
+
+    python bench_checkout.py --n 10000 --lines 10
+
+Validates create-order bodies straight from JSON bytes, as the endpoint
+does, on a single core. The target is at least 10k carts per second.
+"""
+import argparse
+import time
+
+from checkout import MAX_CART_LINES, CreateOrderRequest, sample_cart
+
+TARGET_PER_SECOND = 10000
+
+
+def bench(n: int, lines: int) -> float:
+    body = sample_cart(lines).encode()
+    CreateOrderRequest.model_validate_json(body)  # warm up
+    started = time.perf_counter()
+    for _ in range(n):
+        CreateOrderRequest.model_validate_json(body)
+    return n / (time.perf_counter() - started)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--n", type=int, default=10000)
+    parser.add_argument("--lines", type=int, default=10)
+    args = parser.parse_args()
+
+    for lines in sorted({1, args.lines, MAX_CART_LINES}):
+        rate = bench(args.n, lines)
+        verdict = "ok" if rate >= TARGET_PER_SECOND else "BELOW TARGET"
+        print(f"{lines:3} lines: {rate:10.0f} carts/s  {verdict}")
+
+
+if __name__ == "__main__":
+    main()
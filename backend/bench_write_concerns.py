@@ -0,0 +1,56 @@
+"""Write latency per write concern against a live MongoDB.
+
+    python bench_write_concerns.py --n 2000
+
+Uses a scratch collection in DB_NAME and drops it afterwards. On a single
+node "majority" equals w=1 apart from the journal wait; run it against a
+replica set to see the real difference.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.write_concern import WriteConcern
+
+from config import settings
+
+CONCERNS = {
+    "w=0 (telemetry)": WriteConcern(w=0),
+    "w=1": WriteConcern(w=1),
+    "w=majority,j=true (payments)": WriteConcern(w="majority", j=True),
+}
+
+
+async def bench(coll, n: int):
+    latencies = []
+    for i in range(n):
+        started = time.perf_counter()
+        await coll.insert_one({"i": i, "payload": "x" * 200})
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return {
+        "p50": statistics.median(latencies),
+        "p99": latencies[int(len(latencies) * 0.99) - 1],
+        "ops_per_second": n / (sum(latencies) / 1000),
+    }
+
+
+async def main(n: int) -> None:
+    client = AsyncIOMotorClient(settings.MONGO_URL)
+    scratch = client[settings.DB_NAME]["bench_write_concerns"]
+    try:
+        for label, concern in CONCERNS.items():
+            result = await bench(scratch.with_options(write_concern=concern), n)
+            print(f"{label:32} p50={result['p50']:.3f}ms p99={result['p99']:.3f}ms "
+                  f"{result['ops_per_second']:.0f} ops/s")
+    finally:
+        await scratch.drop()
+        client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=2000)
+    asyncio.run(main(parser.parse_args().n))
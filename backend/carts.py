@@ -0,0 +1,357 @@
+"""Server-side carts keyed by session.
+
+A cart is a version number plus compact lines (numeric variant id ->
+quantity). Carts are held in an in-memory LRU and written behind to the
+`carts` collection: mutations only mark the cart dirty, and a background
+flush upserts all dirty carts in one bulk_write every CART_FLUSH_SECONDS.
+Dirty carts are pinned until flushed, so LRU eviction never drops a write.
+
+Each write is conditional on the version the worker last read or wrote.
+When another worker changed the cart in between, the write is rejected and
+the cart is re-read, and this worker's own changes are applied on top of it
+before the next flush, so concurrent edits from several workers are merged
+rather than overwritten.
+
+Prices are never stored on the cart. price() joins the lines against the
+catalog (the catalog_sync snapshot, falling back to a Storefront `nodes`
+query for unknown variants), with stock from the availability layer. The
+result is cached per (cart, version, catalog version, stock version), so
+repeated reads and checkout reuse one pricing pass.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional
+
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+
+import availability
+import catalog
+import catalog_sync
+import orders
+from cache import LRUCache
+from checkout import CART_ID_PATTERN, MAX_CART_LINES, MAX_QUANTITY
+from config import settings
+from write_concerns import collection
+
+logger = logging.getLogger(__name__)
+
+# Compact document fields
+VERSION = "v"
+ITEMS = "it"            # [[variant_id, quantity], ...]
+UPDATED_AT = "ua"
+
+DUPLICATE_KEY = 11000
+
+VARIANTS_QUERY = """
+query cartVariants($ids: [ID!]!) {
+    nodes(ids: $ids) {
+        ... on ProductVariant {
+            id
+            title
+            availableForSale
+            price {
+                amount
+                currencyCode
+            }
+            image {
+                url
+            }
+            product {
+                handle
+                title
+            }
+        }
+    }
+}
+"""
+
+
+class VariantInfo(NamedTuple):
+    handle: str
+    title: str
+    variant_title: str
+    price: int              # paise
+    currency: str
+    image: Optional[str]
+    available: bool
+
+
+class Cart:
+    __slots__ = ("id", "version", "items", "updated_at", "stored_version", "changes", "cleared")
+
+    def __init__(self, cart_id: str, version: int = 0, items: Optional[Dict[str, int]] = None,
+                 updated_at: Optional[datetime] = None):
+        self.id = cart_id
+        self.version = version
+        self.items: Dict[str, int] = items or {}
+        self.updated_at = updated_at or datetime.utcnow()
+        # Version last read from or written to Mongo, and the unflushed edits
+        # since then (variant id -> quantity, 0 = removed), for rebasing
+        self.stored_version = version
+        self.changes: Dict[str, int] = {}
+        self.cleared = False
+
+    def rebase(self, doc: Optional[Dict[str, Any]]) -> None:
+        """Replay unflushed edits on top of the stored cart another worker wrote"""
+        stored = Cart.from_doc(doc) if doc is not None else Cart(self.id)
+        items = {} if self.cleared else stored.items
+        for variant_id, quantity in self.changes.items():
+            if quantity > 0:
+                items[variant_id] = quantity
+            else:
+                items.pop(variant_id, None)
+        self.items = dict(list(items.items())[:MAX_CART_LINES])
+        self.stored_version = stored.version
+        self.version = max(self.version, stored.version) + 1
+
+    def to_doc(self) -> Dict[str, Any]:
+        return {
+            "_id": self.id,
+            VERSION: self.version,
+            ITEMS: [[variant_id, quantity] for variant_id, quantity in self.items.items()],
+            UPDATED_AT: self.updated_at,
+        }
+
+    @classmethod
+    def from_doc(cls, doc: Dict[str, Any]) -> "Cart":
+        return cls(doc["_id"], doc.get(VERSION, 0), {v: q for v, q in doc.get(ITEMS, [])}, doc.get(UPDATED_AT))
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+def valid_session_id(session_id: Optional[str]) -> bool:
+    return bool(session_id) and CART_ID_PATTERN.match(session_id) is not None
+
+
+class CartStore:
+    def __init__(self, db, maxsize: int):
+        self._db = db
+        self._carts = LRUCache(maxsize=maxsize)
+        self._dirty: Dict[str, Cart] = {}
+        self._flush_lock = asyncio.Lock()
+
+    async def ensure_indexes(self) -> None:
+        await self._db.carts.create_index(UPDATED_AT, expireAfterSeconds=settings.CART_TTL_DAYS * 86400)
+
+    async def get(self, cart_id: str) -> Optional[Cart]:
+        cart = self._dirty.get(cart_id) or self._carts.get(cart_id)
+        if cart is None and self._db is not None:
+            doc = await self._db.carts.find_one({"_id": cart_id})
+            if doc is not None:
+                cart = Cart.from_doc(doc)
+                self._carts.set(cart_id, cart)
+        return cart
+
+    async def get_or_new(self, cart_id: str) -> Cart:
+        """Existing cart, or an empty one that is only stored once modified"""
+        return await self.get(cart_id) or Cart(cart_id)
+
+    def _touch(self, cart: Cart) -> Cart:
+        cart.version += 1
+        cart.updated_at = datetime.utcnow()
+        self._carts.set(cart.id, cart)
+        self._dirty[cart.id] = cart
+        return cart
+
+    def set_quantity(self, cart: Cart, variant_id: str, quantity: int) -> Cart:
+        variant_id = orders.compact_variant_id(variant_id)
+        if quantity <= 0:
+            cart.items.pop(variant_id, None)
+        else:
+            if variant_id not in cart.items and len(cart.items) >= MAX_CART_LINES:
+                raise ValueError(f"Cart cannot hold more than {MAX_CART_LINES} products")
+            cart.items[variant_id] = min(quantity, MAX_QUANTITY)
+        cart.changes[variant_id] = cart.items.get(variant_id, 0)
+        return self._touch(cart)
+
+    def add(self, cart: Cart, variant_id: str, quantity: int) -> Cart:
+        current = cart.items.get(orders.compact_variant_id(variant_id), 0)
+        return self.set_quantity(cart, variant_id, current + quantity)
+
+    def clear(self, cart: Cart) -> Cart:
+        cart.items.clear()
+        cart.changes.clear()
+        cart.cleared = True
+        return self._touch(cart)
+
+    async def flush(self) -> int:
+        """Upsert every dirty cart in one bulk_write; returns carts written.
+
+        Each replace only matches the version this worker last saw. If another
+        worker wrote the cart since, the upsert collides on _id and the cart
+        is rebased onto the stored one, to be written by the next flush.
+        """
+        if self._db is None or not self._dirty:
+            return 0
+        async with self._flush_lock:
+            batch = [(cart, cart.version) for cart in self._dirty.values()]
+            conflicts = set()
+            try:
+                await collection(self._db, "carts").bulk_write(
+                    [
+                        ReplaceOne({"_id": cart.id, VERSION: cart.stored_version}, cart.to_doc(), upsert=True)
+                        for cart, _ in batch
+                    ],
+                    ordered=False,
+                )
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                if any(error.get("code") != DUPLICATE_KEY for error in errors) or e.details.get("writeConcernErrors"):
+                    logger.error(f"Cart flush failed, will retry: {str(e)}")
+                    return 0
+                conflicts = {error["index"] for error in errors}
+            except Exception as e:
+                logger.error(f"Cart flush failed, will retry: {str(e)}")
+                return 0
+
+            for i, (cart, flushed_version) in enumerate(batch):
+                if i in conflicts:
+                    cart.rebase(await self._db.carts.find_one({"_id": cart.id}))
+                    continue
+                cart.stored_version = flushed_version
+                # Carts modified while the write was in flight stay dirty
+                if cart.version == flushed_version and self._dirty.get(cart.id) is cart:
+                    cart.changes.clear()
+                    cart.cleared = False
+                    del self._dirty[cart.id]
+            if conflicts:
+                logger.info(f"Rebased {len(conflicts)} carts changed by another worker")
+            return len(batch) - len(conflicts)
+
+
+# Variant id (numeric) -> VariantInfo, from the catalog snapshot and from fallback queries
+_catalog_variants: Dict[str, VariantInfo] = {}
+_fetched_variants = LRUCache(maxsize=settings.PRODUCT_CACHE_SIZE * 10, ttl=settings.PRODUCT_CACHE_TTL_SECONDS)
+
+# (cart id, cart version, catalog version) -> priced cart
+_priced = LRUCache(maxsize=settings.CART_CACHE_SIZE, ttl=settings.LIST_CACHE_TTL_SECONDS)
+
+
+def _variant_info(product_handle: str, product_title: str, variant: Dict[str, Any],
+                  image: Optional[str]) -> VariantInfo:
+    return VariantInfo(
+        handle=product_handle,
+        title=product_title,
+        variant_title=variant.get("title", ""),
+        price=orders.to_paise(float(variant["price"]["amount"])),
+        currency=variant["price"]["currencyCode"],
+        image=(variant.get("image") or {}).get("url") or image,
+        available=bool(variant.get("availableForSale")),
+    )
+
+
+def _product_variants(product: Dict[str, Any]) -> Iterable[Dict[str, Any]]:
+    return (edge["node"] for edge in product.get("variants", {}).get("edges", []))
+
+
+def on_product_change(old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]) -> None:
+    if old is not None:
+        for variant in _product_variants(old):
+            _catalog_variants.pop(orders.compact_variant_id(variant["id"]), None)
+    if new is not None:
+        images = new.get("images", {}).get("edges", [])
+        image = images[0]["node"]["url"] if images else None
+        for variant in _product_variants(new):
+            _catalog_variants[orders.compact_variant_id(variant["id"])] = _variant_info(
+                new["handle"], new["title"], variant, image
+            )
+
+
+async def variant_info(variant_ids: Iterable[str]) -> Dict[str, VariantInfo]:
+    """VariantInfo for compact variant ids; unknown ids are left out"""
+    found, missing = {}, []
+    for variant_id in variant_ids:
+        info = _catalog_variants.get(variant_id) or _fetched_variants.get(variant_id)
+        if info is None:
+            missing.append(variant_id)
+        else:
+            found[variant_id] = info
+    for i in range(0, len(missing), catalog.MAX_BATCH_HANDLES):
+        ids = [orders.expand_variant_id(v) for v in missing[i:i + catalog.MAX_BATCH_HANDLES]]
+        data = await catalog.storefront(VARIANTS_QUERY, {"ids": ids})
+        for node in data["nodes"]:
+            if not node or "product" not in node:
+                continue
+            info = _variant_info(node["product"]["handle"], node["product"]["title"], node, None)
+            variant_id = orders.compact_variant_id(node["id"])
+            _fetched_variants.set(variant_id, info)
+            found[variant_id] = info
+    return found
+
+
+def _available(variant_id: str, info: VariantInfo) -> bool:
+    """Stock from the availability layer; the catalog's flag only when it has none"""
+    level = availability.stock.get(orders.expand_variant_id(variant_id))
+    if level is None or level.get("availableForSale") is None:
+        return info.available
+    return bool(level["availableForSale"])
+
+
+async def price(cart: Cart) -> Dict[str, Any]:
+    """Cart lines joined with current prices, amounts in paise.
+
+    Variants that no longer exist go to `unavailable`; sold-out ones stay in
+    `items` with available=False so the cart can show them.
+    """
+    key = (cart.id, cart.version, catalog_sync.version, availability.version)
+    priced = _priced.get(key)
+    if priced is not None:
+        return priced
+
+    infos = await variant_info(cart.items)
+    availability.touch({info.handle for info in infos.values()})
+    lines, unavailable, subtotal, currency = [], [], 0, "INR"
+    for variant_id, quantity in cart.items.items():
+        info = infos.get(variant_id)
+        if info is None:
+            unavailable.append(orders.expand_variant_id(variant_id))
+            continue
+        line_total = info.price * quantity
+        subtotal += line_total
+        currency = info.currency
+        lines.append({
+            "variant_id": orders.expand_variant_id(variant_id),
+            "quantity": quantity,
+            "unit_price": info.price,
+            "line_total": line_total,
+            "title": info.title,
+            "variant_title": info.variant_title,
+            "handle": info.handle,
+            "image": info.image,
+            "available": _available(variant_id, info),
+        })
+
+    priced = {
+        "id": cart.id,
+        "version": cart.version,
+        "items": lines,
+        "unavailable": unavailable,
+        "item_count": sum(line["quantity"] for line in lines),
+        "subtotal": subtotal,
+        "currency": currency,
+    }
+    _priced.set(key, priced)
+    return priced
+
+
+def line_title(line: Dict[str, Any]) -> str:
+    variant_title = line.get("variant_title")
+    if variant_title and variant_title != "Default Title":
+        return f"{line['title']} - {variant_title}"
+    return line["title"]
+
+
+def order_items(priced: Dict[str, Any]) -> List[list]:
+    """Compact order lines ([variant_id, quantity, paise, title]) for a priced cart"""
+    return [
+        [orders.compact_variant_id(line["variant_id"]), line["quantity"], line["unit_price"], line_title(line)]
+        for line in priced["items"]
+    ]
+
+
+catalog_sync.add_listener(on_product_change)
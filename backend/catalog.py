@@ -0,0 +1,255 @@
+"""Shopify Storefront catalog access with a per-handle product cache.
+
+Every product returned by the list endpoint is written into the cache, so
+product pages are usually served without waiting on Shopify. Misses for a
+single handle are coalesced; batch misses are fetched in one query
+(`nodes` for handles whose id we know, aliased `productByHandle` otherwise).
+"""
+import asyncio
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+from fastapi import HTTPException
+
+import images
+from cache import LRUCache
+from compression import CompressedPayload
+from config import settings
+from log_config import upstream
+from tracing import span
+
+PRODUCT_FIELDS = """
+fragment ProductFields on Product {
+    id
+    title
+    handle
+    description
+    vendor
+    productType
+    tags
+    createdAt
+    updatedAt
+    images(first: 5) {
+        edges {
+            node {
+                id
+                url
+                altText
+                width
+                height
+            }
+        }
+    }
+    variants(first: 10) {
+        edges {
+            node {
+                id
+                title
+                price {
+                    amount
+                    currencyCode
+                }
+                compareAtPrice {
+                    amount
+                    currencyCode
+                }
+                availableForSale
+                quantityAvailable
+                selectedOptions {
+                    name
+                    value
+                }
+            }
+        }
+    }
+}
+"""
+
+MAX_BATCH_HANDLES = 50
+
+product_cache = LRUCache(maxsize=settings.PRODUCT_CACHE_SIZE, ttl=settings.PRODUCT_CACHE_TTL_SECONDS)
+
+# Serialized API responses, compressed once: ("product", handle) / ("products", query key)
+response_cache = LRUCache(maxsize=settings.RESPONSE_CACHE_SIZE, ttl=settings.LIST_CACHE_TTL_SECONDS)
+
+# Response cache keys that embed each product, for push invalidation. Keys
+# the LRU has since evicted are swept out once the index doubles in size.
+_keys_by_handle: Dict[str, set] = {}
+_indexed = 0
+_sweep_at = settings.RESPONSE_CACHE_SIZE * 20
+
+# Shopify product id per handle, remembered so batch misses can use `nodes`
+_ids_by_handle: Dict[str, str] = {}
+_inflight: Dict[str, asyncio.Future] = {}
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(timeout=30.0)
+    return _http_client
+
+
+async def close() -> None:
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+async def storefront(query: str, variables: Dict[str, Any]) -> Dict[str, Any]:
+    """POST a Storefront GraphQL query and return its `data`"""
+    with upstream("shopify"), span("shopify.storefront", **{"graphql.query_size": len(query)}):
+        response = await http_client().post(
+            f"https://{settings.SHOPIFY_STORE_DOMAIN}/api/{settings.SHOPIFY_API_VERSION}/graphql.json",
+            headers={
+                "Content-Type": "application/json",
+                "X-Shopify-Storefront-Access-Token": settings.SHOPIFY_STOREFRONT_ACCESS_TOKEN
+            },
+            json={"query": query, "variables": variables},
+        )
+
+    if response.status_code != 200:
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=f"Shopify API error: {response.text}"
+        )
+
+    result = response.json()
+
+    if "errors" in result:
+        raise HTTPException(status_code=400, detail=result["errors"])
+
+    return result["data"]
+
+
+def warm(products: Iterable[Dict[str, Any]]) -> None:
+    """Cache full product nodes, e.g. those returned by the list endpoint.
+
+    Image nodes are annotated in place with their responsive image set first.
+    """
+    products = list(products)
+    images.annotate(products)
+    for product in products:
+        if product and product.get("handle"):
+            if product_cache.get(product["handle"]) != product:
+                response_cache.pop(("product", product["handle"]))
+            product_cache.set(product["handle"], product)
+            _ids_by_handle[product["handle"]] = product["id"]
+
+
+def cached_response(key: tuple) -> Optional[CompressedPayload]:
+    return response_cache.get(key)
+
+
+def store_response(key: tuple, response: Dict[str, Any], ttl: Optional[float] = None,
+                   handles: Iterable[str] = ()) -> CompressedPayload:
+    """Serialize and compress `response` once and keep it under `key`.
+
+    `handles` are the products embedded in it; invalidate_handles() drops
+    every cached response that contains one of them.
+    """
+    global _indexed
+    payload = CompressedPayload(response)
+    response_cache.set(key, payload, ttl=ttl)
+    for handle in handles:
+        keys = _keys_by_handle.setdefault(handle, set())
+        if key not in keys:
+            keys.add(key)
+            _indexed += 1
+    if _indexed > _sweep_at:
+        _sweep_index()
+    return payload
+
+
+def _sweep_index() -> None:
+    """Drop index entries for responses the LRU has evicted"""
+    global _indexed, _sweep_at
+    live = set(response_cache.keys())
+    for handle in list(_keys_by_handle):
+        keys = _keys_by_handle[handle] & live
+        if keys:
+            _keys_by_handle[handle] = keys
+        else:
+            del _keys_by_handle[handle]
+    _indexed = sum(len(keys) for keys in _keys_by_handle.values())
+    _sweep_at = max(_indexed * 2, settings.RESPONSE_CACHE_SIZE * 20)
+
+
+def invalidate_handles(handles: Iterable[str]) -> None:
+    global _indexed
+    for handle in handles:
+        response_cache.pop(("product", handle))
+        keys = _keys_by_handle.pop(handle, ())
+        _indexed -= len(keys)
+        for key in keys:
+            response_cache.pop(key)
+
+
+async def _fetch_by_handles(handles: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+    known = [h for h in handles if h in _ids_by_handle]
+    unknown = [h for h in handles if h not in _ids_by_handle]
+
+    params, selections, variables = [], [], {}
+    if known:
+        params.append("$ids: [ID!]!")
+        selections.append("nodes(ids: $ids) { ... on Product { ...ProductFields } }")
+        variables["ids"] = [_ids_by_handle[h] for h in known]
+    for i, handle in enumerate(unknown):
+        params.append(f"$h{i}: String!")
+        selections.append(f"p{i}: productByHandle(handle: $h{i}) {{ ...ProductFields }}")
+        variables[f"h{i}"] = handle
+
+    query = f"query productsByHandle({', '.join(params)}) {{ {' '.join(selections)} }}" + PRODUCT_FIELDS
+    data = await storefront(query, variables)
+
+    found = [node for node in data.get("nodes", []) if node]
+    found += [data.get(f"p{i}") for i in range(len(unknown))]
+    warm(found)
+
+    by_handle = {product["handle"]: product for product in found if product}
+    return {handle: by_handle.get(handle) for handle in handles}
+
+
+async def get_products_by_handle(handles: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+    """Products for each handle (None when Shopify has no such product)"""
+    results = {handle: product_cache.get(handle) for handle in handles}
+    missing = [handle for handle, product in results.items() if product is None]
+    if missing:
+        results.update(await _fetch_by_handles(missing))
+    return results
+
+
+async def get_product(handle: str) -> Optional[Dict[str, Any]]:
+    product = product_cache.get(handle)
+    if product is not None:
+        return product
+
+    # Coalesce concurrent misses for the same handle into one upstream call
+    pending = _inflight.get(handle)
+    if pending is not None:
+        try:
+            return await asyncio.shield(pending)
+        except asyncio.CancelledError:
+            # The request that owned the fetch went away; take over unless we were cancelled too
+            if pending.cancelled() and not asyncio.current_task().cancelling():
+                return await get_product(handle)
+            raise
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[handle] = future
+    try:
+        product = (await _fetch_by_handles([handle]))[handle]
+        future.set_result(product)
+        return product
+    except Exception as e:
+        future.set_exception(e)
+        # Mark retrieved so a miss with no waiters doesn't log a warning
+        future.exception()
+        raise
+    finally:
+        if not future.done():
+            # Cancelled (client disconnect, timeout): release the waiters
+            future.cancel()
+        del _inflight[handle]
@@ -0,0 +1,182 @@
+"""In-memory snapshot of the whole Shopify catalog.
+
+A full sync pages through every product (250 per request). Incremental syncs
+ask only for products whose updated_at moved past the newest one seen.
+Derived indexes (facets, price index, ...) register a listener and receive
+(old, new) for every product that was added, changed or removed. Incremental
+updates therefore stay O(changed products). Deletions only show up on full
+syncs, which run every CATALOG_FULL_SYNC_EVERY passes.
+"""
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+import catalog
+import images
+
+logger = logging.getLogger(__name__)
+
+SYNC_PAGE_SIZE = 250
+
+SYNC_QUERY = """
+query syncProducts($first: Int!, $after: String, $query: String) {
+    products(first: $first, after: $after, query: $query, sortKey: UPDATED_AT) {
+        edges {
+            node {
+                ...ProductFields
+                collections(first: 20) {
+                    edges {
+                        node {
+                            handle
+                        }
+                    }
+                }
+            }
+        }
+        pageInfo {
+            hasNextPage
+            endCursor
+        }
+    }
+}
+""" + catalog.PRODUCT_FIELDS
+
+COLLECTIONS_QUERY = """
+query syncCollections($first: Int!, $after: String) {
+    collections(first: $first, after: $after) {
+        edges {
+            node {
+                id
+                title
+                handle
+                description
+                image {
+                    url
+                    altText
+                }
+            }
+        }
+        pageInfo {
+            hasNextPage
+            endCursor
+        }
+    }
+}
+"""
+
+# (old, new) -> None; old is None for new products, new is None for removed ones
+Listener = Callable[[Optional[Dict[str, Any]], Optional[Dict[str, Any]]], None]
+
+products: Dict[str, Dict[str, Any]] = {}
+collections: Dict[str, Dict[str, Any]] = {}
+version = 0
+
+_listeners: List[Listener] = []
+_last_updated_at: Optional[str] = None
+_loaded = asyncio.Event()
+_sync_lock = asyncio.Lock()
+_passes = 0
+
+
+def add_listener(listener: Listener) -> None:
+    """Register a derived index and replay the current snapshot into it"""
+    _listeners.append(listener)
+    for product in products.values():
+        listener(None, product)
+
+
+def product_collections(product: Dict[str, Any]) -> List[str]:
+    return [edge["node"]["handle"] for edge in product.get("collections", {}).get("edges", [])]
+
+
+async def _paginate(query: str, root: str, variables: Dict[str, Any]) -> List[Dict[str, Any]]:
+    nodes, after = [], None
+    while True:
+        data = await catalog.storefront(query, {**variables, "first": SYNC_PAGE_SIZE, "after": after})
+        page = data[root]
+        nodes.extend(edge["node"] for edge in page["edges"])
+        if not page["pageInfo"]["hasNextPage"]:
+            return nodes
+        after = page["pageInfo"]["endCursor"]
+
+
+def _apply(changed: List[Dict[str, Any]], removed: List[str]) -> int:
+    global version, _last_updated_at
+    # Annotate before comparing so unchanged products compare equal
+    images.annotate(changed)
+    events = []
+    for product in changed:
+        old = products.get(product["handle"])
+        if old != product:
+            events.append((old, product))
+            products[product["handle"]] = product
+    for handle in removed:
+        events.append((products.pop(handle), None))
+
+    for old, new in events:
+        for listener in _listeners:
+            try:
+                listener(old, new)
+            except Exception as e:
+                logger.error(f"Catalog listener {listener!r} failed: {str(e)}")
+
+    if changed:
+        newest = max(p["updatedAt"] for p in changed)
+        _last_updated_at = max(_last_updated_at or newest, newest)
+    if events:
+        version += 1
+        # The product cache holds plain ProductFields nodes, as the list endpoint returns
+        catalog.warm(
+            {key: value for key, value in new.items() if key != "collections"}
+            for _, new in events if new is not None
+        )
+    return len(events)
+
+
+async def _full_sync() -> int:
+    global version
+    fetched = await _paginate(SYNC_QUERY, "products", {"query": None})
+    collection_nodes = await _paginate(COLLECTIONS_QUERY, "collections", {})
+    fresh_collections = {c["handle"]: c for c in collection_nodes}
+    if fresh_collections != collections:
+        collections.clear()
+        collections.update(fresh_collections)
+        version += 1
+
+    seen = {p["handle"] for p in fetched}
+    changes = _apply(fetched, [handle for handle in products if handle not in seen])
+    _loaded.set()
+    return changes
+
+
+async def full_sync() -> int:
+    async with _sync_lock:
+        return await _full_sync()
+
+
+async def incremental_sync() -> int:
+    if _last_updated_at is None:
+        return await full_sync()
+    async with _sync_lock:
+        fetched = await _paginate(SYNC_QUERY, "products", {"query": f"updated_at:>'{_last_updated_at}'"})
+        return _apply(fetched, [])
+
+
+async def ensure_loaded() -> None:
+    """Wait for the first full sync, running it if nobody has yet"""
+    if _loaded.is_set():
+        return
+    async with _sync_lock:
+        if not _loaded.is_set():
+            await _full_sync()
+
+
+async def sync(full_every: int) -> int:
+    """Scheduled pass: a full sync every `full_every` passes, incremental otherwise"""
+    global _passes
+    full = _passes % full_every == 0
+    _passes += 1
+    changes = await (full_sync() if full else incremental_sync())
+    if changes:
+        logger.info(f"Catalog sync: {changes} product changes, {len(products)} products")
+    return changes
@@ -0,0 +1,156 @@
+"""Checkout request schemas.
+
+Models are strict (no str -> int coercion, no unknown fields), prices are
+integer paise and cart size is capped, so the worst-case cost of validating
+a request is bounded. Bodies are validated straight from bytes with
+model_validate_json. BodySizeLimitMiddleware rejects anything larger than
+MAX_CHECKOUT_BODY_BYTES before it is read into memory.
+
+Carts the server already holds are not validated again: with a cart_id the
+client-sent `cart` is dropped before validation, and verify-payment never
+looks at the cart (the order document already has its lines).
+
+    python bench_checkout.py   # validation throughput, target >= 10k carts/s
+"""
+import json
+import re
+from typing import Any, Callable, List, Optional, Type, TypeVar
+
+from fastapi import HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, model_validator
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+MAX_CART_LINES = 50
+MAX_QUANTITY = 99
+CART_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+Model = TypeVar("Model", bound=BaseModel)
+
+
+class CheckoutModel(BaseModel):
+    model_config = ConfigDict(strict=True, extra="forbid")
+
+
+class CartItem(CheckoutModel):
+    id: str = Field(min_length=1, max_length=100)
+    title: str = Field(max_length=255)
+    quantity: int = Field(ge=1, le=MAX_QUANTITY)
+    price: int = Field(ge=0)  # unit price in paise
+    handle: str = Field(max_length=255)
+
+
+class ShippingAddress(CheckoutModel):
+    name: str = Field(min_length=1, max_length=100)
+    phone: str = Field(pattern=r"^\+?[0-9 -]{7,15}$")
+    email: Optional[str] = Field(None, max_length=254)
+    line1: str = Field(min_length=1, max_length=200)
+    line2: Optional[str] = Field(None, max_length=200)
+    city: str = Field(min_length=1, max_length=100)
+    state: str = Field(min_length=1, max_length=100)
+    pincode: str = Field(pattern=r"^[1-9][0-9]{5}$")
+    country: str = Field("India", max_length=60)
+
+
+class CreateOrderRequest(CheckoutModel):
+    amount: Optional[int] = Field(None, ge=100)  # paise; priced server-side when cart_id is sent
+    currency: str = Field("INR", pattern=r"^[A-Z]{3}$")
+    cart: List[CartItem] = Field([], max_length=MAX_CART_LINES)
+    cart_id: Optional[str] = Field(None, pattern=CART_ID_PATTERN.pattern)
+    shipping_address: Optional[ShippingAddress] = None
+
+    @model_validator(mode="before")
+    @classmethod
+    def skip_known_cart(cls, data: Any) -> Any:
+        # The stored cart is authoritative; don't pay to validate a client copy
+        if isinstance(data, dict) and data.get("cart_id") and "cart" in data:
+            data = {k: v for k, v in data.items() if k != "cart"}
+        return data
+
+
+class VerifyPaymentRequest(CheckoutModel):
+    # Older clients still send the cart; it is ignored without being validated
+    model_config = ConfigDict(strict=True, extra="ignore")
+
+    razorpay_order_id: str = Field(pattern=r"^order_[A-Za-z0-9]{1,40}$")
+    razorpay_payment_id: str = Field(pattern=r"^pay_[A-Za-z0-9]{1,40}$")
+    razorpay_signature: str = Field(pattern=r"^[0-9a-f]{64}$")
+    cart_id: Optional[str] = Field(None, pattern=CART_ID_PATTERN.pattern)
+
+
+class ShippingOrderRequest(CheckoutModel):
+    order_id: str = Field(pattern=r"^order_[A-Za-z0-9]{1,40}$")
+    shipping_address: Optional[ShippingAddress] = None
+
+
+class CartLineRequest(CheckoutModel):
+    variant_id: str = Field(min_length=1, max_length=100)
+    quantity: int = Field(1, ge=0, le=MAX_QUANTITY)
+
+
+def body(model: Type[Model]) -> Callable:
+    """Dependency validating the raw request body against `model` in one pass"""
+
+    async def dependency(request: Request) -> Model:
+        raw = await request.body()
+        try:
+            return model.model_validate_json(raw or b"{}")
+        except ValidationError as e:
+            raise RequestValidationError(e.errors(include_url=False))
+
+    dependency.__name__ = f"{model.__name__}_body"
+    return dependency
+
+
+def openapi_body(model: Type[BaseModel]) -> dict:
+    """openapi_extra documenting a body read through body()"""
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": model.model_json_schema()}}}}
+
+
+class BodySizeLimitMiddleware:
+    """413 for request bodies over `max_bytes` on the given path prefixes"""
+
+    def __init__(self, app: ASGIApp, max_bytes: int, paths: tuple):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.paths = paths
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+
+        too_large = JSONResponse({"detail": "Request body too large"}, status_code=413)
+        length = Headers(scope=scope).get("content-length")
+        if length is not None and length.isdigit() and int(length) > self.max_bytes:
+            await too_large(scope, receive, send)
+            return
+
+        # Chunked or lying clients: count as the body streams in
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise HTTPException(status_code=413, detail="Request body too large")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def sample_cart(lines: int = 10) -> str:
+    """JSON body of a create-order request with `lines` items, for benchmarks"""
+    return json.dumps({
+        "amount": 129900 * lines,
+        "currency": "INR",
+        "cart": [
+            {"id": f"gid://shopify/ProductVariant/{4000000000 + i}", "title": f"Handloom Saree {i}",
+             "quantity": 1 + i % 3, "price": 129900, "handle": f"handloom-saree-{i}"}
+            for i in range(lines)
+        ],
+    })
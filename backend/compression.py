@@ -0,0 +1,137 @@
+"""Response compression: precompressed JSON payloads, Accept-Encoding
+negotiation and a middleware for everything else.
+
+brotli is optional; without it only gzip (and identity) are offered.
+"""
+import gzip
+import json
+from typing import Any, Dict, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - optional dependency
+    brotli = None
+
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def dumps(payload: Any) -> bytes:
+    return json.dumps(payload, separators=(",", ":"), default=str).encode()
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+    raise ValueError(f"Unsupported encoding: {encoding}")
+
+
+def supported_encodings():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick the best encoding we support from an Accept-Encoding header"""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    for encoding in supported_encodings():
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return None
+
+
+class CompressedPayload:
+    """A JSON body encoded once, with every supported compression precomputed"""
+
+    def __init__(self, payload: Any):
+        self.body = dumps(payload)
+        self.encoded: Dict[str, bytes] = {
+            encoding: compress(self.body, encoding) for encoding in supported_encodings()
+        }
+
+    def select(self, accept_encoding: Optional[str]):
+        """(body, content_encoding) for a request's Accept-Encoding"""
+        encoding = negotiate(accept_encoding)
+        if encoding is None:
+            return self.body, None
+        return self.encoded[encoding], encoding
+
+
+def payload_response(payload: CompressedPayload, accept_encoding: Optional[str],
+                     cache_control: Optional[str] = None) -> Response:
+    """Response carrying the precompressed variant a client accepts"""
+    body, encoding = payload.select(accept_encoding)
+    headers = {"Vary": "Accept-Encoding"}
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    if cache_control:
+        headers["Cache-Control"] = cache_control
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+class CompressionMiddleware:
+    """gzip/brotli for buffered responses of at least `minimum_size` bytes.
+
+    Responses that already carry Content-Encoding (precompressed cache
+    entries) and streaming responses pass through untouched.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Dict[str, Any] = {}
+        passthrough = False
+
+        async def send_compressed(message: Message) -> None:
+            nonlocal start_message, passthrough
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            headers = MutableHeaders(raw=start_message["headers"])
+            body = message.get("body", b"")
+            if ("content-encoding" in headers or message.get("more_body", False)
+                    or len(body) < self.minimum_size):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_compressed)
@@ -0,0 +1,124 @@
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+from pydantic_settings import BaseSettings
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+# Configuration Settings
+class Settings(BaseSettings):
+    MONGO_URL: str = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+    DB_NAME: str = os.getenv("DB_NAME", "undhyu_db")
+    SHOPIFY_STORE_DOMAIN: str = os.getenv("SHOPIFY_STORE_DOMAIN", "j0dktb-z1.myshopify.com")
+    SHOPIFY_STOREFRONT_ACCESS_TOKEN: str = os.getenv("SHOPIFY_STOREFRONT_ACCESS_TOKEN", "")
+    SHOPIFY_API_VERSION: str = os.getenv("SHOPIFY_API_VERSION", "2024-01")
+    RAZORPAY_KEY_ID: str = os.getenv("RAZORPAY_KEY_ID", "")
+    RAZORPAY_KEY_SECRET: str = os.getenv("RAZORPAY_KEY_SECRET", "")
+    RAZORPAY_WEBHOOK_SECRET: str = os.getenv("RAZORPAY_WEBHOOK_SECRET", "")
+    # Admin API token for creating orders after payment
+    SHOPIFY_ADMIN_ACCESS_TOKEN: str = os.getenv("SHOPIFY_ADMIN_ACCESS_TOKEN", "")
+    SHOPIFY_ADMIN_BASE_URL: str = os.getenv(
+        "SHOPIFY_ADMIN_BASE_URL",
+        f"https://{os.getenv('SHOPIFY_STORE_DOMAIN', 'j0dktb-z1.myshopify.com')}/admin/api/{os.getenv('SHOPIFY_API_VERSION', '2024-01')}",
+    )
+    SHIPROCKET_EMAIL: str = os.getenv("SHIPROCKET_EMAIL", "")
+    SHIPROCKET_PASSWORD: str = os.getenv("SHIPROCKET_PASSWORD", "")
+    SHIPROCKET_BASE_URL: str = os.getenv("SHIPROCKET_BASE_URL", "https://apiv2.shiprocket.in")
+    SHIPROCKET_PICKUP_LOCATION: str = os.getenv("SHIPROCKET_PICKUP_LOCATION", "Primary")
+    SHIPROCKET_PACKAGE_CM: str = os.getenv("SHIPROCKET_PACKAGE_CM", "30x25x5")  # length x breadth x height
+    SHIPROCKET_PACKAGE_WEIGHT_KG: float = float(os.getenv("SHIPROCKET_PACKAGE_WEIGHT_KG", 0.5))
+    # Outbox dispatcher for post-payment side effects
+    OUTBOX_CONCURRENCY: int = int(os.getenv("OUTBOX_CONCURRENCY", 4))
+    OUTBOX_MAX_ATTEMPTS: int = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 8))
+    OUTBOX_RETRY_BASE_SECONDS: float = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", 30))
+    OUTBOX_POLL_SECONDS: float = float(os.getenv("OUTBOX_POLL_SECONDS", 5))
+    # Shipment tracking refresh (0 disables the poller; lookups still read the local store)
+    TRACKING_POLL_SECONDS: int = int(os.getenv("TRACKING_POLL_SECONDS", 60))
+    TRACKING_BATCH_SIZE: int = int(os.getenv("TRACKING_BATCH_SIZE", 50))
+    # FX table for ?currency= prices and non-INR checkout; the file is re-read when it changes (0 = load once)
+    FX_BASE_CURRENCY: str = os.getenv("FX_BASE_CURRENCY", "INR")
+    FX_RATES_FILE: str = os.getenv("FX_RATES_FILE", "fx_rates.json")
+    FX_REFRESH_SECONDS: int = int(os.getenv("FX_REFRESH_SECONDS", 300))
+    # Probe endpoints read cached dependency checks; only HEALTH_REQUIRED ones affect readiness
+    HEALTH_CHECK_SECONDS: int = int(os.getenv("HEALTH_CHECK_SECONDS", 10))
+    HEALTH_CHECK_TIMEOUT_SECONDS: float = float(os.getenv("HEALTH_CHECK_TIMEOUT_SECONDS", 3))
+    HEALTH_REQUIRED: str = os.getenv("HEALTH_REQUIRED", "mongo")  # comma-separated: mongo,shopify,razorpay
+    RAZORPAY_HEALTH_URL: str = os.getenv("RAZORPAY_HEALTH_URL", "https://api.razorpay.com/v1")
+    # Startup cache warmup from the most requested /api/products queries
+    WARMUP_KEYS: int = int(os.getenv("WARMUP_KEYS", 200))
+    WARMUP_RATE_PER_SECOND: float = float(os.getenv("WARMUP_RATE_PER_SECOND", 5))
+    WARMUP_MAX_SECONDS: float = float(os.getenv("WARMUP_MAX_SECONDS", 60))
+    WARMUP_PERSIST_SECONDS: int = int(os.getenv("WARMUP_PERSIST_SECONDS", 300))
+    WARMUP_KEY_TTL_DAYS: int = int(os.getenv("WARMUP_KEY_TTL_DAYS", 7))
+    WARMUP_FILE: str = os.getenv("WARMUP_FILE", "warm_keys.json")
+    PRODUCT_CACHE_SIZE: int = int(os.getenv("PRODUCT_CACHE_SIZE", 5000))
+    # Products are cached long; stock is layered on from the availability cache
+    PRODUCT_CACHE_TTL_SECONDS: int = int(os.getenv("PRODUCT_CACHE_TTL_SECONDS", 1800))
+    AVAILABILITY_TTL_SECONDS: int = int(os.getenv("AVAILABILITY_TTL_SECONDS", 60))
+    AVAILABILITY_POLL_SECONDS: int = int(os.getenv("AVAILABILITY_POLL_SECONDS", 30))
+    AVAILABILITY_CACHE_SIZE: int = int(os.getenv("AVAILABILITY_CACHE_SIZE", 50000))
+    AVAILABILITY_HOT_PRODUCTS: int = int(os.getenv("AVAILABILITY_HOT_PRODUCTS", 1000))
+    AVAILABILITY_HOT_SECONDS: int = int(os.getenv("AVAILABILITY_HOT_SECONDS", 600))
+    SHOPIFY_WEBHOOK_SECRET: str = os.getenv("SHOPIFY_WEBHOOK_SECRET", os.getenv("SHOPIFY_API_SECRET", ""))
+    RESPONSE_CACHE_SIZE: int = int(os.getenv("RESPONSE_CACHE_SIZE", 2000))
+    LIST_CACHE_TTL_SECONDS: int = int(os.getenv("LIST_CACHE_TTL_SECONDS", 60))
+    COMPRESSION_MIN_SIZE: int = int(os.getenv("COMPRESSION_MIN_SIZE", 1024))
+    # Full-catalog snapshot behind facets and local filtering (0 disables the background sync)
+    CATALOG_SYNC_INTERVAL_SECONDS: int = int(os.getenv("CATALOG_SYNC_INTERVAL_SECONDS", 300))
+    CATALOG_FULL_SYNC_EVERY: int = int(os.getenv("CATALOG_FULL_SYNC_EVERY", 12))
+    HOMEPAGE_TTL_SECONDS: int = int(os.getenv("HOMEPAGE_TTL_SECONDS", 120))
+    # Per-client rate limiting; backend "memory" (per worker) or "mongo" (shared)
+    RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+    RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "memory")
+    TRUST_PROXY_HEADERS: bool = os.getenv("TRUST_PROXY_HEADERS", "false").lower() == "true"
+    # Proxies in front of the app that append to X-Forwarded-For; the client is that many entries from the right
+    TRUSTED_PROXY_HOPS: int = int(os.getenv("TRUSTED_PROXY_HOPS", 1))
+    # Comma-separated X-API-Key values that get their own bucket; other requests are limited by IP
+    RATE_LIMIT_API_KEYS: str = os.getenv("RATE_LIMIT_API_KEYS", "")
+    # Write concern "w" for telemetry collections (0 = unacknowledged)
+    TELEMETRY_WRITE_W: int = int(os.getenv("TELEMETRY_WRITE_W", 0))
+    # Rewrite legacy order documents into the compact schema in the background (a no-op once done)
+    ORDER_MIGRATION_ON_STARTUP: bool = os.getenv("ORDER_MIGRATION_ON_STARTUP", "true").lower() == "true"
+    # Stale-order reconciliation (0 disables the background task)
+    RECONCILE_INTERVAL_SECONDS: int = int(os.getenv("RECONCILE_INTERVAL_SECONDS", 0))
+    RECONCILE_STALE_MINUTES: int = int(os.getenv("RECONCILE_STALE_MINUTES", 30))
+    RECONCILE_CONCURRENCY: int = int(os.getenv("RECONCILE_CONCURRENCY", 8))
+    RAZORPAY_MAX_RPS: float = float(os.getenv("RAZORPAY_MAX_RPS", 10))
+    # Checkout and cart requests larger than this are rejected with 413
+    MAX_CHECKOUT_BODY_BYTES: int = int(os.getenv("MAX_CHECKOUT_BODY_BYTES", 32768))
+    # Server-side carts: in-memory LRU, written behind to Mongo
+    CART_CACHE_SIZE: int = int(os.getenv("CART_CACHE_SIZE", 10000))
+    CART_FLUSH_SECONDS: float = float(os.getenv("CART_FLUSH_SECONDS", 2))
+    CART_TTL_DAYS: int = int(os.getenv("CART_TTL_DAYS", 30))
+    # JSON logs; successful requests are sampled, errors are always logged
+    LOG_LEVEL: str = os.getenv("LOG_LEVEL", "INFO")
+    LOG_SAMPLE_RATE: float = float(os.getenv("LOG_SAMPLE_RATE", 0.1))
+    # Tracing: fraction of new traces sampled; exporter "memory", "file" or "none"
+    TRACE_SAMPLE_RATE: float = float(os.getenv("TRACE_SAMPLE_RATE", 0.01))
+    TRACE_EXPORTER: str = os.getenv("TRACE_EXPORTER", "memory")
+    TRACE_FILE: str = os.getenv("TRACE_FILE", "traces.jsonl")
+    TRACE_BUFFER_SIZE: int = int(os.getenv("TRACE_BUFFER_SIZE", 10000))
+    # Log event-loop stalls longer than this, with the blocking stack (0 disables)
+    LOOP_LAG_THRESHOLD_MS: int = int(os.getenv("LOOP_LAG_THRESHOLD_MS", 100))
+    PROFILE_MAX_SECONDS: int = int(os.getenv("PROFILE_MAX_SECONDS", 60))
+    # Auth: HS256 signing key (required unless APP_ENV=development), token lifetime and caches
+    APP_ENV: str = os.getenv("APP_ENV", "production")
+    JWT_SECRET: str = os.getenv("JWT_SECRET", "")
+    JWT_TTL_MINUTES: int = int(os.getenv("JWT_TTL_MINUTES", 7 * 24 * 60))
+    AUTH_CACHE_SIZE: int = int(os.getenv("AUTH_CACHE_SIZE", 10000))
+    AUTH_REVOCATION_REFRESH_SECONDS: int = int(os.getenv("AUTH_REVOCATION_REFRESH_SECONDS", 30))
+    AUTH_HASH_THREADS: int = int(os.getenv("AUTH_HASH_THREADS", 4))
+    PASSWORD_HASH_ROUNDS: int = int(os.getenv("PASSWORD_HASH_ROUNDS", 12))
+    # Bootstrap admin account, created at startup if missing
+    ADMIN_EMAIL: str = os.getenv("ADMIN_EMAIL", "")
+    ADMIN_PASSWORD: str = os.getenv("ADMIN_PASSWORD", "")
+    PORT: int = int(os.getenv("PORT", 8001))
+    
+    class Config:
+        env_file = ".env"
+        # .env also carries keys used outside this app (e.g. SHOPIFY_API_KEY)
+        extra = "ignore"
+
+settings = Settings()
@@ -0,0 +1,145 @@
+"""Display and checkout prices in other currencies.
+
+Rates come from FX_RATES_FILE, a JSON table relative to the store currency:
+
+    {"base": "INR", "as_of": "2026-10-19", "rates": {"USD": 0.01198, "EUR": 0.01102}}
+
+A scheduled job reloads the file when its mtime changes, so the rates can be
+updated by whatever process writes the file without a restart. Each load
+bumps the table version.
+
+Catalog responses are never fetched per currency. A converted response is
+made from the cached store-currency payload. The conversion walks the
+response once to collect every Money node ({amount, currencyCode}) and
+rewrites them as a batch with one rate per source currency. The result is
+cached under (key, currency, table version) and registered against the same
+product handles, so stock and catalog invalidations drop it as well.
+"""
+import json
+import logging
+import os
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import catalog
+from compression import CompressedPayload
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# ISO 4217 minor units where they differ from 2
+MINOR_UNITS = {
+    "JPY": 0, "KRW": 0, "VND": 0, "CLP": 0, "ISK": 0, "UGX": 0,
+    "BHD": 3, "KWD": 3, "OMR": 3, "JOD": 3, "TND": 3,
+}
+
+
+class FxTable(NamedTuple):
+    base: str
+    rates: Dict[str, float]     # units of currency per 1 base
+    as_of: Optional[str]
+    version: int
+
+
+_table = FxTable(settings.FX_BASE_CURRENCY, {settings.FX_BASE_CURRENCY: 1.0}, None, 0)
+_mtime: Optional[float] = None
+
+
+def minor_units(code: str) -> int:
+    return MINOR_UNITS.get(code, 2)
+
+
+def table() -> FxTable:
+    return _table
+
+
+def supported(code: str) -> bool:
+    return code in _table.rates
+
+
+def load(path: str) -> int:
+    """(Re)load the rate table if the file changed; returns rates loaded, 0 if unchanged"""
+    global _table, _mtime
+    try:
+        mtime = os.stat(path).st_mtime
+    except FileNotFoundError:
+        return 0
+    if mtime == _mtime:
+        return 0
+    with open(path) as f:
+        data = json.load(f)
+    base = data.get("base", settings.FX_BASE_CURRENCY)
+    rates = {code: float(rate) for code, rate in data["rates"].items()}
+    invalid = [code for code, rate in rates.items() if rate <= 0 or len(code) != 3]
+    if invalid:
+        raise ValueError(f"Invalid FX rates for {', '.join(invalid)}")
+    rates[base] = 1.0
+    _table = FxTable(base, rates, data.get("as_of"), _table.version + 1)
+    _mtime = mtime
+    logger.info(f"Loaded {len(rates)} FX rates (base {base}, as of {_table.as_of})")
+    return len(rates)
+
+
+def rate(source: str, target: str) -> float:
+    """Multiplier from source to target units; ValueError for unknown currencies"""
+    try:
+        return _table.rates[target] / _table.rates[source]
+    except KeyError as e:
+        raise ValueError(f"No FX rate for {e.args[0]}")
+
+
+def convert_minor(amount: int, source: str, target: str) -> int:
+    """Convert an amount in minor units (e.g. paise) between currencies"""
+    if source == target:
+        return amount
+    major = amount / 10 ** minor_units(source) * rate(source, target)
+    return round(major * 10 ** minor_units(target))
+
+
+def money_nodes(response: Any) -> List[Dict[str, Any]]:
+    """Every {amount, currencyCode} dict in a response, found in one pass"""
+    found, stack = [], [response]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            if "currencyCode" in node and "amount" in node:
+                found.append(node)
+            else:
+                stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+    return found
+
+
+def convert_response(response: Dict[str, Any], target: str) -> Dict[str, Any]:
+    """Rewrite every price in `response` (in place) into `target`"""
+    nodes = money_nodes(response)
+    factors: Dict[str, Tuple[float, int]] = {}
+    digits = minor_units(target)
+    for node in nodes:
+        source = node["currencyCode"]
+        if source not in factors:
+            factors[source] = (rate(source, target), digits)
+    for node in nodes:
+        factor, digits = factors[node["currencyCode"]]
+        node["amount"] = f"{float(node['amount']) * factor:.{digits}f}"
+        node["currencyCode"] = target
+    response["fx"] = {"currency": target, "base": _table.base, "as_of": _table.as_of}
+    return response
+
+
+def converted_payload(key: tuple, payload: CompressedPayload, target: str,
+                      ttl: Optional[float] = None) -> CompressedPayload:
+    """`payload` (a cached store-currency response) in `target`, cached per FX table version"""
+    converted_key = ("fx", target, _table.version) + key
+    cached = catalog.cached_response(converted_key)
+    if cached is not None:
+        return cached
+    response = convert_response(json.loads(payload.body), target)
+    products = response.get("products") or ([response["product"]] if response.get("product") else [])
+    handles = [product["handle"] for product in products if isinstance(product, dict) and "handle" in product]
+    return catalog.store_response(converted_key, response, ttl=ttl, handles=handles)
+
+
+async def reload() -> int:
+    """Scheduled job: pick up a changed rates file"""
+    return load(settings.FX_RATES_FILE)
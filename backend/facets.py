@@ -0,0 +1,130 @@
+"""Precomputed filter facets over the catalog snapshot.
+
+Counts by collection, vendor, productType, tag and price bucket are kept
+per scope: the whole catalog (scope None) and each collection. They are
+updated incrementally from catalog_sync change events. Serialized responses
+are cached until the next change, so filter sidebars never scan the catalog.
+"""
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import catalog_sync
+from compression import CompressedPayload
+
+# Upper bounds (INR) of the price buckets; the last bucket is open-ended
+PRICE_BUCKETS = [500, 1000, 2000, 5000, 10000]
+
+
+def product_price(product: Dict[str, Any]) -> Optional[float]:
+    """Lowest variant price, the price a listing shows"""
+    prices = [float(edge["node"]["price"]["amount"]) for edge in product.get("variants", {}).get("edges", [])]
+    return min(prices) if prices else None
+
+
+def price_bucket(price: float) -> int:
+    for i, upper in enumerate(PRICE_BUCKETS):
+        if price < upper:
+            return i
+    return len(PRICE_BUCKETS)
+
+
+class FacetCounts:
+    def __init__(self):
+        self.total = 0
+        self.collections: Counter = Counter()
+        self.vendors: Counter = Counter()
+        self.product_types: Counter = Counter()
+        self.tags: Counter = Counter()
+        self.price_buckets: Counter = Counter()
+        self.prices: Counter = Counter()
+
+    def update(self, product: Dict[str, Any], sign: int) -> None:
+        self.total += sign
+        for handle in catalog_sync.product_collections(product):
+            self.collections[handle] += sign
+        if product.get("vendor"):
+            self.vendors[product["vendor"]] += sign
+        if product.get("productType"):
+            self.product_types[product["productType"]] += sign
+        for tag in product.get("tags", []):
+            self.tags[tag] += sign
+        price = product_price(product)
+        if price is not None:
+            self.price_buckets[price_bucket(price)] += sign
+            self.prices[price] += sign
+
+    def to_dict(self) -> Dict[str, Any]:
+        def positive(counter: Counter) -> Dict[str, int]:
+            return {key: n for key, n in counter.most_common() if n > 0}
+
+        prices = [price for price, n in self.prices.items() if n > 0]
+        bounds = [0] + PRICE_BUCKETS + [None]
+        return {
+            "total": self.total,
+            "collections": positive(self.collections),
+            "vendors": positive(self.vendors),
+            "productTypes": positive(self.product_types),
+            "tags": positive(self.tags),
+            "priceBuckets": [
+                {"min": bounds[i], "max": bounds[i + 1], "count": self.price_buckets[i]}
+                for i in range(len(bounds) - 1) if self.price_buckets[i] > 0
+            ],
+            "priceRange": {"min": min(prices), "max": max(prices)} if prices else None,
+        }
+
+
+_scopes: Dict[Optional[str], FacetCounts] = {None: FacetCounts()}
+_payloads: Dict[Any, CompressedPayload] = {}
+_payload_version = -1
+
+
+def _scopes_for(product: Dict[str, Any]) -> List[Optional[str]]:
+    return [None] + catalog_sync.product_collections(product)
+
+
+def on_product_change(old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]) -> None:
+    if old is not None:
+        for scope in _scopes_for(old):
+            _scopes[scope].update(old, -1)
+    if new is not None:
+        for scope in _scopes_for(new):
+            _scopes.setdefault(scope, FacetCounts()).update(new, +1)
+
+
+def _cached(key: Any, build) -> CompressedPayload:
+    global _payload_version
+    if _payload_version != catalog_sync.version:
+        _payloads.clear()
+        _payload_version = catalog_sync.version
+    payload = _payloads.get(key)
+    if payload is None:
+        payload = _payloads[key] = CompressedPayload(build())
+    return payload
+
+
+def facets_payload(collection_handle: Optional[str] = None) -> CompressedPayload:
+    def build():
+        counts = _scopes.get(collection_handle) or FacetCounts()
+        return {"collection": collection_handle, "facets": counts.to_dict()}
+
+    if collection_handle not in _scopes:
+        # Unknown (or empty) collections aren't cached, so arbitrary handles can't grow _payloads
+        return CompressedPayload(build())
+    return _cached(("facets", collection_handle), build)
+
+
+def collections_payload() -> CompressedPayload:
+    def build():
+        counts = _scopes[None].collections
+        return {
+            "collections": [
+                {**collection, "productCount": counts.get(handle, 0)}
+                for handle, collection in sorted(catalog_sync.collections.items(),
+                                                 key=lambda item: item[1]["title"])
+            ]
+        }
+
+    return _cached(("collections",), build)
+
+
+catalog_sync.add_listener(on_product_change)
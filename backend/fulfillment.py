@@ -0,0 +1,283 @@
+"""Post-payment side effects, one adapter per outbox event kind.
+
+Each adapter takes the order document plus the raw Razorpay payment. It
+returns order fields to $set on success. It raises PermanentError for
+failures a retry cannot fix, such as a rejected payload; any other exception
+is retried by the outbox dispatcher with backoff.
+
+Handlers are idempotent. An event can run again after the upstream call
+succeeded: the order update failed, a lease expired, or the event was
+re-queued. So each handler skips orders that already have its result, and
+before creating anything it looks the razorpay order id up upstream and
+adopts a match.
+
+Base URLs and the HTTP client are constructor arguments, so adapters can
+be pointed at local fake servers:
+
+    ShiprocketAdapter("http://127.0.0.1:9000", "ops@example.com", "secret")
+"""
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+import orders
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+SHOPIFY_ORDER = "shopify_order"
+SHIPMENT = "shipment"
+
+
+class PermanentError(Exception):
+    """The request was rejected; retrying the same event won't help"""
+
+
+def _raise_for_status(response: httpx.Response, upstream: str) -> None:
+    if response.status_code < 400:
+        return
+    message = f"{upstream} returned {response.status_code}: {response.text[:500]}"
+    if response.status_code in (408, 429) or response.status_code >= 500:
+        raise RuntimeError(message)
+    raise PermanentError(message)
+
+
+def _rupees(paise: int) -> str:
+    return f"{paise / 100:.2f}"
+
+
+class ShopifyOrderAdapter:
+    """Create a paid Shopify order through the Admin REST API"""
+
+    kind = SHOPIFY_ORDER
+    # REST can't filter orders by tag; the Admin GraphQL search can
+    ORDER_BY_TAG_QUERY = """
+    query orderByTag($query: String!) {
+        orders(first: 1, query: $query) { edges { node { id name } } }
+    }
+    """
+
+    def __init__(self, base_url: str, access_token: str, client: Optional[httpx.AsyncClient] = None):
+        self.base_url = base_url.rstrip("/")
+        self.access_token = access_token
+        self.client = client or httpx.AsyncClient(timeout=30.0)
+
+    def payload(self, order: Dict[str, Any], payment: Dict[str, Any]) -> Dict[str, Any]:
+        # Line prices are in the store currency even when the charge was converted
+        amount, currency = orders.store_amount(order)
+        amount = _rupees(amount)
+        body = {
+            "line_items": [
+                {"variant_id": int(variant_id), "quantity": quantity, "price": _rupees(price)}
+                for variant_id, quantity, price, _ in orders.order_lines(order)
+                if str(variant_id).isdigit()
+            ],
+            "currency": currency,
+            "financial_status": "paid",
+            "transactions": [{
+                "kind": "sale", "status": "success", "gateway": "razorpay",
+                "amount": amount, "authorization": order.get(orders.PAYMENT_ID),
+            }],
+            "tags": f"razorpay,{order[orders.ORDER_ID]}",
+            "note_attributes": [
+                {"name": "razorpay_order_id", "value": order[orders.ORDER_ID]},
+                {"name": "razorpay_payment_id", "value": order.get(orders.PAYMENT_ID)},
+            ],
+            "send_receipt": True,
+        }
+        if payment.get("email"):
+            body["email"] = payment["email"]
+        if payment.get("contact"):
+            body["phone"] = payment["contact"]
+        address = order.get(orders.SHIPPING_ADDRESS)
+        if address:
+            body["shipping_address"] = {
+                "name": address["name"], "phone": address["phone"],
+                "address1": address["line1"], "address2": address.get("line2") or "",
+                "city": address["city"], "province": address["state"],
+                "zip": address["pincode"], "country": address.get("country", "India"),
+            }
+        return {"order": body}
+
+    async def find_existing(self, razorpay_order_id: str) -> Optional[Dict[str, Any]]:
+        """The Shopify order already created for (tagged with) this razorpay order, if any"""
+        response = await self.client.post(
+            f"{self.base_url}/graphql.json",
+            headers={"X-Shopify-Access-Token": self.access_token},
+            json={"query": self.ORDER_BY_TAG_QUERY, "variables": {"query": f"tag:{razorpay_order_id}"}},
+        )
+        _raise_for_status(response, "Shopify")
+        edges = ((response.json().get("data") or {}).get("orders") or {}).get("edges") or []
+        if not edges:
+            return None
+        node = edges[0]["node"]
+        return {"id": int(node["id"].rsplit("/", 1)[-1]), "name": node.get("name")}
+
+    async def handle(self, order: Dict[str, Any], payment: Dict[str, Any]) -> Dict[str, Any]:
+        if order.get(orders.SHOPIFY_ORDER):
+            return {}
+        existing = await self.find_existing(order[orders.ORDER_ID])
+        if existing is not None:
+            logger.info(f"Shopify order {existing['name']} already exists for {order[orders.ORDER_ID]}")
+            return {orders.SHOPIFY_ORDER: existing}
+        response = await self.client.post(
+            f"{self.base_url}/orders.json",
+            headers={"X-Shopify-Access-Token": self.access_token},
+            json=self.payload(order, payment),
+        )
+        _raise_for_status(response, "Shopify")
+        created = response.json()["order"]
+        return {orders.SHOPIFY_ORDER: {"id": created["id"], "name": created.get("name")}}
+
+
+class ShiprocketAdapter:
+    """Create a Shiprocket ad-hoc order (shipment) for a paid order"""
+
+    kind = SHIPMENT
+    TOKEN_TTL_SECONDS = 9 * 24 * 3600  # tokens are valid for 10 days
+
+    def __init__(self, base_url: str, email: str, password: str, client: Optional[httpx.AsyncClient] = None):
+        self.base_url = base_url.rstrip("/")
+        self.email = email
+        self.password = password
+        self.client = client or httpx.AsyncClient(timeout=30.0)
+        self._token: Optional[str] = None
+        self._token_expires = 0.0
+
+    async def token(self) -> str:
+        if self._token is None or time.monotonic() > self._token_expires:
+            response = await self.client.post(
+                f"{self.base_url}/v1/external/auth/login",
+                json={"email": self.email, "password": self.password},
+            )
+            _raise_for_status(response, "Shiprocket auth")
+            self._token = response.json()["token"]
+            self._token_expires = time.monotonic() + self.TOKEN_TTL_SECONDS
+        return self._token
+
+    def payload(self, order: Dict[str, Any], payment: Dict[str, Any]) -> Dict[str, Any]:
+        address = order[orders.SHIPPING_ADDRESS]
+        created_at: datetime = order.get(orders.CREATED_AT) or datetime.utcnow()
+        length, breadth, height = (float(cm) for cm in settings.SHIPROCKET_PACKAGE_CM.split("x"))
+        return {
+            "order_id": order[orders.ORDER_ID],
+            "order_date": created_at.strftime("%Y-%m-%d %H:%M"),
+            "pickup_location": settings.SHIPROCKET_PICKUP_LOCATION,
+            "billing_customer_name": address["name"],
+            "billing_last_name": "",
+            "billing_address": address["line1"],
+            "billing_address_2": address.get("line2") or "",
+            "billing_city": address["city"],
+            "billing_state": address["state"],
+            "billing_pincode": address["pincode"],
+            "billing_country": address.get("country", "India"),
+            "billing_email": address.get("email") or payment.get("email") or "",
+            "billing_phone": address["phone"],
+            "shipping_is_billing": True,
+            "order_items": [
+                {"name": title or f"Variant {variant_id}", "sku": str(variant_id), "units": quantity,
+                 "selling_price": _rupees(price)}
+                for variant_id, quantity, price, title in orders.order_lines(order)
+            ],
+            "payment_method": "Prepaid",
+            "sub_total": _rupees(orders.store_amount(order)[0]),
+            "length": length,
+            "breadth": breadth,
+            "height": height,
+            "weight": settings.SHIPROCKET_PACKAGE_WEIGHT_KG,
+        }
+
+    async def find_existing(self, razorpay_order_id: str) -> Optional[Dict[str, Any]]:
+        """The shipment already created for this razorpay order (Shiprocket's channel order id), if any"""
+        response = await self.client.get(
+            f"{self.base_url}/v1/external/orders",
+            headers={"Authorization": f"Bearer {await self.token()}"},
+            params={"search": razorpay_order_id},
+        )
+        if response.status_code == 401:
+            self._token = None
+            raise RuntimeError("Shiprocket token rejected")
+        _raise_for_status(response, "Shiprocket")
+        for found in (response.json() or {}).get("data") or []:
+            if str(found.get("channel_order_id")) != razorpay_order_id:
+                continue
+            shipment = (found.get("shipments") or [{}])[0]
+            return {
+                "order_id": found.get("id"),
+                "shipment_id": shipment.get("id"),
+                "awb": shipment.get("awb") or None,
+                "courier": shipment.get("courier") or None,
+            }
+        return None
+
+    async def handle(self, order: Dict[str, Any], payment: Dict[str, Any]) -> Dict[str, Any]:
+        if order.get(orders.SHIPMENT):
+            return {}
+        if not order.get(orders.SHIPPING_ADDRESS):
+            # Nothing to ship to yet; /api/shipping/create-order re-queues it with an address
+            return {}
+        existing = await self.find_existing(order[orders.ORDER_ID])
+        if existing is not None:
+            logger.info(f"Shiprocket order {existing['order_id']} already exists for {order[orders.ORDER_ID]}")
+            return {orders.SHIPMENT: existing}
+        response = await self.client.post(
+            f"{self.base_url}/v1/external/orders/create/adhoc",
+            headers={"Authorization": f"Bearer {await self.token()}"},
+            json=self.payload(order, payment),
+        )
+        if response.status_code == 401:
+            # Token revoked early; fetch a new one on the retry
+            self._token = None
+            raise RuntimeError("Shiprocket token rejected")
+        _raise_for_status(response, "Shiprocket")
+        created = response.json()
+        return {orders.SHIPMENT: {
+            "order_id": created.get("order_id"),
+            "shipment_id": created.get("shipment_id"),
+            "awb": created.get("awb_code") or None,
+            "courier": created.get("courier_name") or None,
+        }}
+
+    async def shipment_awb(self, shipment_id: Any) -> Optional[Dict[str, Any]]:
+        """AWB and courier of a shipment, once Shiprocket has assigned them (None before)"""
+        response = await self.client.get(
+            f"{self.base_url}/v1/external/shipments/{shipment_id}",
+            headers={"Authorization": f"Bearer {await self.token()}"},
+        )
+        if response.status_code == 401:
+            self._token = None
+            raise RuntimeError("Shiprocket token rejected")
+        _raise_for_status(response, "Shiprocket")
+        shipment = (response.json() or {}).get("data") or {}
+        awb = shipment.get("awb") or shipment.get("awb_code")
+        if not awb:
+            return None
+        return {"awb": str(awb), "courier": shipment.get("courier") or shipment.get("courier_name") or None}
+
+    async def track_awbs(self, awbs: List[str]) -> Dict[str, Any]:
+        """Raw tracking data per AWB, from one bulk tracking call"""
+        response = await self.client.post(
+            f"{self.base_url}/v1/external/courier/track/awbs",
+            headers={"Authorization": f"Bearer {await self.token()}"},
+            json={"awbs": awbs},
+        )
+        if response.status_code == 401:
+            self._token = None
+            raise RuntimeError("Shiprocket token rejected")
+        _raise_for_status(response, "Shiprocket tracking")
+        return response.json() or {}
+
+
+def configured_adapters() -> Dict[str, Any]:
+    """Adapters whose credentials are present in settings"""
+    adapters = {}
+    if settings.SHOPIFY_ADMIN_ACCESS_TOKEN:
+        adapters[SHOPIFY_ORDER] = ShopifyOrderAdapter(settings.SHOPIFY_ADMIN_BASE_URL, settings.SHOPIFY_ADMIN_ACCESS_TOKEN)
+    if settings.SHIPROCKET_EMAIL and settings.SHIPROCKET_PASSWORD:
+        adapters[SHIPMENT] = ShiprocketAdapter(
+            settings.SHIPROCKET_BASE_URL, settings.SHIPROCKET_EMAIL, settings.SHIPROCKET_PASSWORD
+        )
+    return adapters
@@ -0,0 +1,89 @@
+"""Cached dependency health for load balancer probes.
+
+A scheduled job checks Mongo (ping), Shopify (a one-field Storefront query)
+and Razorpay (a GET that only needs a response) in parallel every
+HEALTH_CHECK_SECONDS. Each check has its own timeout. The probe endpoints
+only read the stored results, so a probe costs no I/O however often the
+load balancer calls it. A slow dependency also doesn't turn every probe into
+another slow request.
+
+Only dependencies named in HEALTH_REQUIRED affect readiness. The others are
+reported with their latency but never take a worker out of rotation: if
+Shopify has an outage, marking every worker unready would turn a degraded
+catalog into a full outage.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import catalog
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+SHOP_QUERY = "query healthCheck { shop { name } }"
+
+# Dependency -> latest result: {"ok", "latency_ms", "checked_at", "error"}
+results: Dict[str, Dict[str, Any]] = {}
+_checked: set = set()
+
+
+def required() -> set:
+    """HEALTH_REQUIRED, minus dependencies this worker doesn't use (no database)"""
+    names = {name.strip() for name in settings.HEALTH_REQUIRED.split(",") if name.strip()}
+    return names & _checked if _checked else names
+
+
+async def _timed(name: str, check: Callable[[], Awaitable[None]]) -> None:
+    started = time.monotonic()
+    error: Optional[str] = None
+    try:
+        await asyncio.wait_for(check(), timeout=settings.HEALTH_CHECK_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        error = f"Timed out after {settings.HEALTH_CHECK_TIMEOUT_SECONDS}s"
+    except Exception as e:
+        error = str(e)[:200] or type(e).__name__
+    if error and results.get(name, {}).get("ok", True):
+        logger.warning(f"Health check {name} failing: {error}")
+    results[name] = {
+        "ok": error is None,
+        "latency_ms": round((time.monotonic() - started) * 1000, 1),
+        "checked_at": datetime.utcnow(),
+        "error": error,
+    }
+
+
+async def check_all(db) -> None:
+    async def mongo() -> None:
+        await db.command("ping")
+
+    async def shopify() -> None:
+        await catalog.storefront(SHOP_QUERY, {})
+
+    async def razorpay() -> None:
+        response = await catalog.http_client().get(settings.RAZORPAY_HEALTH_URL)
+        if response.status_code >= 500:
+            raise RuntimeError(f"Razorpay returned {response.status_code}")
+
+    checks = {"shopify": shopify, "razorpay": razorpay}
+    if db is not None:
+        checks["mongo"] = mongo
+    _checked.update(checks)
+    await asyncio.gather(*(_timed(name, check) for name, check in checks.items()))
+
+
+def snapshot() -> Dict[str, Any]:
+    """Stored results plus whether every required dependency is healthy"""
+    # Results older than three check intervals mean the checker itself is stuck
+    stale_before = datetime.utcnow() - timedelta(seconds=settings.HEALTH_CHECK_SECONDS * 3)
+    needed = required()
+    dependencies = {}
+    healthy = needed <= results.keys()
+    for name, result in results.items():
+        stale = result["checked_at"] < stale_before
+        dependencies[name] = {**result, "stale": stale, "required": name in needed}
+        if name in needed and (stale or not result["ok"]):
+            healthy = False
+    return {"healthy": healthy, "dependencies": dependencies}
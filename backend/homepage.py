@@ -0,0 +1,141 @@
+"""Backend-for-frontend payload for the storefront homepage.
+
+The homepage used to query Shopify straight from the browser. It now makes
+one request to /api/homepage. That response is built server-side, cached, and
+kept precompressed. A stale payload is served while a single background
+refresh rebuilds it.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+
+import catalog
+import images
+from compression import CompressedPayload
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+HOMEPAGE_QUERY = """
+query homepage($products: Int!, $collections: Int!) {
+    products(first: $products) {
+        edges {
+            node {
+                id
+                title
+                handle
+                description
+                vendor
+                productType
+                images(first: 1) {
+                    edges {
+                        node {
+                            url
+                            altText
+                        }
+                    }
+                }
+                variants(first: 1) {
+                    edges {
+                        node {
+                            id
+                            price {
+                                amount
+                                currencyCode
+                            }
+                            compareAtPrice {
+                                amount
+                                currencyCode
+                            }
+                            availableForSale
+                        }
+                    }
+                }
+            }
+        }
+    }
+    collections(first: $collections) {
+        edges {
+            node {
+                id
+                title
+                handle
+                image {
+                    url
+                    altText
+                }
+            }
+        }
+    }
+}
+"""
+
+HERO_IMAGES = [
+    {
+        "url": "https://images.unsplash.com/photo-1617627143750-d86bc21e42bb",
+        "alt": "Vibrant red saree with traditional jewelry"
+    },
+    {
+        "url": "https://images.unsplash.com/photo-1571908599407-cdb918ed83bf",
+        "alt": "Elegant cream ethnic outfit in boutique setting"
+    },
+    {
+        "url": "https://images.unsplash.com/photo-1619715613791-89d35b51ff81",
+        "alt": "Green traditional outfit with modern styling"
+    }
+]
+
+HOMEPAGE_PRODUCTS = 12
+HOMEPAGE_COLLECTIONS = 12
+
+_payload: Optional[CompressedPayload] = None
+_built_at = 0.0
+_refresh: Optional[asyncio.Task] = None
+_cold_lock = asyncio.Lock()
+
+
+async def build() -> Dict[str, Any]:
+    data = await catalog.storefront(
+        HOMEPAGE_QUERY, {"products": HOMEPAGE_PRODUCTS, "collections": HOMEPAGE_COLLECTIONS}
+    )
+    products = [edge["node"] for edge in data["products"]["edges"]]
+    images.annotate(products)
+    return {
+        "products": products,
+        "collections": [edge["node"] for edge in data["collections"]["edges"]],
+        "hero": HERO_IMAGES,
+    }
+
+
+async def refresh() -> CompressedPayload:
+    global _payload, _built_at
+    _payload = CompressedPayload(await build())
+    _built_at = time.monotonic()
+    return _payload
+
+
+def refresh_in_background() -> None:
+    global _refresh
+    if _refresh is not None and not _refresh.done():
+        return
+
+    async def run():
+        try:
+            await refresh()
+        except Exception as e:
+            logger.warning(f"Homepage refresh failed, serving stale payload: {str(e)}")
+
+    _refresh = asyncio.create_task(run())
+
+
+async def get_payload() -> CompressedPayload:
+    """Current payload; only the very first request waits on Shopify"""
+    if _payload is None:
+        async with _cold_lock:
+            if _payload is None:
+                return await refresh()
+        return _payload
+    if time.monotonic() - _built_at > settings.HOMEPAGE_TTL_SECONDS:
+        refresh_in_background()
+    return _payload
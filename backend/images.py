@@ -0,0 +1,170 @@
+"""Responsive image manifest for catalog products.
+
+Each product image node is annotated in place with `srcset` (Shopify CDN
+size variants via the `width` URL parameter), a tiny `lqip` URL and, once
+computed, a BlurHash `placeholder`. Products are annotated on the way into
+the caches, so list responses carry display-ready image sets.
+
+Placeholders need the image pixels. A background worker downloads a 32px
+thumbnail and encodes it off the event loop. Pillow is optional; without it
+images carry srcset and lqip only.
+"""
+import asyncio
+import io
+import logging
+import math
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import httpx
+
+from cache import LRUCache
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover - optional dependency
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+SRCSET_WIDTHS = [160, 320, 480, 640, 960, 1280, 1920]
+DEFAULT_MAX_WIDTH = 1280
+LQIP_WIDTH = 32
+PLACEHOLDER_COMPONENTS = (4, 3)
+PLACEHOLDER_WORKERS = 4
+
+# image url -> BlurHash string ("" when it could not be computed)
+placeholders = LRUCache(maxsize=50000)
+_queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=10000)
+_queued: set = set()
+
+
+def sized_url(url: str, width: int) -> str:
+    """Shopify CDN URL resized to `width` pixels"""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k != "width"] + [("width", str(width))]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def srcset(url: str, original_width: Optional[int]) -> str:
+    max_width = original_width or DEFAULT_MAX_WIDTH
+    cap = min(max_width, SRCSET_WIDTHS[-1])
+    widths = [w for w in SRCSET_WIDTHS if w < max_width]
+    if not widths or widths[-1] != cap:
+        widths.append(cap)
+    return ", ".join(f"{sized_url(url, w)} {w}w" for w in widths)
+
+
+def _image_nodes(product: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [edge["node"] for edge in product.get("images", {}).get("edges", [])]
+
+
+def annotate(products: Iterable[Dict[str, Any]]) -> None:
+    """Add srcset / lqip / placeholder to every image node (idempotent)"""
+    for product in products:
+        if not product:
+            continue
+        for image in _image_nodes(product):
+            url = image.get("url")
+            if not url:
+                continue
+            image["srcset"] = srcset(url, image.get("width"))
+            image["lqip"] = sized_url(url, LQIP_WIDTH)
+            placeholder = placeholders.get(url)
+            if placeholder:
+                image["placeholder"] = placeholder
+            elif placeholder is None and Image is not None and url not in _queued and not _queue.full():
+                _queued.add(url)
+                _queue.put_nowait(url)
+
+
+# BlurHash encoding (https://blurha.sh), for small thumbnails only
+_BASE83 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+
+
+def _base83(value: int, length: int) -> str:
+    return "".join(_BASE83[(value // 83 ** (length - i - 1)) % 83] for i in range(length))
+
+
+def _to_linear(value: int) -> float:
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _to_srgb(value: float) -> int:
+    v = max(0.0, min(1.0, value))
+    if v <= 0.0031308:
+        return int(v * 12.92 * 255 + 0.5)
+    return int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value: float, exp: float) -> float:
+    return math.copysign(abs(value) ** exp, value)
+
+
+def blurhash(pixels: List[tuple], width: int, height: int, components=PLACEHOLDER_COMPONENTS) -> str:
+    cx, cy = components
+    linear = [(_to_linear(r), _to_linear(g), _to_linear(b)) for r, g, b in pixels]
+    factors = []
+    for j in range(cy):
+        cos_y = [math.cos(math.pi * j * y / height) for y in range(height)]
+        for i in range(cx):
+            cos_x = [math.cos(math.pi * i * x / width) for x in range(width)]
+            norm = 1 if i == 0 and j == 0 else 2
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                for x in range(width):
+                    basis = cos_x[x] * cos_y[y]
+                    pr, pg, pb = linear[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = norm / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _base83((cx - 1) + (cy - 1) * 9, 1)
+    if ac:
+        quantised_max = max(0, min(82, math.floor(max(abs(v) for f in ac for v in f) * 166 - 0.5)))
+        max_value = (quantised_max + 1) / 166
+        result += _base83(quantised_max, 1)
+    else:
+        max_value = 1
+        result += _base83(0, 1)
+    result += _base83((_to_srgb(dc[0]) << 16) + (_to_srgb(dc[1]) << 8) + _to_srgb(dc[2]), 4)
+    for f in ac:
+        r, g, b = (max(0, min(18, math.floor(_sign_pow(v / max_value, 0.5) * 9 + 9.5))) for v in f)
+        result += _base83(r * 19 * 19 + g * 19 + b, 2)
+    return result
+
+
+def _placeholder_from_bytes(data: bytes) -> str:
+    with Image.open(io.BytesIO(data)) as img:
+        img = img.convert("RGB")
+        img.thumbnail((LQIP_WIDTH, LQIP_WIDTH))
+        return blurhash(list(img.getdata()), img.width, img.height)
+
+
+async def placeholder_worker() -> None:
+    async with httpx.AsyncClient(timeout=10.0) as client:
+        while True:
+            url = await _queue.get()
+            try:
+                response = await client.get(sized_url(url, LQIP_WIDTH))
+                response.raise_for_status()
+                # Decoding and the DCT are CPU work; keep them off the event loop
+                placeholders.set(url, await asyncio.to_thread(_placeholder_from_bytes, response.content))
+            except Exception as e:
+                # Remember the failure so the image isn't retried on every annotate
+                placeholders.set(url, "")
+                logger.warning(f"Placeholder for {url} failed: {str(e)}")
+            finally:
+                _queued.discard(url)
+                _queue.task_done()
+
+
+def start_workers() -> List[asyncio.Task]:
+    if Image is None:
+        return []
+    return [asyncio.create_task(placeholder_worker()) for _ in range(PLACEHOLDER_WORKERS)]
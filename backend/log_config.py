@@ -0,0 +1,190 @@
+"""Structured JSON logging that stays off the event loop.
+
+configure_logging() routes every record through a QueueHandler. A
+QueueListener thread does the formatting and stdout I/O. Each line carries
+the current request id and upstream timings. Successful access lines are
+sampled at LOG_SAMPLE_RATE; errors are always kept. Payment and credential
+fields are redacted before anything is written.
+"""
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+import tracing
+
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+upstream_var: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("upstream", default=None)
+
+REDACTED = "[REDACTED]"
+REDACT_KEYS = {
+    "razorpay_signature", "signature", "card", "card_id", "vpa", "email", "contact",
+    "password", "token", "authorization", "key_secret", "bank_account",
+}
+# Hex HMAC signatures and bearer tokens that end up inside free-text messages
+REDACT_PATTERNS = [
+    re.compile(r"\b[0-9a-f]{64}\b"),
+    re.compile(r"(?i)bearer\s+[\w\-.]+"),
+]
+
+# LogRecord attributes that are not user-supplied `extra` fields
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def redact(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {k: REDACTED if k.lower() in REDACT_KEYS else redact(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [redact(v) for v in value]
+    if isinstance(value, str):
+        for pattern in REDACT_PATTERNS:
+            value = pattern.sub(REDACTED, value)
+    return value
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # Already formatted by ContextQueueHandler.prepare on the logging thread
+            entry["exc"] = record.exc_text
+        return json.dumps(redact(entry), default=str)
+
+
+class ContextFilter(logging.Filter):
+    """Stamp records with the request context while still on the caller's task"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        request_id = request_id_var.get()
+        if request_id and not hasattr(record, "request_id"):
+            record.request_id = request_id
+        upstream = upstream_var.get()
+        if upstream and not hasattr(record, "upstream_ms"):
+            record.upstream_ms = dict(upstream)
+        span = tracing.current_span()
+        if span is not None and span.sampled and not hasattr(record, "trace_id"):
+            record.trace_id = span.trace_id
+        return True
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Keep extra fields and exc_info for the JSON formatter on the listener thread
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def configure_logging(level: str = "INFO") -> None:
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(-1)
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=False)
+    _listener.start()
+
+    handler = ContextQueueHandler(log_queue)
+    handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+
+
+def shutdown_logging() -> None:
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+@contextmanager
+def upstream(name: str):
+    """Add the wall time of the enclosed upstream call to this request's timings"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = upstream_var.get()
+        if timings is not None:
+            elapsed = (time.perf_counter() - started) * 1000
+            timings[name] = round(timings.get(name, 0.0) + elapsed, 2)
+
+
+class RequestLoggingMiddleware:
+    """Request ids, upstream timings and sampled access logs"""
+
+    def __init__(self, app: ASGIApp, sample_rate: float = 1.0):
+        self.app = app
+        self.sample_rate = sample_rate
+        self.logger = logging.getLogger("access")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope["headers"]).get(b"x-request-id", b"").decode(errors="replace")[:64]
+        # Echoed back as a header, so only printable ASCII ids are kept
+        request_id = incoming if incoming.isascii() and incoming.isprintable() and incoming else uuid.uuid4().hex
+        request_token = request_id_var.set(request_id)
+        upstream_token = upstream_var.set({})
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_id(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                MutableHeaders(scope=message)["X-Request-ID"] = request_id
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        except Exception:
+            self._log(scope, 500, started, exc_info=True)
+            raise
+        else:
+            if status >= 400 or random.random() < self.sample_rate:
+                self._log(scope, status, started)
+        finally:
+            request_id_var.reset(request_token)
+            upstream_var.reset(upstream_token)
+
+    def _log(self, scope: Scope, status: int, started: float, exc_info: bool = False) -> None:
+        level = logging.ERROR if status >= 500 else logging.WARNING if status >= 400 else logging.INFO
+        self.logger.log(level, f"{scope['method']} {scope['path']} {status}", exc_info=exc_info, extra={
+            "method": scope["method"],
+            "path": scope["path"],
+            "status": status,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+        })
@@ -0,0 +1,306 @@
+"""Compact order document schema.
+
+Orders are stored with short field names, integer paise amounts and a
+whitelisted slice of the Razorpay payment. The full payment payload lives in
+the cold `payments_raw` collection, keyed by payment id.
+
+Legacy (unversioned) documents are rewritten in batches by migrate_orders():
+
+    python orders.py migrate --batch-size 500
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import ASCENDING, ReplaceOne, UpdateOne
+
+from config import settings
+from write_concerns import collection
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 2
+
+# Compact field names
+VERSION = "v"
+ORDER_ID = "oid"
+PAYMENT_ID = "pid"
+AMOUNT = "amt"          # integer paise
+CURRENCY = "cur"
+BASE_AMOUNT = "bamt"    # store-currency paise of ITEMS, when the charge was converted
+BASE_CURRENCY = "bcur"
+STATUS = "st"
+ITEMS = "it"            # [[variant_id, quantity, unit_price_paise, title], ...]; title absent on old lines
+CREATED_AT = "ca"
+PAID_AT = "pa"
+PAYMENT = "pay"         # whitelisted payment fields
+RECONCILED_AT = "ra"
+CART_ID = "cid"         # server-side cart the order was placed from
+SHIPPING_ADDRESS = "ad"
+SHOPIFY_ORDER = "so"    # {"id", "name"} once the outbox created it
+SHIPMENT = "sh"         # {"order_id", "shipment_id", "awb", "courier"} from Shiprocket
+USER_ID = "uid"         # signed-in customer who placed the order (absent for guests)
+
+RAW_PAYMENTS_COLLECTION = "payments_raw"
+
+# Razorpay payment fields kept on the hot order document
+PAYMENT_FIELDS = (
+    "id", "status", "method", "amount", "currency", "fee", "tax",
+    "bank", "wallet", "vpa", "international", "created_at",
+)
+
+VARIANT_GID_PREFIX = "gid://shopify/ProductVariant/"
+
+# Status a payment event may move an order out of; "paid" is terminal
+ALLOWED_FROM = {
+    "paid": ("created", "failed", "expired"),
+    "failed": ("created",),
+    "expired": ("created",),
+}
+
+
+def to_paise(amount: float) -> int:
+    return int(round(amount * 100))
+
+
+def compact_variant_id(variant_id: str) -> str:
+    if variant_id.startswith(VARIANT_GID_PREFIX):
+        return variant_id[len(VARIANT_GID_PREFIX):]
+    return variant_id
+
+
+def expand_variant_id(variant_id: str) -> str:
+    if variant_id.isdigit():
+        return VARIANT_GID_PREFIX + variant_id
+    return variant_id
+
+
+def compact_items(cart: Iterable[Any]) -> List[list]:
+    """CartItem models (paise) or legacy cart dicts (rupees) -> [variant_id, quantity, paise, title]"""
+    items = []
+    for item in cart:
+        if isinstance(item, list):
+            # Already compact (priced server-side cart)
+            items.append(item)
+        elif isinstance(item, dict):
+            line = [compact_variant_id(item["id"]), item["quantity"], to_paise(item["price"])]
+            if item.get("title"):
+                line.append(item["title"])
+            items.append(line)
+        else:
+            items.append([compact_variant_id(item.id), item.quantity, item.price, item.title])
+    return items
+
+
+def order_lines(doc: Dict[str, Any]) -> List[Tuple[str, int, int, Optional[str]]]:
+    """(variant_id, quantity, paise, title) per line; title is None for lines stored without one"""
+    return [(line[0], line[1], line[2], line[3] if len(line) > 3 else None) for line in doc.get(ITEMS, [])]
+
+
+def slim_payment(payment: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: payment[key] for key in PAYMENT_FIELDS if payment.get(key) is not None}
+
+
+def new_order(razorpay_order_id: str, amount: int, currency: str, cart: Iterable[Any],
+              cart_id: Optional[str] = None, shipping_address: Optional[Dict[str, Any]] = None,
+              user_id: Optional[str] = None, base: Optional[Tuple[int, str]] = None) -> Dict[str, Any]:
+    """`base` is (amount, currency) in the store currency when `amount` was converted from it"""
+    order = {
+        VERSION: SCHEMA_VERSION,
+        ORDER_ID: razorpay_order_id,
+        AMOUNT: int(amount),
+        CURRENCY: currency,
+        STATUS: "created",
+        ITEMS: compact_items(cart),
+        CREATED_AT: datetime.utcnow(),
+    }
+    if cart_id:
+        order[CART_ID] = cart_id
+    if shipping_address:
+        order[SHIPPING_ADDRESS] = shipping_address
+    if user_id:
+        order[USER_ID] = user_id
+    if base is not None and base[1] != currency:
+        order[BASE_AMOUNT], order[BASE_CURRENCY] = int(base[0]), base[1]
+    return order
+
+
+def store_amount(doc: Dict[str, Any]) -> Tuple[int, str]:
+    """(amount, currency) in the currency of the order's item prices"""
+    if BASE_AMOUNT in doc:
+        return doc[BASE_AMOUNT], doc[BASE_CURRENCY]
+    return doc[AMOUNT], doc[CURRENCY]
+
+
+def paid_fields(payment: Dict[str, Any], paid_at: Optional[datetime] = None) -> Dict[str, Any]:
+    """$set fields for an order whose payment was captured"""
+    return {
+        PAYMENT_ID: payment["id"],
+        STATUS: "paid",
+        PAID_AT: paid_at or datetime.utcnow(),
+        PAYMENT: slim_payment(payment),
+    }
+
+
+async def transition_status(db, razorpay_order_id: str, status: str, fields: Dict[str, Any] = None,
+                            session=None) -> bool:
+    """Move an order to `status` only from an allowed previous status.
+
+    The status check is part of the update filter, so concurrent verify,
+    webhook and reconciliation writes can't race or downgrade a paid order
+    without needing a transaction. Returns whether this call made the change.
+    """
+    result = await collection(db, "orders", "payment").update_one(
+        {ORDER_ID: razorpay_order_id, STATUS: {"$in": list(ALLOWED_FROM[status])}},
+        {"$set": {**(fields or {}), STATUS: status}},
+        session=session,
+    )
+    return result.modified_count == 1
+
+
+async def store_raw_payment(db, razorpay_order_id: str, payment: Dict[str, Any]) -> None:
+    """Keep the full Razorpay payload out of the hot orders collection"""
+    await collection(db, RAW_PAYMENTS_COLLECTION).update_one(
+        {"_id": payment["id"]},
+        {"$set": {ORDER_ID: razorpay_order_id, "payload": payment, "stored_at": datetime.utcnow()}},
+        upsert=True,
+    )
+
+
+def expand_order(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """API representation of an order document; legacy ones are compacted first"""
+    if VERSION not in doc:
+        doc = compact_from_legacy(doc)
+    order = {
+        "id": str(doc["_id"]),
+        "razorpay_order_id": doc[ORDER_ID],
+        "razorpay_payment_id": doc.get(PAYMENT_ID),
+        "amount": doc[AMOUNT],
+        "currency": doc[CURRENCY],
+        "status": doc[STATUS],
+        "items": [
+            {"variant_id": expand_variant_id(v), "quantity": q, "price": p, "title": title}
+            for v, q, p, title in order_lines(doc)
+        ],
+        "created_at": doc[CREATED_AT],
+        "paid_at": doc.get(PAID_AT),
+    }
+    if BASE_AMOUNT in doc:
+        order["base_amount"], order["base_currency"] = doc[BASE_AMOUNT], doc[BASE_CURRENCY]
+    if PAYMENT in doc:
+        order["payment"] = doc[PAYMENT]
+    if SHIPPING_ADDRESS in doc:
+        order["shipping_address"] = doc[SHIPPING_ADDRESS]
+    if SHOPIFY_ORDER in doc:
+        order["shopify_order"] = doc[SHOPIFY_ORDER]
+    if SHIPMENT in doc:
+        order["shipment"] = doc[SHIPMENT]
+    return order
+
+
+def _legacy_created_at(doc: Dict[str, Any]) -> datetime:
+    if doc.get("created_at"):
+        return doc["created_at"]
+    generation_time = getattr(doc["_id"], "generation_time", None)
+    if generation_time is None:
+        raise ValueError("no created_at and _id is not an ObjectId")
+    return generation_time.replace(tzinfo=None)
+
+
+def compact_from_legacy(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Rewrite an unversioned order document into the compact schema"""
+    compact = {
+        "_id": doc["_id"],
+        VERSION: SCHEMA_VERSION,
+        ORDER_ID: doc["razorpay_order_id"],
+        AMOUNT: int(doc["amount"]),
+        CURRENCY: doc.get("currency", "INR"),
+        STATUS: doc.get("status", "created"),
+        ITEMS: compact_items(doc.get("cart", [])),
+        CREATED_AT: _legacy_created_at(doc),
+    }
+    for legacy, short in (("razorpay_payment_id", PAYMENT_ID), ("paid_at", PAID_AT),
+                          ("reconciled_at", RECONCILED_AT)):
+        if doc.get(legacy) is not None:
+            compact[short] = doc[legacy]
+    if doc.get("payment_details"):
+        compact[PAYMENT] = slim_payment(doc["payment_details"])
+    return compact
+
+
+async def ensure_indexes(db) -> None:
+    await db.orders.create_index([(ORDER_ID, ASCENDING)], name="oid", unique=True, sparse=True)
+    await db[RAW_PAYMENTS_COLLECTION].create_index([(ORDER_ID, ASCENDING)], name="oid")
+    await db.orders.create_index([(USER_ID, ASCENDING), (CREATED_AT, ASCENDING)], name="uid_created", sparse=True)
+
+
+async def migrate_orders(db, batch_size: int = 500, pause_seconds: float = 0.05) -> int:
+    """Rewrite legacy order documents in _id order; returns documents migrated.
+
+    Each batch is one bulk_write on orders plus one on payments_raw, with a
+    short pause between batches to leave headroom for live traffic. Safe to
+    re-run: only unversioned documents are selected and replaced.
+    """
+    migrated = 0
+    last_id = None
+    while True:
+        query: Dict[str, Any] = {VERSION: {"$exists": False}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = await db.orders.find(query).sort("_id", ASCENDING).to_list(batch_size)
+        if not batch:
+            break
+
+        order_ops, raw_ops = [], []
+        for doc in batch:
+            try:
+                compact = compact_from_legacy(doc)
+            except (KeyError, TypeError, ValueError, AttributeError) as e:
+                logger.warning(f"Skipping order {doc['_id']}: {str(e)}")
+                continue
+            order_ops.append(ReplaceOne({"_id": doc["_id"], VERSION: {"$exists": False}}, compact))
+            payment = doc.get("payment_details")
+            if payment and payment.get("id"):
+                raw_ops.append(UpdateOne(
+                    {"_id": payment["id"]},
+                    {"$set": {ORDER_ID: compact[ORDER_ID], "payload": payment, "stored_at": datetime.utcnow()}},
+                    upsert=True,
+                ))
+
+        # Copy the cold payload before dropping it from the order
+        if raw_ops:
+            await collection(db, RAW_PAYMENTS_COLLECTION).bulk_write(raw_ops, ordered=False)
+        if order_ops:
+            result = await collection(db, "orders", "migrate").bulk_write(order_ops, ordered=False)
+            migrated += result.modified_count
+
+        last_id = batch[-1]["_id"]
+        logger.info(f"Order migration: {migrated} documents rewritten")
+        await asyncio.sleep(pause_seconds)
+    return migrated
+
+
+def main() -> None:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Compact order schema tools")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    async def run():
+        client = AsyncIOMotorClient(settings.MONGO_URL)
+        try:
+            db = client[settings.DB_NAME]
+            await ensure_indexes(db)
+            return await migrate_orders(db, batch_size=args.batch_size)
+        finally:
+            client.close()
+
+    print(f"Migrated {asyncio.run(run())} orders")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""Transactional outbox for post-payment side effects.
+
+When an order becomes paid, one event per side effect (Shopify order,
+shipment) is written to the `outbox` collection. Where the deployment
+supports it (replica set), this happens in the same transaction as the
+status change. Events are keyed "<kind>:<order id>". Verify, webhook and
+reconciliation can all enqueue the same event, and it is stored once.
+
+Dispatcher drains the collection in the background:
+- Events are claimed atomically with a lease, so several workers can run
+  and a crashed worker's events are picked up again once the lease expires.
+- At most OUTBOX_CONCURRENCY events are in flight per worker.
+- Failures retry with exponential backoff and jitter. After
+  OUTBOX_MAX_ATTEMPTS attempts, or on a fulfillment.PermanentError, an
+  event is marked dead and logged.
+"""
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Optional
+
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import OperationFailure
+
+import orders
+from fulfillment import SHIPMENT, SHOPIFY_ORDER, PermanentError
+from write_concerns import PAYMENTS, collection
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "outbox"
+
+# Event document fields
+KIND = "k"
+ORDER_ID = orders.ORDER_ID
+STATUS = "st"
+ATTEMPTS = "n"
+DUE = "due"
+LEASE = "lease"
+ERROR = "err"
+RESULT = "res"
+CREATED_AT = "ca"
+DONE_AT = "da"
+
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+DEAD = "dead"
+
+PAID_EVENTS = (SHOPIFY_ORDER, SHIPMENT)
+MAX_RETRY_DELAY_SECONDS = 6 * 3600
+LEASE_SECONDS = 300
+
+# Set on enqueue so the dispatcher starts right away instead of at the next poll
+_wakeup = asyncio.Event()
+# Cleared the first time the server rejects a transaction (standalone mongod)
+_transactions_supported = True
+
+
+def event_id(kind: str, razorpay_order_id: str) -> str:
+    return f"{kind}:{razorpay_order_id}"
+
+
+def _event_update(kind: str, razorpay_order_id: str, requeue: bool) -> UpdateOne:
+    now = datetime.utcnow()
+    fresh = {STATUS: PENDING, ATTEMPTS: 0, DUE: now}
+    update = {"$setOnInsert": {KIND: kind, ORDER_ID: razorpay_order_id, CREATED_AT: now}}
+    if requeue:
+        update["$set"] = fresh
+    else:
+        update["$setOnInsert"].update(fresh)
+    return UpdateOne({"_id": event_id(kind, razorpay_order_id)}, update, upsert=True)
+
+
+async def enqueue(db, razorpay_order_ids: Iterable[str], kinds: Iterable[str] = PAID_EVENTS,
+                  requeue: bool = False, session=None) -> None:
+    """Idempotently add events; `requeue` resets existing ones to pending"""
+    operations = [_event_update(kind, oid, requeue) for oid in razorpay_order_ids for kind in kinds]
+    if operations:
+        await collection(db, COLLECTION).bulk_write(operations, ordered=False, session=session)
+        _wakeup.set()
+
+
+async def mark_paid(client, db, razorpay_order_id: str, fields: Dict[str, Any]) -> bool:
+    """Transition the order to paid and enqueue its events atomically when possible"""
+    global _transactions_supported
+    if _transactions_supported and client is not None:
+        async def paid_in_transaction(session) -> bool:
+            changed = await orders.transition_status(db, razorpay_order_id, "paid", fields, session=session)
+            await enqueue(db, [razorpay_order_id], session=session)
+            return changed
+
+        try:
+            # Verify and webhook racing on one order conflict (WriteConflict, a
+            # TransientTransactionError); with_transaction retries the loser,
+            # whose transition then finds the order already paid and returns False.
+            async with await client.start_session() as session:
+                return await session.with_transaction(paid_in_transaction, write_concern=PAYMENTS)
+        except OperationFailure as e:
+            if e.code != 20:  # IllegalOperation: transactions need a replica set
+                raise
+            _transactions_supported = False
+            logger.warning("MongoDB does not support transactions; outbox events are written after the order update")
+    changed = await orders.transition_status(db, razorpay_order_id, "paid", fields)
+    await enqueue(db, [razorpay_order_id])
+    return changed
+
+
+async def ensure_indexes(db) -> None:
+    await db[COLLECTION].create_index([(STATUS, ASCENDING), (DUE, ASCENDING)], name="status_due")
+    await db[COLLECTION].create_index([(ORDER_ID, ASCENDING)], name="oid")
+
+
+class Dispatcher:
+    def __init__(self, db, adapters: Dict[str, Any], concurrency: int = 4, max_attempts: int = 8,
+                 retry_base_seconds: float = 30, poll_seconds: float = 5):
+        self.db = db
+        self.adapters = adapters
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.poll_seconds = poll_seconds
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks: set = set()
+
+    async def claim(self) -> Optional[Dict[str, Any]]:
+        now = datetime.utcnow()
+        return await collection(self.db, COLLECTION).find_one_and_update(
+            {
+                KIND: {"$in": list(self.adapters)},
+                "$or": [
+                    {STATUS: PENDING, DUE: {"$lte": now}},
+                    {STATUS: IN_FLIGHT, LEASE: {"$lte": now}},
+                ],
+            },
+            {"$set": {STATUS: IN_FLIGHT, LEASE: now + timedelta(seconds=LEASE_SECONDS)}, "$inc": {ATTEMPTS: 1}},
+            sort=[(DUE, ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def retry_delay(self, attempts: int) -> float:
+        delay = min(self.retry_base_seconds * 2 ** (attempts - 1), MAX_RETRY_DELAY_SECONDS)
+        return delay * random.uniform(0.5, 1.5)
+
+    async def process(self, event: Dict[str, Any]) -> None:
+        events = collection(self.db, COLLECTION)
+        try:
+            order = await self.db.orders.find_one({ORDER_ID: event[ORDER_ID]})
+            if order is None:
+                raise PermanentError(f"Order {event[ORDER_ID]} not found")
+            raw = await self.db[orders.RAW_PAYMENTS_COLLECTION].find_one({"_id": order.get(orders.PAYMENT_ID)})
+            fields = await self.adapters[event[KIND]].handle(order, (raw or {}).get("payload", {}))
+            if fields:
+                await collection(self.db, "orders").update_one({"_id": order["_id"]}, {"$set": fields})
+            await events.update_one(
+                {"_id": event["_id"], STATUS: IN_FLIGHT},
+                {"$set": {STATUS: DONE, DONE_AT: datetime.utcnow(), RESULT: fields}, "$unset": {LEASE: "", ERROR: ""}},
+            )
+        except Exception as e:
+            attempts = event[ATTEMPTS]
+            dead = isinstance(e, PermanentError) or attempts >= self.max_attempts
+            update = {STATUS: DEAD if dead else PENDING, ERROR: str(e)[:1000]}
+            if not dead:
+                update[DUE] = datetime.utcnow() + timedelta(seconds=self.retry_delay(attempts))
+            await events.update_one({"_id": event["_id"]}, {"$set": update, "$unset": {LEASE: ""}})
+            if dead:
+                logger.error(f"Outbox event {event['_id']} failed permanently after {attempts} attempts: {str(e)}")
+            else:
+                logger.warning(f"Outbox event {event['_id']} attempt {attempts} failed, retrying: {str(e)}")
+
+    async def _run(self, event: Dict[str, Any]) -> None:
+        try:
+            await self.process(event)
+        finally:
+            self._slots.release()
+
+    async def drain(self) -> int:
+        """Start every due event, waiting for free slots; returns events started"""
+        started = 0
+        while True:
+            await self._slots.acquire()
+            try:
+                event = await self.claim()
+            except Exception:
+                self._slots.release()
+                raise
+            if event is None:
+                self._slots.release()
+                return started
+            task = asyncio.create_task(self._run(event))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            started += 1
+
+    async def run_forever(self) -> None:
+        await ensure_indexes(self.db)
+        while True:
+            _wakeup.clear()
+            try:
+                await self.drain()
+            except Exception as e:
+                logger.error(f"Outbox dispatch failed: {str(e)}")
+            try:
+                await asyncio.wait_for(_wakeup.wait(), timeout=self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def wait_idle(self) -> None:
+        """Wait for in-flight events (used by tests and shutdown)"""
+        if self._tasks:
+            await asyncio.gather(*list(self._tasks), return_exceptions=True)
@@ -0,0 +1,129 @@
+"""Local variant-price index for min_price/max_price listing queries.
+
+Every variant price in the catalog snapshot is kept in a sorted array of
+(price, handle) pairs, maintained incrementally from catalog_sync events.
+A price range is two bisects. Matches are then narrowed by collection, sorted
+and paginated in memory. Cursors encode the sort_key and the last item's
+sort value, not a position, so a page boundary stays put when the catalog
+refreshes between requests.
+"""
+import base64
+import bisect
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+import catalog_sync
+from facets import product_price
+
+CURSOR_PREFIX = "px:"
+
+# Sort keys answerable locally; BEST_SELLING and RELEVANCE need Shopify
+SORT_FIELDS = {
+    "CREATED_AT": lambda p: p.get("createdAt") or "",
+    "UPDATED_AT": lambda p: p.get("updatedAt") or "",
+    "TITLE": lambda p: (p.get("title") or "").lower(),
+    "PRICE": lambda p: product_price(p) or 0.0,
+}
+
+_entries: List[Tuple[float, str]] = []
+
+
+def variant_prices(product: Dict[str, Any]) -> List[float]:
+    return sorted({float(edge["node"]["price"]["amount"])
+                   for edge in product.get("variants", {}).get("edges", [])})
+
+
+def on_product_change(old: Optional[Dict[str, Any]], new: Optional[Dict[str, Any]]) -> None:
+    if old is not None:
+        for price in variant_prices(old):
+            i = bisect.bisect_left(_entries, (price, old["handle"]))
+            if i < len(_entries) and _entries[i] == (price, old["handle"]):
+                del _entries[i]
+    if new is not None:
+        for price in variant_prices(new):
+            bisect.insort(_entries, (price, new["handle"]))
+
+
+def handles_in_range(min_price: Optional[float], max_price: Optional[float]) -> set:
+    lo = 0 if min_price is None else bisect.bisect_left(_entries, (min_price, ""))
+    hi = len(_entries) if max_price is None else bisect.bisect_right(_entries, (max_price, "\uffff"))
+    return {handle for _, handle in _entries[lo:hi]}
+
+
+def can_answer(search_query: Optional[str], sort_key: str, after: Optional[str]) -> bool:
+    if after is not None and not after.startswith(CURSOR_PREFIX):
+        return False
+    return search_query is None and sort_key in SORT_FIELDS and bool(catalog_sync.products)
+
+
+def encode_cursor(sort_key: str, sort_value: Any, handle: str) -> str:
+    raw = json.dumps([sort_key, sort_value, handle], separators=(",", ":")).encode()
+    return CURSOR_PREFIX + base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(cursor: str, sort_key: str) -> Tuple[Any, str]:
+    """(sort value, handle) of a cursor made for `sort_key`; 400 for anything else"""
+    try:
+        cursor_sort_key, sort_value, handle = json.loads(base64.urlsafe_b64decode(cursor[len(CURSOR_PREFIX):]))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if cursor_sort_key != sort_key:
+        raise HTTPException(status_code=400, detail="Cursor was issued for a different sort_key")
+    # Sort values are compared against the page's keys, so the type has to match
+    value_type = (int, float) if sort_key == "PRICE" else str
+    if not isinstance(handle, str) or not isinstance(sort_value, value_type) or isinstance(sort_value, bool):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return sort_value, handle
+
+
+def query(
+    first: int,
+    after: Optional[str] = None,
+    collection_handle: Optional[str] = None,
+    sort_key: str = "CREATED_AT",
+    reverse: bool = False,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+) -> Dict[str, Any]:
+    """Same response shape as the Shopify-backed listing"""
+    if min_price is None and max_price is None:
+        handles = set(catalog_sync.products)
+    else:
+        handles = handles_in_range(min_price, max_price)
+
+    products = [catalog_sync.products[h] for h in handles if h in catalog_sync.products]
+    if collection_handle:
+        products = [p for p in products if collection_handle in catalog_sync.product_collections(p)]
+
+    sort_value = SORT_FIELDS[sort_key]
+    keyed = sorted(((sort_value(p), p["handle"]), p) for p in products)
+    if reverse:
+        keyed.reverse()
+
+    start = 0
+    if after is not None:
+        position = decode_cursor(after, sort_key)
+        keys = [key for key, _ in keyed]
+        if reverse:
+            # keys are descending; find the first key strictly below the cursor
+            start = len(keys) - bisect.bisect_left(keys[::-1], position)
+        else:
+            start = bisect.bisect_right(keys, position)
+
+    page = keyed[start:start + first]
+    nodes = [{key: value for key, value in p.items() if key != "collections"} for _, p in page]
+    return {
+        "products": nodes,
+        "pageInfo": {
+            "hasNextPage": start + first < len(keyed),
+            "hasPreviousPage": start > 0,
+            "startCursor": encode_cursor(sort_key, *page[0][0]) if page else None,
+            "endCursor": encode_cursor(sort_key, *page[-1][0]) if page else None,
+        },
+        "totalCount": len(nodes),
+    }
+
+
+catalog_sync.add_listener(on_product_change)
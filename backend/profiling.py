@@ -0,0 +1,133 @@
+"""On-demand sampling profiler and event-loop lag watchdog.
+
+The profiler is a thread that snapshots every thread's stack with
+sys._current_frames() at a fixed interval and counts identical stacks. Its
+output is the collapsed-stack format ("frame;frame;frame count" per line)
+read by flamegraph.pl and speedscope. Nothing is instrumented, so the
+overhead is one stack walk per interval while a profile is running and
+zero otherwise.
+
+The watchdog catches callbacks that block the loop, such as the synchronous
+Razorpay SDK calls. A heartbeat callback stamps the time on every loop
+iteration it gets. A watchdog thread notices when the stamp goes stale for
+longer than the threshold, and captures the loop thread's stack while the
+loop is still stuck.
+"""
+import asyncio
+import logging
+import sys
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_STACK_DEPTH = 128
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _format_stack(frame) -> List[str]:
+    return list(reversed(_collapse(frame).split(";")))
+
+
+def sample(seconds: float, interval: float = 0.005, thread_ids: Optional[List[int]] = None) -> Counter:
+    """Blocking: collapsed stacks counted every `interval` for `seconds`"""
+    own = threading.get_ident()
+    names = {t.ident: t.name for t in threading.enumerate()}
+    counts: Counter = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for ident, frame in sys._current_frames().items():
+            if ident == own or (thread_ids is not None and ident not in thread_ids):
+                continue
+            counts[f"{names.get(ident, ident)};{_collapse(frame)}"] += 1
+        time.sleep(interval)
+    return counts
+
+
+def collapsed(counts: Counter) -> str:
+    return "".join(f"{stack} {n}\n" for stack, n in counts.most_common())
+
+
+_profile_lock = asyncio.Lock()
+
+
+async def profile(seconds: float, interval: float = 0.005, loop_only: bool = False) -> Optional[str]:
+    """Collapsed stacks for the next `seconds`; None if a profile is already running"""
+    if _profile_lock.locked():
+        return None
+    async with _profile_lock:
+        thread_ids = [threading.get_ident()] if loop_only else None
+        counts = await asyncio.to_thread(sample, seconds, interval, thread_ids)
+    return collapsed(counts)
+
+
+class LoopWatchdog:
+    """Flag event-loop stalls longer than `threshold` seconds, with the blocking stack"""
+
+    def __init__(self, threshold: float = 0.1, history: int = 100):
+        self.threshold = threshold
+        self.stalls: deque = deque(maxlen=history)
+        self.max_lag = 0.0
+        self.stall_count = 0
+        self._heartbeat = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pending: Optional[Dict[str, Any]] = None
+
+    def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._loop.call_soon(self._beat)
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _beat(self) -> None:
+        now = time.monotonic()
+        lag = now - self._heartbeat - self.threshold / 4
+        self.max_lag = max(self.max_lag, lag)
+        stall = self._pending
+        if stall is not None:
+            # The loop is moving again; the stall's length is now known
+            stall["duration_ms"] = round((now - stall["_since"]) * 1000, 1)
+            del stall["_since"]
+            self._pending = None
+            logger.warning(f"Event loop blocked for {stall['duration_ms']}ms", extra={"stack": stall["stack"]})
+        self._heartbeat = now
+        if not self._stop.is_set():
+            self._loop.call_later(self.threshold / 4, self._beat)
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.threshold / 2):
+            since = self._heartbeat
+            if self._pending is not None or time.monotonic() - since < self.threshold + self.threshold / 4:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            self.stall_count += 1
+            self._pending = {"at": time.time(), "_since": since, "duration_ms": None, "stack": _format_stack(frame)}
+            self.stalls.append(self._pending)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "stall_count": self.stall_count,
+            "stalls": [{k: v for k, v in s.items() if not k.startswith("_")} for s in self.stalls],
+        }
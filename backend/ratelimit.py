@@ -0,0 +1,206 @@
+"""Per-client rate limiting for the expensive and abusable routes.
+
+Clients are keyed by X-API-Key when it is one of RATE_LIMIT_API_KEYS, and
+otherwise by IP address. Unknown keys are ignored, or a random key per request
+would get a fresh bucket every time. Behind proxies (TRUST_PROXY_HEADERS)
+the IP is the X-Forwarded-For entry TRUSTED_PROXY_HOPS from the right, since
+anything further left is written by the client. Each route draws a cost from
+a named bucket; listings cost more the larger `first` is.
+The default backend is an in-process token bucket. For multi-worker
+deployments RATE_LIMIT_BACKEND=mongo switches to a sliding-window counter
+shared through the `rate_limits` collection. Limited requests get a 429 with
+Retry-After.
+"""
+import logging
+import math
+import time
+from datetime import datetime
+from typing import Callable, Dict, FrozenSet, Iterable, List, NamedTuple, Optional, Tuple
+
+from pymongo import ReturnDocument
+from starlette.datastructures import Headers, QueryParams
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from cache import LRUCache
+from write_concerns import collection
+
+logger = logging.getLogger(__name__)
+
+
+class Bucket(NamedTuple):
+    name: str
+    capacity: float          # burst size, and the limit per window for the mongo backend
+    per_second: float        # sustained refill rate
+
+
+class RoutePolicy(NamedTuple):
+    bucket: Bucket
+    cost: Callable[[QueryParams], float]
+
+
+CATALOG = Bucket("catalog", capacity=600, per_second=10)
+CHECKOUT = Bucket("checkout", capacity=10, per_second=10 / 60)
+AUTH = Bucket("auth", capacity=10, per_second=5 / 60)
+# Product pages and cart edits for unknown handles/variants go to Shopify
+PRODUCT = Bucket("product", capacity=120, per_second=2)
+CART = Bucket("cart", capacity=60, per_second=1)
+
+
+def _int_param(params: QueryParams, name: str, default: int) -> int:
+    try:
+        return int(params.get(name, default))
+    except ValueError:
+        return default
+
+
+ROUTES: Dict[Tuple[str, str], RoutePolicy] = {
+    # 1 token per 25 products requested, so first=250 costs 11
+    ("GET", "/api/products"): RoutePolicy(CATALOG, lambda q: 1 + _int_param(q, "first", 20) // 25),
+    ("GET", "/api/products:batch"): RoutePolicy(CATALOG, lambda q: 1 + q.get("handles", "").count(",") // 10),
+    ("POST", "/api/create-razorpay-order"): RoutePolicy(CHECKOUT, lambda q: 1),
+    ("POST", "/api/verify-payment"): RoutePolicy(CHECKOUT, lambda q: 1),
+    ("POST", "/api/shipping/create-order"): RoutePolicy(CHECKOUT, lambda q: 1),
+    ("POST", "/api/auth/login"): RoutePolicy(AUTH, lambda q: 1),
+    ("POST", "/api/auth/register"): RoutePolicy(AUTH, lambda q: 1),
+    ("GET", "/api/cart"): RoutePolicy(CART, lambda q: 1),
+    ("POST", "/api/cart"): RoutePolicy(CART, lambda q: 1),
+    ("PUT", "/api/cart"): RoutePolicy(CART, lambda q: 1),
+    ("DELETE", "/api/cart"): RoutePolicy(CART, lambda q: 1),
+}
+
+# Templated paths ("/api/products/{handle}"), matched by prefix when no exact route applies
+PREFIX_ROUTES: List[Tuple[str, str, RoutePolicy]] = [
+    ("GET", "/api/products/", RoutePolicy(PRODUCT, lambda q: 1)),
+    ("DELETE", "/api/cart/items/", RoutePolicy(CART, lambda q: 1)),
+]
+
+
+def route_policy(method: str, path: str) -> Optional[RoutePolicy]:
+    policy = ROUTES.get((method, path))
+    if policy is None:
+        for route_method, prefix, prefix_policy in PREFIX_ROUTES:
+            if method == route_method and path.startswith(prefix):
+                return prefix_policy
+    return policy
+
+
+class MemoryLimiter:
+    """Token buckets per (bucket, client) in a bounded LRU"""
+
+    def __init__(self, max_clients: int = 100000):
+        self._state = LRUCache(maxsize=max_clients)
+
+    async def hit(self, bucket: Bucket, client: str, cost: float) -> Optional[float]:
+        """None if allowed, otherwise seconds until `cost` tokens are available"""
+        now = time.monotonic()
+        key = (bucket.name, client)
+        tokens, updated_at = self._state.get(key) or (bucket.capacity, now)
+        tokens = min(bucket.capacity, tokens + (now - updated_at) * bucket.per_second)
+        if tokens < cost:
+            self._state.set(key, (tokens, now))
+            return (cost - tokens) / bucket.per_second
+        self._state.set(key, (tokens - cost, now))
+        return None
+
+
+class MongoLimiter:
+    """Sliding-window counters shared across workers.
+
+    The window is the time the bucket takes to refill completely. Usage is the
+    current window's count plus the previous one's, weighted by how much of it
+    still overlaps the sliding window. Closed windows never change, so their
+    counts are cached locally.
+    """
+
+    def __init__(self, db):
+        self._db = db
+        self._closed = LRUCache(maxsize=100000)
+
+    async def ensure_indexes(self) -> None:
+        await self._db.rate_limits.create_index("expires_at", expireAfterSeconds=0)
+
+    async def _closed_count(self, doc_id: str) -> float:
+        count = self._closed.get(doc_id)
+        if count is None:
+            doc = await self._db.rate_limits.find_one({"_id": doc_id}, {"n": 1})
+            count = doc["n"] if doc else 0
+            self._closed.set(doc_id, count)
+        return count
+
+    async def hit(self, bucket: Bucket, client: str, cost: float) -> Optional[float]:
+        try:
+            return await self._hit(bucket, client, cost)
+        except Exception as e:
+            # Fail open: a Mongo hiccup must not take the storefront down
+            logger.warning(f"Rate limiter unavailable: {str(e)}")
+            return None
+
+    async def _hit(self, bucket: Bucket, client: str, cost: float) -> Optional[float]:
+        window = bucket.capacity / bucket.per_second
+        now = time.time()
+        current = int(now // window)
+        prefix = f"{bucket.name}:{client}:"
+
+        doc = await collection(self._db, "rate_limits").find_one_and_update(
+            {"_id": prefix + str(current)},
+            {
+                "$inc": {"n": cost},
+                "$setOnInsert": {"expires_at": datetime.utcfromtimestamp((current + 2) * window)},
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        previous = await self._closed_count(prefix + str(current - 1))
+        elapsed = (now % window) / window
+        used = doc["n"] + previous * (1 - elapsed)
+        if used <= bucket.capacity:
+            return None
+        # Time until the previous window's weight has decayed enough
+        if previous:
+            return max(1.0, (used - bucket.capacity) / previous * window)
+        return window - now % window
+
+
+def client_key(scope: Scope, trust_proxy_headers: bool, api_keys: FrozenSet[str] = frozenset(),
+               proxy_hops: int = 1) -> str:
+    headers = Headers(scope=scope)
+    api_key = headers.get("x-api-key")
+    if api_key and api_key in api_keys:
+        return "key:" + api_key
+    if trust_proxy_headers and headers.get("x-forwarded-for"):
+        # Entries left of what our own proxies appended are client-controlled
+        forwarded = [ip.strip() for ip in headers["x-forwarded-for"].split(",") if ip.strip()]
+        if forwarded:
+            return "ip:" + forwarded[-min(proxy_hops, len(forwarded))]
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+class RateLimitMiddleware:
+    def __init__(self, app: ASGIApp, limiter, trust_proxy_headers: bool = False, api_keys: Iterable[str] = (),
+                 proxy_hops: int = 1):
+        self.app = app
+        self.limiter = limiter
+        self.trust_proxy_headers = trust_proxy_headers
+        self.api_keys = frozenset(api_keys)
+        self.proxy_hops = max(proxy_hops, 1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        policy = route_policy(scope.get("method"), scope.get("path")) if scope["type"] == "http" else None
+        if policy is None:
+            await self.app(scope, receive, send)
+            return
+
+        cost = policy.cost(QueryParams(scope.get("query_string", b"")))
+        retry_after = await self.limiter.hit(policy.bucket, client_key(scope, self.trust_proxy_headers, self.api_keys, self.proxy_hops), cost)
+        if retry_after is None:
+            await self.app(scope, receive, send)
+            return
+
+        response = JSONResponse(
+            {"detail": "Rate limit exceeded"},
+            status_code=429,
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+        await response(scope, receive, send)
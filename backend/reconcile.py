@@ -0,0 +1,260 @@
+"""Reconcile orders stuck in "created" against Razorpay.
+
+Orders stay "created" when the browser closes before /api/verify-payment
+runs. This worker finds stale ones through the (status, created_at) index,
+asks Razorpay for their payments with bounded concurrency and a request rate
+cap, and fixes every status with a single bulk_write.
+
+Run once from the command line:
+
+    python reconcile.py --stale-minutes 30 --concurrency 8 --dry-run
+
+or schedule reconcile_and_log() as a singleton job (see server.py).
+"""
+import argparse
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, Field
+from pymongo import ASCENDING, UpdateOne
+
+import orders
+import outbox
+import stats
+from config import settings
+from orders import AMOUNT, CREATED_AT, ORDER_ID, RECONCILED_AT, STATUS
+from write_concerns import collection
+
+logger = logging.getLogger(__name__)
+
+# Orders with no payment attempt at all are expired after this long
+ORDER_EXPIRY = timedelta(hours=24)
+
+
+class Mismatch(BaseModel):
+    razorpay_order_id: str
+    reason: str
+    order_amount: Optional[int] = None
+    payment_amount: Optional[int] = None
+
+
+class ReconcileReport(BaseModel):
+    scanned: int = 0
+    fetched: int = 0
+    updated: int = 0
+    errors: int = 0
+    elapsed_seconds: float = 0.0
+    orders_per_second: float = 0.0
+    status_counts: Dict[str, int] = Field(default_factory=dict)
+    mismatches: List[Mismatch] = Field(default_factory=list)
+
+
+class RateLimiter:
+    """Spaces request starts at least 1/rate seconds apart"""
+
+    def __init__(self, rate: float):
+        self._interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next_at - now
+            self._next_at = max(now, self._next_at) + self._interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+_indexes_ready = False
+
+
+async def ensure_indexes(db) -> None:
+    await orders.ensure_indexes(db)
+    await db.orders.create_index(
+        [(STATUS, ASCENDING), (CREATED_AT, ASCENDING)],
+        name="status_created_at",
+    )
+
+
+async def find_stale_orders(db, stale_minutes: int, limit: int = 1000) -> List[Dict[str, Any]]:
+    cutoff = datetime.utcnow() - timedelta(minutes=stale_minutes)
+    cursor = db.orders.find(
+        {STATUS: "created", CREATED_AT: {"$lt": cutoff}},
+        {ORDER_ID: 1, AMOUNT: 1, CREATED_AT: 1},
+    ).sort(CREATED_AT, ASCENDING).hint("status_created_at")
+    return await cursor.to_list(limit)
+
+
+async def fetch_payments(razorpay_client, order_ids: List[str], concurrency: int, max_rps: float,
+                         retries: int = 3) -> Dict[str, Any]:
+    """Fetch payments for each order id; failed lookups map to the exception"""
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(max_rps)
+
+    async def fetch_one(order_id: str):
+        async with semaphore:
+            for attempt in range(retries):
+                await limiter.wait()
+                try:
+                    # The Razorpay SDK is blocking, keep it off the event loop
+                    result = await asyncio.to_thread(razorpay_client.order.payments, order_id)
+                    return order_id, result.get("items", [])
+                except Exception as e:
+                    if attempt == retries - 1:
+                        return order_id, e
+                    await asyncio.sleep(2 ** attempt)
+
+    results = await asyncio.gather(*(fetch_one(order_id) for order_id in order_ids))
+    return dict(results)
+
+
+def resolve_status(order: Dict[str, Any], payments: List[Dict[str, Any]], now: datetime):
+    """Decide the order's new status; returns (status, set_fields, mismatch)"""
+    order_id = order[ORDER_ID]
+    captured = [p for p in payments if p.get("status") == "captured"]
+
+    if captured:
+        payment = captured[0]
+        if order.get(AMOUNT) is not None and payment.get("amount") != order[AMOUNT]:
+            return None, None, Mismatch(
+                razorpay_order_id=order_id,
+                reason="captured amount differs from order amount",
+                order_amount=order[AMOUNT],
+                payment_amount=payment.get("amount"),
+            )
+        if len(captured) > 1:
+            mismatch = Mismatch(razorpay_order_id=order_id, reason=f"{len(captured)} captured payments")
+        else:
+            mismatch = None
+        paid_at = datetime.utcfromtimestamp(payment["created_at"]) if payment.get("created_at") else now
+        return "paid", orders.paid_fields(payment, paid_at), mismatch
+
+    if any(p.get("status") == "authorized" for p in payments):
+        # payment_capture=1 should capture automatically; leave it for the next run
+        return None, None, Mismatch(razorpay_order_id=order_id, reason="payment authorized but not captured")
+
+    if payments and all(p.get("status") == "failed" for p in payments):
+        return "failed", {}, None
+
+    if not payments and now - order[CREATED_AT] > ORDER_EXPIRY:
+        return "expired", {}, None
+
+    return None, None, None
+
+
+async def reconcile_once(db, razorpay_client, stale_minutes: int = None, concurrency: int = None,
+                         max_rps: float = None, limit: int = 1000, dry_run: bool = False) -> ReconcileReport:
+    stale_minutes = settings.RECONCILE_STALE_MINUTES if stale_minutes is None else stale_minutes
+    concurrency = concurrency or settings.RECONCILE_CONCURRENCY
+    max_rps = max_rps or settings.RAZORPAY_MAX_RPS
+
+    started = time.monotonic()
+    report = ReconcileReport()
+
+    stale = await find_stale_orders(db, stale_minutes, limit)
+    report.scanned = len(stale)
+
+    payments_by_order = await fetch_payments(
+        razorpay_client, [o[ORDER_ID] for o in stale], concurrency, max_rps
+    )
+
+    now = datetime.utcnow()
+    operations, paid = [], []
+    for order in stale:
+        payments = payments_by_order.get(order[ORDER_ID])
+        if isinstance(payments, Exception):
+            report.errors += 1
+            continue
+        report.fetched += 1
+
+        status, fields, mismatch = resolve_status(order, payments, now)
+        if mismatch:
+            report.mismatches.append(mismatch)
+        if status is None:
+            continue
+
+        report.status_counts[status] = report.status_counts.get(status, 0) + 1
+        if status == "paid":
+            paid.append(order[ORDER_ID])
+        # Only touch orders still "created" so a concurrent verify/webhook wins
+        operations.append(UpdateOne(
+            {"_id": order["_id"], STATUS: {"$in": list(orders.ALLOWED_FROM[status])}},
+            {"$set": {STATUS: status, RECONCILED_AT: now, **fields}},
+        ))
+
+    if operations and not dry_run:
+        result = await collection(db, "orders", "payment").bulk_write(operations, ordered=False)
+        report.updated = result.modified_count
+        # Payments missed by verify and the webhook still get their side effects
+        await outbox.enqueue(db, paid)
+        if report.updated:
+            await record_stats(db, [o["_id"] for o in stale], now)
+
+    report.elapsed_seconds = round(time.monotonic() - started, 3)
+    if report.elapsed_seconds:
+        report.orders_per_second = round(report.scanned / report.elapsed_seconds, 2)
+    return report
+
+
+async def record_stats(db, ids: List[Any], reconciled_at: datetime) -> None:
+    """Count the orders this pass changed; RECONCILED_AT tells them apart from lost races"""
+    changed = await db.orders.find(
+        {"_id": {"$in": ids}, RECONCILED_AT: reconciled_at, STATUS: {"$in": [stats.PAID, stats.FAILED]}},
+        {AMOUNT: 1, orders.CURRENCY: 1, STATUS: 1, orders.PAID_AT: 1},
+    ).to_list(None)
+    for order in changed:
+        at = order.get(orders.PAID_AT) if order[STATUS] == stats.PAID else reconciled_at
+        await stats.record(db, order[STATUS], order[AMOUNT], order[orders.CURRENCY], at)
+
+
+async def reconcile_and_log(db, razorpay_client) -> None:
+    """Scheduled pass; the report and every mismatch are logged"""
+    global _indexes_ready
+    if not _indexes_ready:
+        # find_stale_orders hints status_created_at, which must exist before the first pass
+        await ensure_indexes(db)
+        _indexes_ready = True
+    report = await reconcile_once(db, razorpay_client)
+    logger.info("Reconciliation: %s", report.model_dump_json(exclude={"mismatches"}))
+    for mismatch in report.mismatches:
+        logger.warning("Reconciliation mismatch: %s", mismatch.model_dump_json())
+
+
+def main() -> None:
+    import razorpay
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Reconcile stale Razorpay orders")
+    parser.add_argument("--stale-minutes", type=int, default=settings.RECONCILE_STALE_MINUTES)
+    parser.add_argument("--concurrency", type=int, default=settings.RECONCILE_CONCURRENCY)
+    parser.add_argument("--max-rps", type=float, default=settings.RAZORPAY_MAX_RPS)
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    async def run():
+        client = AsyncIOMotorClient(settings.MONGO_URL)
+        try:
+            db = client[settings.DB_NAME]
+            await ensure_indexes(db)
+            return await reconcile_once(
+                db,
+                razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET)),
+                stale_minutes=args.stale_minutes,
+                concurrency=args.concurrency,
+                max_rps=args.max_rps,
+                limit=args.limit,
+                dry_run=args.dry_run,
+            )
+        finally:
+            client.close()
+
+    print(asyncio.run(run()).model_dump_json(indent=2))
+
+
+if __name__ == "__main__":
+    main()
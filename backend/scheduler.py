@@ -0,0 +1,269 @@
+"""In-process scheduler for recurring jobs.
+
+Each job runs in its own asyncio task, outside any request. A job is an
+async function with no arguments and a trigger:
+
+    jobs.add("reconcile", reconcile_once, Interval(300), jitter=30, timeout=120, singleton=True)
+    jobs.add("stats.rollup", rollup, Cron("15 0 * * *"))
+
+- Interval(seconds) waits that long after the previous run finishes.
+  Cron(expr) takes a standard 5-field expression (minute hour day month
+  weekday, UTC). Runs never overlap; fire times missed while a run was still
+  going are skipped.
+- jitter adds a random 0..jitter seconds to every fire time, so workers and
+  jobs don't all hit Mongo or Shopify in the same second.
+- timeout cancels a run that takes longer and counts it as timed out.
+- singleton jobs run on one worker only. Before each run the worker takes
+  the job's lease document in `scheduler_leases` until the next fire time.
+  Another worker whose timer fires in that window skips the run. The current
+  holder can always renew, so leadership sticks to one worker until it stops
+  or misses a run.
+
+A truthy return value is logged and kept as last_result. metrics() reports
+per-job counts, last duration and error, and the next fire time.
+"""
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from pymongo.errors import DuplicateKeyError
+
+from write_concerns import collection
+
+logger = logging.getLogger(__name__)
+
+LEASES_COLLECTION = "scheduler_leases"
+DEFAULT_LEASE_SECONDS = 300
+
+
+class Interval:
+    def __init__(self, seconds: float, immediate: bool = True):
+        self.seconds = seconds
+        self.immediate = immediate
+
+    def first(self, now: datetime) -> datetime:
+        return now if self.immediate else self.next(now)
+
+    def next(self, after: datetime) -> datetime:
+        return after + timedelta(seconds=self.seconds)
+
+    def __repr__(self) -> str:
+        return f"every {self.seconds:g}s"
+
+
+class Cron:
+    """5-field cron expression (minute hour day-of-month month day-of-week), UTC"""
+
+    RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]  # weekday 0 and 7 are Sunday
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: {expression!r}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse(field, low, high) for field, (low, high) in zip(fields, self.RANGES)
+        )
+        self.weekdays = {day % 7 for day in weekdays}
+        # Standard cron: when both day fields are restricted, either may match
+        self._any_day = fields[2] == "*"
+        self._any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse(field: str, low: int, high: int) -> Set[int]:
+        values: Set[int] = set()
+        for part in field.split(","):
+            spec, _, step = part.partition("/")
+            if spec == "*":
+                start, end = low, high
+            elif "-" in spec:
+                start, end = (int(v) for v in spec.split("-", 1))
+            else:
+                start = end = int(spec)
+                if step:
+                    end = high
+            if not low <= start <= end <= high:
+                raise ValueError(f"Cron field {field!r} is out of range {low}-{high}")
+            values.update(range(start, end + 1, int(step) if step else 1))
+        return values
+
+    def _day_matches(self, at: datetime) -> bool:
+        day = at.day in self.days
+        weekday = (at.weekday() + 1) % 7 in self.weekdays  # cron counts from Sunday
+        if self._any_day:
+            return weekday
+        if self._any_weekday:
+            return day
+        return day or weekday
+
+    def first(self, now: datetime) -> datetime:
+        return self.next(now)
+
+    def next(self, after: datetime) -> datetime:
+        at = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = after + timedelta(days=366 * 5)
+        while at <= limit:
+            if at.month not in self.months:
+                at = (at.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(at):
+                at = at.replace(hour=0, minute=0) + timedelta(days=1)
+            elif at.hour not in self.hours:
+                at = at.replace(minute=0) + timedelta(hours=1)
+            elif at.minute not in self.minutes:
+                at += timedelta(minutes=1)
+            else:
+                return at
+        raise ValueError(f"Cron expression never fires: {self.expression!r}")
+
+    def __repr__(self) -> str:
+        return f"cron {self.expression!r}"
+
+
+class Job:
+    def __init__(self, name: str, func: Callable[[], Awaitable[Any]], trigger, jitter: float = 0,
+                 timeout: Optional[float] = None, singleton: bool = False):
+        self.name = name
+        self.func = func
+        self.trigger = trigger
+        self.jitter = jitter
+        self.timeout = timeout
+        self.singleton = singleton
+        self.next_run: Optional[datetime] = None
+        self.running = False
+        self.runs = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.skipped = 0
+        self.total_seconds = 0.0
+        self.last_started_at: Optional[datetime] = None
+        self.last_duration_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.last_result: Any = None
+
+    def schedule(self, fire: datetime) -> None:
+        self.next_run = fire + timedelta(seconds=random.uniform(0, self.jitter)) if self.jitter else fire
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "trigger": repr(self.trigger),
+            "singleton": self.singleton,
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "skipped": self.skipped,
+            "average_ms": round(self.total_seconds * 1000 / self.runs, 1) if self.runs else None,
+            "last_started_at": self.last_started_at,
+            "last_duration_ms": self.last_duration_ms,
+            "last_error": self.last_error,
+            "last_result": self.last_result,
+            "next_run_at": self.next_run,
+        }
+
+
+class Scheduler:
+    def __init__(self, db=None, instance_id: Optional[str] = None):
+        self.db = db
+        self.instance_id = instance_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.jobs: Dict[str, Job] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def add(self, name: str, func: Callable[[], Awaitable[Any]], trigger, jitter: float = 0,
+            timeout: Optional[float] = None, singleton: bool = False) -> Job:
+        if name in self.jobs:
+            raise ValueError(f"Job {name} is already scheduled")
+        job = Job(name, func, trigger, jitter, timeout, singleton)
+        self.jobs[name] = job
+        if self._tasks:
+            self._tasks.append(asyncio.create_task(self._loop(job)))
+        return job
+
+    async def acquire(self, job: Job, until: datetime) -> bool:
+        """Take or renew the job's lease; False while another worker holds it"""
+        if self.db is None:
+            return True
+        now = datetime.utcnow()
+        try:
+            await collection(self.db, LEASES_COLLECTION).update_one(
+                {"_id": job.name, "$or": [{"owner": self.instance_id}, {"until": {"$lte": now}}]},
+                {"$set": {"owner": self.instance_id, "until": until, "renewed_at": now}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # The filter didn't match and the upsert collided with the holder's document
+            return False
+        return True
+
+    async def run(self, job: Job) -> None:
+        """Run the job once now, recording metrics; errors never propagate"""
+        job.running = True
+        job.last_started_at = datetime.utcnow()
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(job.func(), timeout=job.timeout)
+            job.last_error = None
+            if result:
+                job.last_result = result if isinstance(result, (int, float, str, bool)) else str(result)
+                logger.info(f"Job {job.name}: {job.last_result}")
+        except asyncio.TimeoutError:
+            job.timeouts += 1
+            job.last_error = f"Timed out after {job.timeout}s"
+            logger.error(f"Job {job.name} timed out after {job.timeout}s")
+        except Exception as e:
+            job.failures += 1
+            job.last_error = str(e)[:1000]
+            logger.error(f"Job {job.name} failed: {str(e)}")
+        finally:
+            elapsed = time.monotonic() - started
+            job.runs += 1
+            job.total_seconds += elapsed
+            job.last_duration_ms = round(elapsed * 1000, 1)
+            job.running = False
+
+    async def _loop(self, job: Job) -> None:
+        job.schedule(job.trigger.first(datetime.utcnow()))
+        while True:
+            await asyncio.sleep(max((job.next_run - datetime.utcnow()).total_seconds(), 0))
+            now = datetime.utcnow()
+            fire = job.trigger.next(now)
+            if job.singleton:
+                lease = max(fire, now + timedelta(seconds=job.timeout or DEFAULT_LEASE_SECONDS))
+                try:
+                    leader = await self.acquire(job, lease)
+                except Exception as e:
+                    logger.error(f"Job {job.name} lease failed: {str(e)}")
+                    leader = False
+                if not leader:
+                    job.skipped += 1
+                    job.schedule(fire)
+                    continue
+            await self.run(job)
+            # Interval jobs wait a full period after the run; cron skips fire times it overran
+            job.schedule(job.trigger.next(datetime.utcnow()))
+
+    def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._loop(job)) for job in self.jobs.values()]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.db is not None and any(job.singleton for job in self.jobs.values()):
+            # Hand singleton jobs over right away instead of at lease expiry
+            try:
+                await collection(self.db, LEASES_COLLECTION).update_many(
+                    {"owner": self.instance_id}, {"$set": {"until": datetime.utcnow()}}
+                )
+            except Exception as e:
+                logger.warning(f"Could not release job leases: {str(e)}")
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"instance": self.instance_id, "jobs": {name: job.metrics() for name, job in self.jobs.items()}}
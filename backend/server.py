@@ -1,188 +1,73 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Query
-from dotenv import load_dotenv
+from fastapi import FastAPI, APIRouter, Depends, Header, HTTPException, Query, Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
-import os
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 import logging
-from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional
 import uuid
-from datetime import datetime
-import httpx
-from pydantic_settings import BaseSettings
+from datetime import datetime, timedelta
 import razorpay
-import hmac
-import hashlib
 import json
+import asyncio
+
+import auth
+import availability
+import carts
+import catalog
+import catalog_sync
+import checkout
+import currency as fx
+import facets
+import health
+import homepage
+import images
+import orders
+import outbox
+import price_index
+import profiling
+import stats
+import tracing
+import tracking
+import warmup
+from checkout import CartLineRequest, CreateOrderRequest, ShippingOrderRequest, VerifyPaymentRequest
+from compression import CompressionMiddleware, payload_response
+from config import settings
+from fulfillment import SHIPMENT, configured_adapters
+from log_config import RequestLoggingMiddleware, configure_logging, shutdown_logging, upstream
+from ratelimit import MemoryLimiter, MongoLimiter, RateLimitMiddleware
+from reconcile import reconcile_and_log
+from scheduler import Interval, Scheduler
+from signatures import RazorpaySigner, ShopifyWebhookSigner
+from tracing import MongoCommandListener, TracingMiddleware, span
+from write_concerns import collection
+
+# Configure logging before anything below can log
+configure_logging(settings.LOG_LEVEL)
+logger = logging.getLogger(__name__)
+tracing.configure(settings.TRACE_SAMPLE_RATE, settings.TRACE_EXPORTER, settings.TRACE_FILE, settings.TRACE_BUFFER_SIZE)
 
 
-# Add these imports at the top if not already there
-import razorpay
-import hmac
-import hashlib
-
-# Add this after your existing settings
-razorpay_client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
-
-# Add these models after your existing models
-class CartItem(BaseModel):
-    id: str
-    title: str
-    quantity: int
-    price: float
-    handle: str
-
-class CreateOrderRequest(BaseModel):
-    amount: int  # Amount in paise
-    currency: str = "INR"
-    cart: List[CartItem]
-
-class VerifyPaymentRequest(BaseModel):
-    razorpay_order_id: str
-    razorpay_payment_id: str
-    razorpay_signature: str
-    cart: List[CartItem]
-
-# Add these endpoints after your existing endpoints
-@api_router.post("/create-razorpay-order")
-async def create_razorpay_order(request: CreateOrderRequest):
-    """Create Razorpay order for payment"""
-    try:
-        # Create order in Razorpay
-        order_data = {
-            "amount": request.amount,
-            "currency": request.currency,
-            "receipt": f"order_{uuid.uuid4()}",
-            "payment_capture": 1
-        }
-        
-        razorpay_order = razorpay_client.order.create(data=order_data)
-        
-        # Store order in database
-        if db:
-            order_record = {
-                "razorpay_order_id": razorpay_order["id"],
-                "amount": request.amount,
-                "currency": request.currency,
-                "cart": [item.dict() for item in request.cart],
-                "status": "created",
-                "created_at": datetime.utcnow()
-            }
-            await db.orders.insert_one(order_record)
-        
-        return {
-            "id": razorpay_order["id"],
-            "amount": razorpay_order["amount"],
-            "currency": razorpay_order["currency"],
-            "status": razorpay_order["status"]
-        }
-        
-    except Exception as e:
-        print(f"Razorpay order creation error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to create order: {str(e)}")
-
-@api_router.post("/verify-payment")
-async def verify_payment(request: VerifyPaymentRequest):
-    """Verify Razorpay payment and process order"""
-    try:
-        # Verify payment signature
-        signature = request.razorpay_signature
-        order_id = request.razorpay_order_id
-        payment_id = request.razorpay_payment_id
-        
-        # Create signature for verification
-        message = f"{order_id}|{payment_id}"
-        generated_signature = hmac.new(
-            settings.RAZORPAY_KEY_SECRET.encode(),
-            message.encode(),
-            hashlib.sha256
-        ).hexdigest()
-        
-        if not hmac.compare_digest(signature, generated_signature):
-            raise HTTPException(status_code=400, detail="Invalid payment signature")
-        
-        # Get payment details from Razorpay
-        payment = razorpay_client.payment.fetch(payment_id)
-        
-        if payment["status"] != "captured":
-            raise HTTPException(status_code=400, detail="Payment not captured")
-        
-        # Update order status in database
-        if db:
-            await db.orders.update_one(
-                {"razorpay_order_id": order_id},
-                {
-                    "$set": {
-                        "razorpay_payment_id": payment_id,
-                        "status": "paid",
-                        "paid_at": datetime.utcnow(),
-                        "payment_details": payment
-                    }
-                }
-            )
-        
-        return {
-            "success": True,
-            "payment_id": payment_id,
-            "order_id": order_id,
-            "amount": payment["amount"],
-            "status": payment["status"],
-            "message": "Payment verified successfully"
-        }
-        
-    except Exception as e:
-        print(f"Payment verification error: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Payment verification failed: {str(e)}")
-
-@api_router.get("/orders")
-async def get_orders():
-    """Get all orders"""
-    if not db:
-        return {"orders": []}
-    
-    try:
-        orders = await db.orders.find().sort("created_at", -1).to_list(100)
-        return {"orders": orders}
-    except Exception as e:
-        print(f"Error fetching orders: {str(e)}")
-        return {"orders": []}
-
-
-
-
-
-ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
-
-# Configuration Settings
-class Settings(BaseSettings):
-    MONGO_URL: str = os.getenv("MONGO_URL", "mongodb://localhost:27017")
-    DB_NAME: str = os.getenv("DB_NAME", "undhyu_db")
-    SHOPIFY_STORE_DOMAIN: str = os.getenv("SHOPIFY_STORE_DOMAIN", "j0dktb-z1.myshopify.com")
-    SHOPIFY_STOREFRONT_ACCESS_TOKEN: str = os.getenv("SHOPIFY_STOREFRONT_ACCESS_TOKEN", "")
-    SHOPIFY_API_VERSION: str = os.getenv("SHOPIFY_API_VERSION", "2024-01")
-    RAZORPAY_KEY_ID: str = os.getenv("RAZORPAY_KEY_ID", "")
-    RAZORPAY_KEY_SECRET: str = os.getenv("RAZORPAY_KEY_SECRET", "")
-    PORT: int = int(os.getenv("PORT", 8001))
-    
-    class Config:
-        env_file = ".env"
-
-settings = Settings()
-
 # MongoDB connection with fallback
 try:
-    client = AsyncIOMotorClient(settings.MONGO_URL)
+    client = AsyncIOMotorClient(settings.MONGO_URL, event_listeners=[MongoCommandListener()])
     db = client[settings.DB_NAME]
 except Exception as e:
-    print(f"MongoDB connection failed: {e}")
+    logger.error(f"MongoDB connection failed: {e}")
     client = None
     db = None
 
 # Initialize Razorpay client
 razorpay_client = razorpay.Client(auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET))
 
+# Keyed HMAC templates for checkout and webhook signatures
+payment_signer = RazorpaySigner(settings.RAZORPAY_KEY_SECRET)
+webhook_signer = RazorpaySigner(settings.RAZORPAY_WEBHOOK_SECRET) if settings.RAZORPAY_WEBHOOK_SECRET else None
+shopify_webhook_signer = ShopifyWebhookSigner(settings.SHOPIFY_WEBHOOK_SECRET) if settings.SHOPIFY_WEBHOOK_SECRET else None
+
 # Create the main app
 app = FastAPI(title="Undhyu.com API", version="1.0.0")
 
@@ -198,66 +83,110 @@ class StatusCheck(BaseModel):
 class StatusCheckCreate(BaseModel):
     client_name: str
 
-class CartItem(BaseModel):
-    id: str
-    title: str
-    quantity: int
-    price: float
-    handle: str
-
-class CreateOrderRequest(BaseModel):
-    amount: int  # Amount in paise
-    currency: str = "INR"
-    cart: List[CartItem]
+cart_store = carts.CartStore(db, settings.CART_CACHE_SIZE)
 
-class VerifyPaymentRequest(BaseModel):
-    razorpay_order_id: str
-    razorpay_payment_id: str
-    razorpay_signature: str
-    cart: List[CartItem]
+def cart_session(x_session_id: Optional[str] = Header(None)) -> str:
+    """Cart id from X-Session-ID, or a new one for first-time visitors"""
+    return x_session_id if carts.valid_session_id(x_session_id) else carts.new_session_id()
 
 # Original status endpoints
 @api_router.post("/status", response_model=StatusCheck)
 async def create_status_check(input: StatusCheckCreate):
     status_dict = input.dict()
     status_obj = StatusCheck(**status_dict)
-    if db:
-        _ = await db.status_checks.insert_one(status_obj.dict())
+    if db is not None:
+        _ = await collection(db, "status_checks").insert_one(status_obj.dict())
     return status_obj
 
 @api_router.get("/status", response_model=List[StatusCheck])
 async def get_status_checks():
-    if not db:
+    if db is None:
         return []
     status_checks = await db.status_checks.find().to_list(1000)
     return [StatusCheck(**status_check) for status_check in status_checks]
 
+# Auth endpoints
+@api_router.post("/auth/register")
+async def register(request: auth.RegisterRequest):
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    try:
+        user = await auth.create_user(db, request.email, request.password, request.name)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="An account with this email already exists")
+    return {"token": auth.issue_token(user), "user": auth.public_user(user)}
+
+@api_router.post("/auth/login")
+async def login(request: auth.Credentials):
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    user = await auth.authenticate(db, request.email, request.password)
+    if user is None:
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+    return {"token": auth.issue_token(user), "user": auth.public_user(user)}
+
+@api_router.post("/auth/logout")
+async def logout(user: dict = Depends(auth.current_user)):
+    """Revoke the token used for this request"""
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    await auth.revoke(db, user)
+    return {"status": "ok"}
+
+@api_router.get("/auth/me")
+async def me(user: dict = Depends(auth.current_user)):
+    return {"id": user["sub"], "email": user["email"], "roles": user["roles"]}
+
 # Razorpay Payment Endpoints
-@api_router.post("/create-razorpay-order")
-async def create_razorpay_order(request: CreateOrderRequest):
+@api_router.post("/create-razorpay-order", openapi_extra=checkout.openapi_body(CreateOrderRequest))
+async def create_razorpay_order(
+    request: CreateOrderRequest = Depends(checkout.body(CreateOrderRequest)),
+    user: Optional[dict] = Depends(auth.optional_user)
+):
     """Create Razorpay order for payment"""
     try:
+        amount, items, base = request.amount, request.cart, None
+        if request.cart_id:
+            # Price the stored cart instead of trusting a client-sent amount
+            cart = await cart_store.get(request.cart_id)
+            if cart is None or not cart.items:
+                raise HTTPException(status_code=400, detail="Cart is empty")
+            priced = await carts.price(cart)
+            # Sold-out lines stay in the cart (and the shown subtotal) but can't be charged
+            unavailable = priced["unavailable"] + [line["variant_id"] for line in priced["items"] if not line["available"]]
+            if unavailable:
+                raise HTTPException(status_code=409, detail={"unavailable": unavailable})
+            amount, items = priced["subtotal"], carts.order_items(priced)
+            if request.currency != priced["currency"]:
+                # Charge in the shopper's currency; order lines (and fulfillment) keep store-currency prices
+                base = (amount, priced["currency"])
+                try:
+                    amount = fx.convert_minor(amount, priced["currency"], request.currency)
+                except ValueError as e:
+                    raise HTTPException(status_code=400, detail=str(e))
+        if not amount:
+            raise HTTPException(status_code=400, detail="amount or cart_id is required")
+        
         # Create order in Razorpay
         order_data = {
-            "amount": request.amount,
+            "amount": amount,
             "currency": request.currency,
             "receipt": f"order_{uuid.uuid4()}",
             "payment_capture": 1
         }
         
-        razorpay_order = razorpay_client.order.create(data=order_data)
+        with upstream("razorpay"), span("razorpay.order.create", amount=amount):
+            razorpay_order = razorpay_client.order.create(data=order_data)
         
         # Store order in database
-        if db:
-            order_record = {
-                "razorpay_order_id": razorpay_order["id"],
-                "amount": request.amount,
-                "currency": request.currency,
-                "cart": [item.dict() for item in request.cart],
-                "status": "created",
-                "created_at": datetime.utcnow()
-            }
-            await db.orders.insert_one(order_record)
+        if db is not None:
+            order_record = orders.new_order(
+                razorpay_order["id"], amount, request.currency, items, request.cart_id,
+                request.shipping_address.model_dump() if request.shipping_address else None,
+                user["sub"] if user else None, base
+            )
+            await collection(db, "orders").insert_one(order_record)
+            await stats.record(db, stats.CREATED, amount, request.currency, order_record[orders.CREATED_AT])
         
         return {
             "id": razorpay_order["id"],
@@ -266,11 +195,14 @@ async def create_razorpay_order(request: CreateOrderRequest):
             "status": razorpay_order["status"]
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
+        logger.exception(f"Razorpay order creation error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to create order: {str(e)}")
 
-@api_router.post("/verify-payment")
-async def verify_payment(request: VerifyPaymentRequest):
+@api_router.post("/verify-payment", openapi_extra=checkout.openapi_body(VerifyPaymentRequest))
+async def verify_payment(request: VerifyPaymentRequest = Depends(checkout.body(VerifyPaymentRequest))):
     """Verify Razorpay payment and create Shopify order"""
     try:
         # Verify payment signature
@@ -278,39 +210,28 @@ async def verify_payment(request: VerifyPaymentRequest):
         order_id = request.razorpay_order_id
         payment_id = request.razorpay_payment_id
         
-        # Create signature for verification
-        message = f"{order_id}|{payment_id}"
-        generated_signature = hmac.new(
-            settings.RAZORPAY_KEY_SECRET.encode(),
-            message.encode(),
-            hashlib.sha256
-        ).hexdigest()
-        
-        if not hmac.compare_digest(signature, generated_signature):
+        if not payment_signer.verify_payment(order_id, payment_id, signature):
             raise HTTPException(status_code=400, detail="Invalid payment signature")
         
         # Get payment details from Razorpay
-        payment = razorpay_client.payment.fetch(payment_id)
+        with upstream("razorpay"), span("razorpay.payment.fetch"):
+            payment = razorpay_client.payment.fetch(payment_id)
         
         if payment["status"] != "captured":
             raise HTTPException(status_code=400, detail="Payment not captured")
         
         # Update order status in database
-        if db:
-            await db.orders.update_one(
-                {"razorpay_order_id": order_id},
-                {
-                    "$set": {
-                        "razorpay_payment_id": payment_id,
-                        "status": "paid",
-                        "paid_at": datetime.utcnow(),
-                        "payment_details": payment
-                    }
-                }
-            )
+        if db is not None:
+            await orders.store_raw_payment(db, order_id, payment)
+            # A concurrent webhook may already have marked it paid; both are fine.
+            # The Shopify order and shipment are created by the outbox dispatcher.
+            if await outbox.mark_paid(client, db, order_id, orders.paid_fields(payment)):
+                await stats.record_order(db, order_id, stats.PAID)
         
-        # Here you can create Shopify order or send order details
-        # For now, we'll just return success
+        if request.cart_id:
+            cart = await cart_store.get(request.cart_id)
+            if cart is not None:
+                cart_store.clear(cart)
         
         return {
             "success": True,
@@ -320,21 +241,180 @@ async def verify_payment(request: VerifyPaymentRequest):
             "status": payment["status"]
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
+        logger.exception(f"Payment verification error: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Payment verification failed: {str(e)}")
 
+def owned_order_query(order_id: str, user: dict) -> dict:
+    """Filter for an order the user may see: their own, or any for admins"""
+    query = {orders.ORDER_ID: order_id}
+    if not auth.is_admin(user):
+        query[orders.USER_ID] = user["sub"]
+    return query
+
+@api_router.post("/shipping/create-order", openapi_extra=checkout.openapi_body(ShippingOrderRequest))
+async def create_shipping_order(
+    request: ShippingOrderRequest = Depends(checkout.body(ShippingOrderRequest)),
+    user: dict = Depends(auth.current_user)
+):
+    """Queue a Shiprocket shipment for a paid order (optionally setting its address)"""
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    
+    query = owned_order_query(request.order_id, user)
+    projection = {orders.STATUS: 1, orders.SHIPPING_ADDRESS: 1, orders.SHIPMENT: 1}
+    order = await db.orders.find_one(query, projection)
+    if order is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    if order[orders.STATUS] != "paid":
+        raise HTTPException(status_code=409, detail="Order is not paid")
+    if request.shipping_address:
+        # The address can only change until a shipment exists
+        order = await collection(db, "orders").find_one_and_update(
+            {**query, orders.SHIPMENT: None},
+            {"$set": {orders.SHIPPING_ADDRESS: request.shipping_address.model_dump()}},
+            projection=projection,
+            return_document=ReturnDocument.AFTER,
+        )
+        if order is None:
+            raise HTTPException(status_code=409, detail="Order has already shipped")
+    if not order.get(orders.SHIPPING_ADDRESS):
+        raise HTTPException(status_code=400, detail="shipping_address is required")
+    
+    shipment = order.get(orders.SHIPMENT)
+    if shipment is None:
+        await outbox.enqueue(db, [request.order_id], kinds=[SHIPMENT], requeue=True)
+        return {"order_id": request.order_id, "status": "queued"}
+    return {
+        "order_id": request.order_id,
+        "status": "created",
+        "shiprocket_order_id": shipment["order_id"],
+        "shipment_id": shipment["shipment_id"],
+        "awb_code": shipment["awb"],
+    }
+
+@api_router.get("/shipping/track/{awb}")
+async def track_shipment(awb: str):
+    """Latest known status of a shipment, from the local tracking store"""
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    shipment = await tracking.get(db, awb)
+    if shipment is None:
+        raise HTTPException(status_code=404, detail="Shipment not found")
+    return shipment
+
+@api_router.get("/orders/{order_id}/track")
+async def track_order(order_id: str, user: dict = Depends(auth.current_user)):
+    """Tracking for an order's shipment"""
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    order = await db.orders.find_one(owned_order_query(order_id, user), {orders.SHIPMENT: 1})
+    if order is None:
+        raise HTTPException(status_code=404, detail="Order not found")
+    awb = (order.get(orders.SHIPMENT) or {}).get("awb")
+    shipment = await tracking.get(db, awb) if awb else None
+    return {"order_id": order_id, "tracking_number": awb, "tracking": shipment}
+
+# Cart endpoints
+@api_router.get("/cart")
+async def get_cart(cart_id: str = Depends(cart_session)):
+    """Priced cart for this session (amounts in paise)"""
+    return await carts.price(await cart_store.get_or_new(cart_id))
+
+async def _update_cart(cart_id: str, line: CartLineRequest, add: bool):
+    cart = await cart_store.get_or_new(cart_id)
+    if line.quantity > 0:
+        variant_id = orders.compact_variant_id(line.variant_id)
+        if not (await carts.variant_info([variant_id])):
+            raise HTTPException(status_code=404, detail="Product variant not found")
+    try:
+        if add:
+            cart_store.add(cart, line.variant_id, line.quantity)
+        else:
+            cart_store.set_quantity(cart, line.variant_id, line.quantity)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await carts.price(cart)
+
+@api_router.post("/cart", openapi_extra=checkout.openapi_body(CartLineRequest))
+async def add_to_cart(
+    line: CartLineRequest = Depends(checkout.body(CartLineRequest)),
+    cart_id: str = Depends(cart_session)
+):
+    """Add `quantity` of a variant to the cart"""
+    return await _update_cart(cart_id, line, add=True)
+
+@api_router.put("/cart", openapi_extra=checkout.openapi_body(CartLineRequest))
+async def set_cart_quantity(
+    line: CartLineRequest = Depends(checkout.body(CartLineRequest)),
+    cart_id: str = Depends(cart_session)
+):
+    """Set a variant's quantity; 0 removes it"""
+    return await _update_cart(cart_id, line, add=False)
+
+@api_router.delete("/cart/items/{variant_id}")
+async def remove_from_cart(variant_id: str, cart_id: str = Depends(cart_session)):
+    return await _update_cart(cart_id, CartLineRequest(variant_id=variant_id, quantity=0), add=False)
+
+@api_router.delete("/cart")
+async def clear_cart(cart_id: str = Depends(cart_session)):
+    cart = await cart_store.get(cart_id)
+    if cart is not None:
+        cart_store.clear(cart)
+    return await carts.price(cart or carts.Cart(cart_id))
+
+@api_router.post("/payment/webhook")
+async def razorpay_webhook(request: Request):
+    """Handle Razorpay payment.captured / payment.failed webhooks"""
+    if webhook_signer is None:
+        raise HTTPException(status_code=503, detail="Webhook secret not configured")
+    
+    body = await request.body()
+    if not webhook_signer.verify_webhook(body, request.headers.get("X-Razorpay-Signature", "")):
+        raise HTTPException(status_code=400, detail="Invalid webhook signature")
+    
+    event = json.loads(body)
+    payment = event.get("payload", {}).get("payment", {}).get("entity", {})
+    order_id = payment.get("order_id")
+    
+    status_by_event = {"payment.captured": "paid", "payment.failed": "failed"}
+    status = status_by_event.get(event.get("event"))
+    
+    if status and order_id and db is not None:
+        if payment.get("id"):
+            await orders.store_raw_payment(db, order_id, payment)
+        if status == "paid":
+            changed = await outbox.mark_paid(client, db, order_id, orders.paid_fields(payment))
+        else:
+            changed = await orders.transition_status(db, order_id, status, {orders.PAYMENT_ID: payment.get("id")})
+        if changed:
+            await stats.record_order(db, order_id, status)
+    
+    return {"status": "ok"}
+
 @api_router.get("/orders")
-async def get_orders():
-    """Get all orders"""
-    if not db:
+async def get_orders(user: dict = Depends(auth.current_user)):
+    """The signed-in customer's orders; admins see every order"""
+    if db is None:
         return {"orders": []}
     
-    orders = await db.orders.find().sort("created_at", -1).to_list(100)
-    return {"orders": orders}
+    # Legacy documents (not yet migrated) have no user id, so only admins see them
+    query = {} if auth.is_admin(user) else {orders.USER_ID: user["sub"]}
+    docs = await db.orders.find(query).sort(orders.CREATED_AT, -1).to_list(100)
+    expanded = []
+    for doc in docs:
+        try:
+            expanded.append(orders.expand_order(doc))
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Skipping unreadable order {doc.get('_id')}: {str(e)}")
+    return {"orders": expanded}
 
 # Shopify Products Endpoints (existing code...)
 @api_router.get("/products")
 async def get_products(
+    request: Request,
     first: int = Query(20, le=250),
     after: Optional[str] = None,
     collection_handle: Optional[str] = None,
@@ -342,9 +422,51 @@ async def get_products(
     sort_key: str = Query("CREATED_AT", regex="^(CREATED_AT|UPDATED_AT|TITLE|PRICE|BEST_SELLING|RELEVANCE)$"),
     reverse: bool = False,
     min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    currency: Optional[str] = Query(None, pattern="^[A-Z]{3}$", description="Show prices in this currency")
+):
+    """Fetch products with filtering and search capabilities (price filters are in the store currency)"""
+    display_currency(currency)
+    params = {"first": first, "after": after, "collection_handle": collection_handle, "search_query": search_query,
+              "sort_key": sort_key, "reverse": reverse, "min_price": min_price, "max_price": max_price}
+    warmup.record(params)
+    payload = await products_payload(**params)
+    if currency and currency != fx.table().base:
+        payload = fx.converted_payload(("products",) + tuple(params.values()), payload, currency)
+    return payload_response(payload, request.headers.get("accept-encoding"))
+
+def display_currency(code: Optional[str]) -> None:
+    if code and not fx.supported(code):
+        raise HTTPException(status_code=400, detail=f"Unsupported currency {code}")
+
+async def products_payload(
+    first: int = 20,
+    after: Optional[str] = None,
+    collection_handle: Optional[str] = None,
+    search_query: Optional[str] = None,
+    sort_key: str = "CREATED_AT",
+    reverse: bool = False,
+    min_price: Optional[float] = None,
     max_price: Optional[float] = None
 ):
-    """Fetch products with filtering and search capabilities"""
+    """Cached, compressed /api/products response; also used to warm the cache on startup"""
+    cache_key = ("products", first, after, collection_handle,
+                 search_query.strip().lower() if search_query else None,
+                 sort_key, reverse, min_price, max_price)
+    cached = catalog.cached_response(cache_key)
+    if cached is not None:
+        return cached
+    
+    # Price ranges (and their follow-up pages) are answered from the local price index
+    wants_local = (min_price is not None or max_price is not None
+                   or (after is not None and after.startswith(price_index.CURSOR_PREFIX)))
+    if wants_local and price_index.can_answer(search_query, sort_key, after):
+        with span("price_index.query", kind="internal"):
+            result = price_index.query(first, after, collection_handle, sort_key, reverse, min_price, max_price)
+        result["products"] = [availability.apply(p) for p in result["products"]]
+        handles = [p["handle"] for p in result["products"]]
+        availability.touch(handles)
+        return catalog.store_response(cache_key, result, handles=handles)
     
     # Build GraphQL query
     query_filters = []
@@ -368,48 +490,7 @@ async def get_products(
         products(first: $first, after: $after, query: $query, sortKey: $sortKey, reverse: $reverse) {
             edges {
                 node {
-                    id
-                    title
-                    handle
-                    description
-                    vendor
-                    productType
-                    tags
-                    createdAt
-                    updatedAt
-                    images(first: 5) {
-                        edges {
-                            node {
-                                id
-                                url
-                                altText
-                                width
-                                height
-                            }
-                        }
-                    }
-                    variants(first: 10) {
-                        edges {
-                            node {
-                                id
-                                title
-                                price {
-                                    amount
-                                    currencyCode
-                                }
-                                compareAtPrice {
-                                    amount
-                                    currencyCode
-                                }
-                                availableForSale
-                                quantityAvailable
-                                selectedOptions {
-                                    name
-                                    value
-                                }
-                            }
-                        }
-                    }
+                    ...ProductFields
                 }
                 cursor
             }
@@ -421,7 +502,7 @@ async def get_products(
             }
         }
     }
-    """
+    """ + catalog.PRODUCT_FIELDS
     
     variables = {
         "first": first,
@@ -432,36 +513,187 @@ async def get_products(
     }
     
     try:
-        async with httpx.AsyncClient() as http_client:
-            response = await http_client.post(
-                f"https://{settings.SHOPIFY_STORE_DOMAIN}/api/{settings.SHOPIFY_API_VERSION}/graphql.json",
-                headers={
-                    "Content-Type": "application/json",
-                    "X-Shopify-Storefront-Access-Token": settings.SHOPIFY_STOREFRONT_ACCESS_TOKEN
-                },
-                json={"query": graphql_query, "variables": variables},
-                timeout=30.0
-            )
-            
-            if response.status_code != 200:
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Shopify API error: {response.text}"
-                )
-                
-            result = response.json()
-            
-            if "errors" in result:
-                raise HTTPException(status_code=400, detail=result["errors"])
-                
-            return {
-                "products": [edge["node"] for edge in result["data"]["products"]["edges"]],
-                "pageInfo": result["data"]["products"]["pageInfo"],
-                "totalCount": len(result["data"]["products"]["edges"])
-            }
+        data = await catalog.storefront(graphql_query, variables)
+        products = [edge["node"] for edge in data["products"]["edges"]]
+        
+        # Listing pages warm the per-handle cache used by product pages
+        catalog.warm(products)
+        availability.record(products)
+        handles = [p["handle"] for p in products]
+        availability.touch(handles)
+        
+        return catalog.store_response(cache_key, {
+            "products": products,
+            "pageInfo": data["products"]["pageInfo"],
+            "totalCount": len(products)
+        }, handles=handles)
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/products:batch")
+async def get_products_batch(handles: str = Query(..., description="Comma-separated product handles")):
+    """Fetch several products by handle, served from the product cache when warm"""
+    requested = list(dict.fromkeys(h.strip() for h in handles.split(",") if h.strip()))
+    if len(requested) > catalog.MAX_BATCH_HANDLES:
+        raise HTTPException(status_code=400, detail=f"At most {catalog.MAX_BATCH_HANDLES} handles per request")
+    
+    try:
+        found = await catalog.get_products_by_handle(requested)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    availability.touch(h for h in requested if found[h] is not None)
+    return {
+        "products": [availability.apply(found[h]) for h in requested if found[h] is not None],
+        "missing": [h for h in requested if found[h] is None]
+    }
+
+@api_router.get("/products/{handle}")
+async def get_product(
+    handle: str,
+    request: Request,
+    currency: Optional[str] = Query(None, pattern="^[A-Z]{3}$", description="Show prices in this currency")
+):
+    """Fetch a single product by handle"""
+    display_currency(currency)
+    payload = catalog.cached_response(("product", handle))
+    if payload is None:
+        try:
+            product = await catalog.get_product(handle)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
         
+        if product is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        payload = catalog.store_response(
+            ("product", handle), {"product": availability.apply(product)}, ttl=settings.PRODUCT_CACHE_TTL_SECONDS
+        )
+    availability.touch([handle])
+    if currency and currency != fx.table().base:
+        payload = fx.converted_payload(("product", handle), payload, currency, ttl=settings.PRODUCT_CACHE_TTL_SECONDS)
+    return payload_response(payload, request.headers.get("accept-encoding"))
+
+@api_router.post("/webhooks/shopify/products-update")
+async def shopify_products_webhook(request: Request):
+    """Push stock changes from Shopify products/update webhooks into the availability cache"""
+    if shopify_webhook_signer is None:
+        raise HTTPException(status_code=503, detail="Webhook secret not configured")
+    
+    body = await request.body()
+    if not shopify_webhook_signer.verify(body, request.headers.get("X-Shopify-Hmac-Sha256", "")):
+        raise HTTPException(status_code=400, detail="Invalid webhook signature")
+    
+    availability.apply_webhook(json.loads(body))
+    return {"status": "ok"}
+
+@api_router.get("/collections")
+@api_router.get("/categories")
+async def get_collections(request: Request):
+    """List collections with product counts"""
+    try:
+        await catalog_sync.ensure_loaded()
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    
+    return payload_response(facets.collections_payload(), request.headers.get("accept-encoding"))
+
+@api_router.get("/facets")
+async def get_facets(request: Request, collection_handle: Optional[str] = None):
+    """Counts by collection, vendor, productType, tag and price bucket for filter UIs"""
+    try:
+        await catalog_sync.ensure_loaded()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return payload_response(facets.facets_payload(collection_handle), request.headers.get("accept-encoding"))
+
+@api_router.get("/homepage")
+async def get_homepage(request: Request):
+    """Products, collections and hero data for the storefront homepage in one response"""
+    try:
+        payload = await homepage.get_payload()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    return payload_response(payload, request.headers.get("accept-encoding"), cache_control="public, max-age=60")
+
+# Guard for /api/admin routes: a Bearer token with the admin role
+require_admin = auth.require_role(auth.ADMIN)
+
+@api_router.get("/admin/traces", dependencies=[Depends(require_admin)])
+async def get_traces(trace_id: Optional[str] = None, limit: int = Query(500, le=10000)):
+    """Recent sampled spans from the in-memory exporter, newest last"""
+    spans = tracing.recent(trace_id)
+    return {"spans": spans[-limit:], "count": len(spans)}
+
+@api_router.get("/admin/profile", dependencies=[Depends(require_admin)], response_class=PlainTextResponse)
+async def get_profile(
+    seconds: float = Query(10, gt=0),
+    interval_ms: float = Query(5, ge=1, le=1000),
+    loop_only: bool = False
+):
+    """Sample this worker's stacks for N seconds; returns collapsed stacks for flamegraph tools"""
+    if seconds > settings.PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be <= {settings.PROFILE_MAX_SECONDS}")
+    stacks = await profiling.profile(seconds, interval_ms / 1000, loop_only)
+    if stacks is None:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return PlainTextResponse(stacks, headers={"Content-Disposition": "attachment; filename=profile.collapsed"})
+
+@api_router.get("/admin/jobs", dependencies=[Depends(require_admin)])
+async def get_jobs():
+    """Scheduled jobs on this worker: run counts, failures, timeouts, last duration and next run"""
+    return jobs.metrics()
+
+@api_router.get("/admin/loop-lag", dependencies=[Depends(require_admin)])
+async def get_loop_lag():
+    """Event-loop stalls seen by the watchdog, with the stack that blocked the loop"""
+    if loop_watchdog is None:
+        raise HTTPException(status_code=404, detail="Loop watchdog disabled")
+    return loop_watchdog.stats()
+
+@api_router.post("/admin/shipping/track", dependencies=[Depends(require_admin)])
+async def bulk_track_shipments(request: tracking.BulkTrackRequest):
+    """Tracking for many AWBs at once, or the most recently updated shipments in a status"""
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    shipments = await tracking.bulk_query(db, request.awbs, request.status, request.limit)
+    return {"shipments": shipments, "count": len(shipments)}
+
+@api_router.get("/admin/stats", dependencies=[Depends(require_admin)])
+@api_router.get("/admin/dashboard", dependencies=[Depends(require_admin)])
+async def get_stats(days: int = Query(30, ge=1, le=stats.MAX_DAYS), granularity: str = Query("day", pattern="^(day|hour)$")):
+    """Order counts, revenue and conversion per day or hour, from materialized buckets"""
+    if db is None:
+        raise HTTPException(status_code=503, detail="Database unavailable")
+    end = datetime.utcnow()
+    start = (end - timedelta(days=days - 1)).replace(hour=0)
+    result = await stats.read(db, start, end, stats.DAY if granularity == "day" else stats.HOUR)
+    return {"days": days, **result}
+
+@api_router.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and the event loop is answering"""
+    return {"status": "ok"}
+
+@api_router.get("/readyz")
+async def readyz():
+    """Load balancer readiness from cached checks: cache warmed and required dependencies healthy"""
+    dependencies = health.snapshot()
+    ready = warmup.ready.is_set() and dependencies["healthy"]
+    body = {"ready": ready, "warmup": warmup.status, "dependencies": dependencies["dependencies"]}
+    return JSONResponse(jsonable_encoder(body), status_code=200 if ready else 503)
 
 # Root endpoint
 @api_router.get("/")
@@ -471,6 +703,28 @@ async def root():
 # Include the router in the main app
 app.include_router(api_router)
 
+if settings.RATE_LIMIT_BACKEND == "mongo" and db is not None:
+    rate_limiter = MongoLimiter(db)
+else:
+    rate_limiter = MemoryLimiter()
+
+if settings.RATE_LIMIT_ENABLED:
+    app.add_middleware(
+        RateLimitMiddleware,
+        limiter=rate_limiter,
+        trust_proxy_headers=settings.TRUST_PROXY_HEADERS,
+        proxy_hops=settings.TRUSTED_PROXY_HOPS,
+        api_keys=[key.strip() for key in settings.RATE_LIMIT_API_KEYS.split(",") if key.strip()],
+    )
+
+app.add_middleware(
+    checkout.BodySizeLimitMiddleware,
+    max_bytes=settings.MAX_CHECKOUT_BODY_BYTES,
+    paths=("/api/create-razorpay-order", "/api/verify-payment", "/api/cart", "/api/shipping"),
+)
+
+app.add_middleware(CompressionMiddleware, minimum_size=settings.COMPRESSION_MIN_SIZE)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -485,17 +739,92 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+app.add_middleware(RequestLoggingMiddleware, sample_rate=settings.LOG_SAMPLE_RATE)
+
+app.add_middleware(TracingMiddleware)
+
+background_tasks = []
+outbox_dispatcher = outbox.Dispatcher(
+    db, configured_adapters(), settings.OUTBOX_CONCURRENCY, settings.OUTBOX_MAX_ATTEMPTS,
+    settings.OUTBOX_RETRY_BASE_SECONDS, settings.OUTBOX_POLL_SECONDS,
 )
-logger = logging.getLogger(__name__)
+loop_watchdog = profiling.LoopWatchdog(settings.LOOP_LAG_THRESHOLD_MS / 1000) if settings.LOOP_LAG_THRESHOLD_MS > 0 else None
+
+jobs = Scheduler(db)
+
+def schedule_jobs():
+    """Recurring work; singleton jobs run on one worker when several share the database"""
+    if settings.CATALOG_SYNC_INTERVAL_SECONDS > 0:
+        jobs.add("catalog.sync", lambda: catalog_sync.sync(settings.CATALOG_FULL_SYNC_EVERY),
+                 Interval(settings.CATALOG_SYNC_INTERVAL_SECONDS), jitter=30, timeout=600)
+    if settings.FX_REFRESH_SECONDS > 0:
+        jobs.add("fx.reload", fx.reload, Interval(settings.FX_REFRESH_SECONDS, immediate=False), timeout=10)
+    jobs.add("health.checks", lambda: health.check_all(db), Interval(settings.HEALTH_CHECK_SECONDS), jitter=1)
+    if settings.WARMUP_PERSIST_SECONDS > 0:
+        jobs.add("warmup.persist", lambda: warmup.persist(db),
+                 Interval(settings.WARMUP_PERSIST_SECONDS, immediate=False), jitter=30, timeout=60)
+    if settings.AVAILABILITY_POLL_SECONDS > 0:
+        jobs.add("availability.poll", availability.poll_once,
+                 Interval(settings.AVAILABILITY_POLL_SECONDS), jitter=5, timeout=60)
+    if db is None:
+        return
+    jobs.add("auth.revocations", lambda: auth.refresh_revocations(db),
+             Interval(settings.AUTH_REVOCATION_REFRESH_SECONDS), jitter=3, timeout=10)
+    jobs.add("carts.flush", cart_store.flush, Interval(settings.CART_FLUSH_SECONDS, immediate=False), timeout=30)
+    if SHIPMENT in outbox_dispatcher.adapters and settings.TRACKING_POLL_SECONDS > 0:
+        tracker = outbox_dispatcher.adapters[SHIPMENT]
+        jobs.add("tracking.refresh", lambda: tracking.refresh(db, tracker, settings.TRACKING_BATCH_SIZE),
+                 Interval(settings.TRACKING_POLL_SECONDS), jitter=10, timeout=300, singleton=True)
+    if settings.RECONCILE_INTERVAL_SECONDS > 0:
+        jobs.add("reconcile", lambda: reconcile_and_log(db, razorpay_client),
+                 Interval(settings.RECONCILE_INTERVAL_SECONDS), jitter=30, timeout=300, singleton=True)
+
+schedule_jobs()
+
+@app.on_event("startup")
+async def start_background_tasks():
+    if loop_watchdog is not None:
+        loop_watchdog.start()
+    homepage.refresh_in_background()
+    try:
+        fx.load(settings.FX_RATES_FILE)
+    except Exception as e:
+        logger.error(f"Could not load FX rates from {settings.FX_RATES_FILE}: {str(e)}")
+    background_tasks.append(asyncio.create_task(warmup.replay(db, products_payload)))
+    background_tasks.extend(images.start_workers())
+    if db is not None:
+        background_tasks.append(asyncio.create_task(orders.ensure_indexes(db)))
+        background_tasks.append(asyncio.create_task(auth.ensure_indexes(db)))
+        background_tasks.append(asyncio.create_task(cart_store.ensure_indexes()))
+        background_tasks.append(asyncio.create_task(tracking.ensure_indexes(db)))
+    if db is not None and settings.ADMIN_EMAIL and settings.ADMIN_PASSWORD:
+        background_tasks.append(asyncio.create_task(auth.ensure_admin(db, settings.ADMIN_EMAIL, settings.ADMIN_PASSWORD)))
+    if isinstance(rate_limiter, MongoLimiter):
+        background_tasks.append(asyncio.create_task(rate_limiter.ensure_indexes()))
+    if db is not None and settings.ORDER_MIGRATION_ON_STARTUP:
+        background_tasks.append(asyncio.create_task(orders.migrate_orders(db)))
+    # The dispatcher is a long-running consumer woken by enqueue(), not a periodic job
+    if db is not None and outbox_dispatcher.adapters:
+        background_tasks.append(asyncio.create_task(outbox_dispatcher.run_forever()))
+    jobs.start()
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await jobs.stop()
+    try:
+        await warmup.persist(db)
+    except Exception as e:
+        logger.warning(f"Could not persist warmup keys: {str(e)}")
+    for task in background_tasks:
+        task.cancel()
+    if loop_watchdog is not None:
+        loop_watchdog.stop()
+    await cart_store.flush()
+    await catalog.close()
     if client:
         client.close()
+    tracing.shutdown()
+    shutdown_logging()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,98 @@
+"""Razorpay and Shopify signature verification.
+
+The keyed HMAC state is built once per secret and copied for every message,
+so hot paths never re-encode the secret or re-run the key schedule.
+"""
+import base64
+import hashlib
+import hmac
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+# (razorpay_order_id, razorpay_payment_id, razorpay_signature)
+PaymentTriple = Tuple[str, str, str]
+
+# Below this many triples a process pool costs more than it saves
+BATCH_PARALLEL_THRESHOLD = 2000
+
+
+class RazorpaySigner:
+    """Keyed HMAC-SHA256 template for Razorpay payment and webhook signatures"""
+
+    def __init__(self, secret: str):
+        self._template = hmac.new(secret.encode(), digestmod=hashlib.sha256)
+
+    def sign(self, message: bytes) -> str:
+        mac = self._template.copy()
+        mac.update(message)
+        return mac.hexdigest()
+
+    def sign_payment(self, order_id: str, payment_id: str) -> str:
+        return self.sign(f"{order_id}|{payment_id}".encode())
+
+    def verify_payment(self, order_id: str, payment_id: str, signature: str) -> bool:
+        """Check the signature returned by Razorpay Checkout"""
+        return hmac.compare_digest(signature or "", self.sign_payment(order_id, payment_id))
+
+    def verify_webhook(self, body: bytes, signature: str) -> bool:
+        """Check the X-Razorpay-Signature header against the raw webhook body"""
+        return hmac.compare_digest(signature or "", self.sign(body))
+
+    def verify_many(self, triples: Iterable[PaymentTriple]) -> List[bool]:
+        return [self.verify_payment(o, p, s) for o, p, s in triples]
+
+
+class ShopifyWebhookSigner:
+    """Keyed HMAC-SHA256 template for X-Shopify-Hmac-Sha256 (base64 digest)"""
+
+    def __init__(self, secret: str):
+        self._template = hmac.new(secret.encode(), digestmod=hashlib.sha256)
+
+    def verify(self, body: bytes, signature: str) -> bool:
+        mac = self._template.copy()
+        mac.update(body)
+        return hmac.compare_digest((signature or "").encode(), base64.b64encode(mac.digest()))
+
+
+# Per-process signer used by pool workers, set by _init_worker
+_worker_signer: Optional[RazorpaySigner] = None
+
+
+def _init_worker(secret: str) -> None:
+    global _worker_signer
+    _worker_signer = RazorpaySigner(secret)
+
+
+def _verify_chunk(chunk: Sequence[PaymentTriple]) -> List[bool]:
+    return _worker_signer.verify_many(chunk)
+
+
+def verify_batch(
+    secret: str,
+    triples: Sequence[PaymentTriple],
+    processes: Optional[int] = None,
+    chunk_size: int = 5000,
+) -> List[bool]:
+    """Verify many payment signatures, in input order.
+
+    Large batches (offline reconciliation) are split into chunks and spread
+    across a process pool; small ones are verified inline.
+    """
+    triples = list(triples)
+    if processes is None:
+        processes = os.cpu_count() or 1
+
+    if processes <= 1 or len(triples) < BATCH_PARALLEL_THRESHOLD:
+        return RazorpaySigner(secret).verify_many(triples)
+
+    chunks = [triples[i:i + chunk_size] for i in range(0, len(triples), chunk_size)]
+    results: List[bool] = []
+    with ProcessPoolExecutor(
+        max_workers=min(processes, len(chunks)),
+        initializer=_init_worker,
+        initargs=(secret,),
+    ) as pool:
+        for chunk_result in pool.map(_verify_chunk, chunks):
+            results.extend(chunk_result)
+    return results
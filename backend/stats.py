@@ -0,0 +1,198 @@
+"""Materialized order aggregates for the admin dashboard.
+
+Every order event increments one hourly and one daily bucket document with
+$inc upserts. A bucket's _id is "<granularity>:<UTC bucket start>", e.g.
+"d:2026-10-19" or "h:2026-10-19T14". A date range is one _id range scan,
+so the dashboard reads O(buckets) documents however many orders exist.
+
+Counters per bucket:
+- created, paid, failed: order counts
+- created_value.<CUR>, revenue.<CUR>: paise per currency
+
+Events are only recorded when the write that caused them actually changed
+the order (transition_status / mark_paid returned True), so verify, webhook
+and reconciliation racing on one payment count it once. created and failed
+are bucketed by when they happened; paid is bucketed by the order's paid_at.
+
+Counters that drift (a crash between the order write and the $inc, or
+history from before this module) are recomputed from `orders`:
+
+    python stats.py rebuild --days 90
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo import ReplaceOne, UpdateOne
+
+import orders
+from config import settings
+from write_concerns import collection
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "order_stats"
+
+CREATED = "created"
+PAID = "paid"
+FAILED = "failed"
+# Event -> money counter it adds the order amount to (if any)
+AMOUNT_FIELDS = {CREATED: "created_value", PAID: "revenue", FAILED: None}
+
+DAY = "d"
+HOUR = "h"
+FORMATS = {DAY: "%Y-%m-%d", HOUR: "%Y-%m-%dT%H"}
+NAMES = {DAY: "day", HOUR: "hour"}
+MAX_DAYS = 366
+
+
+def bucket_id(granularity: str, at: datetime) -> str:
+    return f"{granularity}:{at.strftime(FORMATS[granularity])}"
+
+
+def _increments(event: str, amount: int, currency: str) -> Dict[str, int]:
+    inc = {event: 1}
+    if AMOUNT_FIELDS[event]:
+        inc[f"{AMOUNT_FIELDS[event]}.{currency}"] = int(amount)
+    return inc
+
+
+async def record(db, event: str, amount: int, currency: str, at: Optional[datetime] = None) -> None:
+    """Count one order event in its hourly and daily buckets.
+
+    Stats are derived data, so a failure is logged rather than failing the
+    payment request; `rebuild` repairs any gap.
+    """
+    at = at or datetime.utcnow()
+    inc = _increments(event, amount, currency)
+    try:
+        await collection(db, COLLECTION).bulk_write([
+            UpdateOne({"_id": bucket_id(granularity, at)}, {"$inc": inc}, upsert=True)
+            for granularity in (HOUR, DAY)
+        ], ordered=False)
+    except Exception as e:
+        logger.error(f"Failed to record {event} stats: {str(e)}")
+
+
+async def record_order(db, razorpay_order_id: str, event: str) -> None:
+    """record() for an order already in the database (status changes)"""
+    order = await db.orders.find_one(
+        {orders.ORDER_ID: razorpay_order_id}, {orders.AMOUNT: 1, orders.CURRENCY: 1, orders.PAID_AT: 1}
+    )
+    if order is not None:
+        at = order.get(orders.PAID_AT) if event == PAID else None
+        await record(db, event, order[orders.AMOUNT], order[orders.CURRENCY], at)
+
+
+def _empty_bucket(bucket: str) -> Dict[str, Any]:
+    return {"bucket": bucket, CREATED: 0, PAID: 0, FAILED: 0, "created_value": {}, "revenue": {}}
+
+
+def _add(total: Dict[str, Any], doc: Dict[str, Any]) -> None:
+    for counter in (CREATED, PAID, FAILED):
+        total[counter] += doc.get(counter, 0)
+    for field in ("created_value", "revenue"):
+        for currency, paise in (doc.get(field) or {}).items():
+            total[field][currency] = total[field].get(currency, 0) + paise
+
+
+async def read(db, start: datetime, end: datetime, granularity: str = DAY) -> Dict[str, Any]:
+    """Buckets from start to end inclusive, plus totals and conversion"""
+    docs = await db[COLLECTION].find({"_id": {
+        "$gte": bucket_id(granularity, start), "$lte": bucket_id(granularity, end),
+    }}).sort("_id", 1).to_list(None)
+
+    buckets: List[Dict[str, Any]] = []
+    totals = _empty_bucket("total")
+    for doc in docs:
+        bucket = _empty_bucket(doc["_id"].split(":", 1)[1])
+        _add(bucket, doc)
+        _add(totals, doc)
+        buckets.append(bucket)
+    del totals["bucket"]
+    totals["conversion_rate"] = round(totals[PAID] / totals[CREATED], 4) if totals[CREATED] else None
+    totals["average_order_value"] = {
+        currency: paise // totals[PAID] for currency, paise in totals["revenue"].items()
+    } if totals[PAID] else {}
+    return {"granularity": NAMES[granularity], "buckets": buckets, "totals": totals}
+
+
+async def rebuild(db, start: datetime, end: Optional[datetime] = None) -> int:
+    """Recompute every bucket from start (whole days) to end from `orders`.
+
+    Buckets in the range are replaced, so increments that land while the
+    rebuild runs can be lost. Run it in a quiet period, or rebuild only past
+    days. Returns the number of bucket documents written.
+    """
+    start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    end = end or datetime.utcnow()
+    buckets: Dict[str, Dict[str, Any]] = {}
+
+    def add(event: str, at: Optional[datetime], order: Dict[str, Any]) -> None:
+        if at is None or not start <= at <= end:
+            return
+        inc = _increments(event, order[orders.AMOUNT], order[orders.CURRENCY])
+        for granularity in (HOUR, DAY):
+            bucket = buckets.setdefault(bucket_id(granularity, at), {})
+            for field, value in inc.items():
+                bucket[field] = bucket.get(field, 0) + value
+
+    projection = {orders.AMOUNT: 1, orders.CURRENCY: 1, orders.STATUS: 1, orders.CREATED_AT: 1, orders.PAID_AT: 1}
+    cursor = db.orders.find({
+        orders.VERSION: orders.SCHEMA_VERSION,
+        "$or": [{orders.CREATED_AT: {"$gte": start}}, {orders.PAID_AT: {"$gte": start}}],
+    }, projection)
+    async for order in cursor:
+        add(CREATED, order.get(orders.CREATED_AT), order)
+        if order.get(orders.PAID_AT):
+            add(PAID, order[orders.PAID_AT], order)
+        if order.get(orders.STATUS) == FAILED:
+            # The failure time isn't stored; count it when the order was created
+            add(FAILED, order.get(orders.CREATED_AT), order)
+
+    stats = collection(db, COLLECTION)
+    await stats.delete_many({"$or": [
+        {"_id": {"$gte": bucket_id(granularity, start), "$lte": bucket_id(granularity, end)}}
+        for granularity in (HOUR, DAY)
+    ]})
+    operations = [ReplaceOne({"_id": _id}, _nest(counters), upsert=True) for _id, counters in buckets.items()]
+    if operations:
+        await stats.bulk_write(operations, ordered=False)
+    return len(operations)
+
+
+def _nest(counters: Dict[str, int]) -> Dict[str, Any]:
+    """{"revenue.INR": 5} -> {"revenue": {"INR": 5}}, as $inc would have stored it"""
+    doc: Dict[str, Any] = {}
+    for field, value in counters.items():
+        if "." in field:
+            parent, child = field.split(".", 1)
+            doc.setdefault(parent, {})[child] = value
+        else:
+            doc[field] = value
+    return doc
+
+
+def main() -> None:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Order stats tools")
+    parser.add_argument("command", choices=["rebuild"])
+    parser.add_argument("--days", type=int, default=30, help="rebuild this many days back, including today")
+    args = parser.parse_args()
+
+    async def run():
+        client = AsyncIOMotorClient(settings.MONGO_URL)
+        try:
+            db = client[settings.DB_NAME]
+            return await rebuild(db, datetime.utcnow() - timedelta(days=args.days - 1))
+        finally:
+            client.close()
+
+    print(f"Rebuilt {asyncio.run(run())} stats buckets")
+
+
+if __name__ == "__main__":
+    main()
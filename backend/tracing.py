@@ -0,0 +1,266 @@
+"""Minimal OpenTelemetry-style tracing without a collector.
+
+Spans carry W3C trace/span ids and nest through a contextvar, so
+`with span("razorpay.order.create"):` inside a request becomes a child of
+the request's server span. The sampling decision is made once per trace,
+at the root (or taken from an incoming `traceparent` header), at
+TRACE_SAMPLE_RATE. Mongo commands are traced by a pymongo command listener;
+Motor runs commands on its executor with the caller's context copied, so
+they attach to the active span.
+
+Finished spans of sampled traces go to an exporter:
+- "memory": the last TRACE_BUFFER_SIZE spans, readable via recent()
+- "file": JSON lines appended to TRACE_FILE by a background thread
+"""
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import monitoring
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "sampled", "kind",
+                 "start_ns", "end_ns", "attributes", "status", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool,
+                 kind: str = "internal", attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = dict(attributes or {})
+        self.status = "OK"
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException) -> None:
+        self.status = "ERROR"
+        self.error = f"{type(error).__name__}: {error}"
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        if self.end_ns is None:
+            self.end_ns = end_ns or time.time_ns()
+            if self.sampled and _exporter is not None:
+                _exporter.export(self)
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "kind": self.kind,
+            "start": self.start_ns / 1e9,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3) if self.end_ns else None,
+            "attributes": self.attributes,
+            "status": self.status,
+            "error": self.error,
+        }
+
+
+class InMemoryExporter:
+    def __init__(self, maxlen: int = 10000):
+        self._spans: deque = deque(maxlen=maxlen)
+
+    def export(self, span: Span) -> None:
+        # deque.append is atomic, so executor threads (Mongo spans) can export too
+        self._spans.append(span)
+
+    def spans(self, trace_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        return [s.to_dict() for s in list(self._spans) if trace_id is None or s.trace_id == trace_id]
+
+    def shutdown(self) -> None:
+        pass
+
+
+class FileExporter:
+    """Append spans as JSON lines from a background thread"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: "queue.SimpleQueue[Optional[Span]]" = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span) -> None:
+        self._queue.put(span)
+
+    def spans(self, trace_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        return []
+
+    def _run(self) -> None:
+        with open(self.path, "a", buffering=1) as f:
+            while True:
+                span = self._queue.get()
+                if span is None:
+                    return
+                f.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+    def shutdown(self) -> None:
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("current_span", default=None)
+_exporter = None
+_sample_rate = 0.0
+
+
+def configure(sample_rate: float, exporter: str = "memory", path: str = "traces.jsonl", buffer_size: int = 10000) -> None:
+    global _exporter, _sample_rate
+    _sample_rate = sample_rate
+    if exporter == "file":
+        _exporter = FileExporter(path)
+    elif exporter == "memory":
+        _exporter = InMemoryExporter(buffer_size)
+    else:
+        _exporter = None
+
+
+def shutdown() -> None:
+    if _exporter is not None:
+        _exporter.shutdown()
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def recent(trace_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Spans held by the exporter (in-memory exporter only)"""
+    return _exporter.spans(trace_id) if _exporter is not None else []
+
+
+def start_span(name: str, kind: str = "internal", attributes: Optional[Dict[str, Any]] = None,
+               parent: Optional[Tuple[str, str, bool]] = None) -> Span:
+    """Start a span under `parent` (trace_id, span_id, sampled) or the current span"""
+    if parent is None:
+        active = _current.get()
+        if active is not None:
+            parent = (active.trace_id, active.span_id, active.sampled)
+    if parent is None:
+        return Span(name, os.urandom(16).hex(), None, random.random() < _sample_rate, kind, attributes)
+    trace_id, parent_id, sampled = parent
+    return Span(name, trace_id, parent_id, sampled, kind, attributes)
+
+
+@contextmanager
+def span(name: str, kind: str = "client", **attributes):
+    """Trace the enclosed block as a child of the current span"""
+    active = start_span(name, kind, attributes)
+    token = _current.set(active)
+    try:
+        yield active
+    except BaseException as e:
+        active.record_error(e)
+        raise
+    finally:
+        _current.reset(token)
+        active.end()
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    parts = (value or "").split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return parts[1], parts[2], sampled
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Child spans for Mongo commands issued while a sampled span is active"""
+
+    def __init__(self):
+        self._open: Dict[Tuple[int, Any], Span] = {}
+        self._lock = threading.Lock()
+
+    def started(self, event) -> None:
+        parent = _current.get()
+        if parent is None or not parent.sampled:
+            return
+        target = event.command.get(event.command_name)
+        s = start_span(f"mongo.{event.command_name}", "client", {
+            "db.system": "mongodb",
+            "db.name": event.database_name,
+            "db.operation": event.command_name,
+            "db.mongodb.collection": target if isinstance(target, str) else None,
+        })
+        with self._lock:
+            self._open[(event.request_id, event.connection_id)] = s
+
+    def _finish(self, event, error: Optional[str] = None) -> None:
+        with self._lock:
+            s = self._open.pop((event.request_id, event.connection_id), None)
+        if s is None:
+            return
+        if error:
+            s.status, s.error = "ERROR", error
+        s.end(s.start_ns + event.duration_micros * 1000)
+
+    def succeeded(self, event) -> None:
+        self._finish(event)
+
+    def failed(self, event) -> None:
+        self._finish(event, str(event.failure.get("errmsg", event.failure)))
+
+
+class TracingMiddleware:
+    """Server span per HTTP request; honours and returns W3C traceparent"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        parent = parse_traceparent(Headers(scope=scope).get("traceparent"))
+        server_span = start_span(f"{scope['method']} {scope['path']}", "server", {
+            "http.method": scope["method"],
+            "http.target": scope["path"],
+        }, parent=parent)
+        token = _current.set(server_span)
+
+        async def send_with_trace(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                server_span.set_attribute("http.status_code", message["status"])
+                if message["status"] >= 500:
+                    server_span.status = "ERROR"
+                MutableHeaders(scope=message)["traceparent"] = server_span.traceparent
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        except BaseException as e:
+            server_span.record_error(e)
+            raise
+        finally:
+            _current.reset(token)
+            server_span.end()
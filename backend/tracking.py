@@ -0,0 +1,245 @@
+"""Local shipment tracking store.
+
+Tracking lookups are served from the `shipments` collection (keyed by AWB),
+never proxied to the courier. A background poller refreshes active AWBs in
+batches through the Shiprocket bulk tracking API. Each shipment records its
+next check time, and the interval depends on its status: out-for-delivery
+parcels are checked often, parcels awaiting pickup rarely, and delivered,
+returned or cancelled parcels never again.
+
+New AWBs are discovered from orders whose shipment (created by the outbox)
+has been assigned one. Shiprocket usually assigns the AWB after the ad-hoc
+order is created, so shipments created without one are looked up again
+every AWB_RECHECK_MINUTES until it appears.
+"""
+import logging
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional
+
+from pydantic import BaseModel, Field
+from pymongo import ASCENDING, UpdateOne
+
+import orders
+from write_concerns import collection
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "shipments"
+MAX_ACTIVITIES = 20
+BULK_QUERY_LIMIT = 500
+AWB_RECHECK_MINUTES = 15
+
+# Shipment document fields (_id is the AWB)
+ORDER_ID = orders.ORDER_ID
+STATUS = "st"
+COURIER_STATUS = "cs"   # courier's own status text
+COURIER = "cr"
+ETD = "etd"
+ACTIVITIES = "act"      # newest first: [{"at", "status", "location"}]
+UPDATED_AT = "ua"
+NEXT_CHECK = "nc"       # None once the status is terminal
+CREATED_AT = "ca"
+
+# Seconds between refreshes per status; None means terminal
+POLL_INTERVALS: Dict[str, Optional[int]] = {
+    "pending_pickup": 6 * 3600,
+    "in_transit": 2 * 3600,
+    "out_for_delivery": 30 * 60,
+    "exception": 60 * 60,
+    "rto": 6 * 3600,
+    "delivered": None,
+    "returned": None,
+    "cancelled": None,
+}
+
+# Shiprocket status text -> our status (checked in order, by prefix)
+STATUS_MAP = [
+    ("RTO DELIVERED", "returned"),
+    ("RTO", "rto"),
+    ("OUT FOR DELIVERY", "out_for_delivery"),
+    ("DELIVERED", "delivered"),
+    ("CANCEL", "cancelled"),
+    ("UNDELIVERED", "exception"),
+    ("NDR", "exception"),
+    ("LOST", "exception"),
+    ("NEW", "pending_pickup"),
+    ("AWB ASSIGNED", "pending_pickup"),
+    ("PICKUP", "pending_pickup"),
+    ("OUT FOR PICKUP", "pending_pickup"),
+]
+
+
+class BulkTrackRequest(BaseModel):
+    awbs: List[str] = Field([], max_length=BULK_QUERY_LIMIT)
+    status: Optional[str] = None
+    limit: int = Field(100, ge=1, le=BULK_QUERY_LIMIT)
+
+
+def normalize_status(courier_status: Optional[str]) -> str:
+    text = (courier_status or "").strip().upper().replace("_", " ")
+    for prefix, status in STATUS_MAP:
+        if text.startswith(prefix):
+            return status
+    return "in_transit"
+
+
+def next_check(status: str, now: datetime) -> Optional[datetime]:
+    interval = POLL_INTERVALS.get(status, POLL_INTERVALS["in_transit"])
+    if interval is None:
+        return None
+    # Jitter spreads batches out instead of every shipment coming due together
+    return now + timedelta(seconds=interval * random.uniform(0.9, 1.1))
+
+
+def to_api(doc: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "awb": doc["_id"],
+        "order_id": doc.get(ORDER_ID),
+        "status": doc.get(STATUS),
+        "courier_status": doc.get(COURIER_STATUS),
+        "courier": doc.get(COURIER),
+        "etd": doc.get(ETD),
+        "activities": doc.get(ACTIVITIES, []),
+        "updated_at": doc.get(UPDATED_AT),
+    }
+
+
+async def ensure_indexes(db) -> None:
+    await db[COLLECTION].create_index([(NEXT_CHECK, ASCENDING)], name="next_check", sparse=True)
+    await db[COLLECTION].create_index([(STATUS, ASCENDING), (UPDATED_AT, ASCENDING)], name="status_updated")
+
+
+async def register(db, awbs: Dict[str, Dict[str, Any]]) -> int:
+    """Start tracking AWBs ({awb: {"order_id", "courier"}}); known AWBs are left alone"""
+    now = datetime.utcnow()
+    operations = [
+        UpdateOne({"_id": awb}, {"$setOnInsert": {
+            ORDER_ID: info.get("order_id"), COURIER: info.get("courier"),
+            STATUS: "pending_pickup", CREATED_AT: now, UPDATED_AT: now, NEXT_CHECK: now,
+        }}, upsert=True)
+        for awb, info in awbs.items()
+    ]
+    if not operations:
+        return 0
+    result = await collection(db, COLLECTION).bulk_write(operations, ordered=False)
+    return result.upserted_count
+
+
+async def assign_awbs(db, tracker, limit: int = 50) -> int:
+    """Store AWBs Shiprocket has assigned since the shipment was created"""
+    now = datetime.utcnow()
+    shipment = orders.SHIPMENT
+    pending = await db.orders.find(
+        {
+            f"{shipment}.shipment_id": {"$ne": None},
+            f"{shipment}.awb": {"$not": {"$type": "string"}},
+            f"{shipment}.awb_checked_at": {"$not": {"$gt": now - timedelta(minutes=AWB_RECHECK_MINUTES)}},
+        },
+        {shipment: 1},
+    ).to_list(limit)
+    assigned = 0
+    for order in pending:
+        update = {f"{shipment}.awb_checked_at": now}
+        try:
+            found = await tracker.shipment_awb(order[shipment]["shipment_id"])
+        except Exception as e:
+            logger.warning(f"AWB lookup failed for shipment {order[shipment]['shipment_id']}: {str(e)}")
+            found = None
+        if found:
+            update[f"{shipment}.awb"] = found["awb"]
+            if found.get("courier"):
+                update[f"{shipment}.courier"] = found["courier"]
+            assigned += 1
+        await collection(db, "orders").update_one({"_id": order["_id"]}, {"$set": update})
+    return assigned
+
+
+async def discover(db, limit: int = 500) -> int:
+    """Register AWBs assigned to outbox-created shipments since the last pass"""
+    field = f"{orders.SHIPMENT}.awb"
+    found = await db.orders.find(
+        {field: {"$type": "string"}, f"{orders.SHIPMENT}.tracked": {"$ne": True}},
+        {orders.ORDER_ID: 1, orders.SHIPMENT: 1},
+    ).to_list(limit)
+    if not found:
+        return 0
+    registered = await register(db, {
+        o[orders.SHIPMENT]["awb"]: {"order_id": o[orders.ORDER_ID], "courier": o[orders.SHIPMENT].get("courier")}
+        for o in found
+    })
+    await collection(db, "orders").update_many(
+        {"_id": {"$in": [o["_id"] for o in found]}},
+        {"$set": {f"{orders.SHIPMENT}.tracked": True}},
+    )
+    return registered
+
+
+def parse_tracking(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Fields to $set from one AWB's Shiprocket tracking_data (None if not usable)"""
+    tracking = (data or {}).get("tracking_data") or {}
+    tracks = tracking.get("shipment_track") or []
+    track = tracks[0] if tracks else {}
+    courier_status = track.get("current_status")
+    if not courier_status:
+        return None
+    activities = [
+        {"at": a.get("date"), "status": a.get("sr-status-label") or a.get("activity"), "location": a.get("location")}
+        for a in (tracking.get("shipment_track_activities") or [])[:MAX_ACTIVITIES]
+    ]
+    fields = {STATUS: normalize_status(courier_status), COURIER_STATUS: courier_status, ACTIVITIES: activities}
+    if track.get("courier_name"):
+        fields[COURIER] = track["courier_name"]
+    if tracking.get("etd") or track.get("edd"):
+        fields[ETD] = tracking.get("etd") or track.get("edd")
+    return fields
+
+
+async def refresh_once(db, tracker, batch_size: int = 50, limit: int = 1000) -> int:
+    """Refresh due shipments in batches; returns shipments updated"""
+    now = datetime.utcnow()
+    due = await db[COLLECTION].find(
+        {NEXT_CHECK: {"$lte": now}}, {"_id": 1, STATUS: 1}
+    ).sort(NEXT_CHECK, ASCENDING).to_list(limit)
+    updated = 0
+    for i in range(0, len(due), batch_size):
+        batch = due[i:i + batch_size]
+        results = await tracker.track_awbs([d["_id"] for d in batch])
+        checked = datetime.utcnow()
+        operations = []
+        for doc in batch:
+            fields = parse_tracking(results.get(doc["_id"]))
+            status = fields[STATUS] if fields else doc[STATUS]
+            update = {NEXT_CHECK: next_check(status, checked)}
+            if fields:
+                update.update(fields)
+                update[UPDATED_AT] = checked
+            operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+        await collection(db, COLLECTION).bulk_write(operations, ordered=False)
+        updated += len(operations)
+    return updated
+
+
+async def get(db, awb: str) -> Optional[Dict[str, Any]]:
+    doc = await db[COLLECTION].find_one({"_id": awb})
+    return to_api(doc) if doc else None
+
+
+async def bulk_query(db, awbs: Iterable[str] = (), status: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+    query: Dict[str, Any] = {}
+    awbs = list(awbs)
+    if awbs:
+        query["_id"] = {"$in": awbs}
+    if status:
+        query[STATUS] = status
+    docs = await db[COLLECTION].find(query).sort(UPDATED_AT, -1).to_list(len(awbs) or limit)
+    return [to_api(doc) for doc in docs]
+
+
+async def refresh(db, tracker, batch_size: int = 50) -> None:
+    """Scheduled pass: fetch newly assigned AWBs, start tracking them, then refresh the ones that are due"""
+    await assign_awbs(db, tracker)
+    registered = await discover(db)
+    updated = await refresh_once(db, tracker, batch_size)
+    if registered or updated:
+        logger.info(f"Tracking: {registered} new AWBs, {updated} shipments refreshed")
@@ -0,0 +1,140 @@
+"""Warm the product listing cache from recorded traffic.
+
+Every /api/products request counts its normalized query (search lowercased,
+cursors dropped) in memory. A scheduled job adds these counts to the
+`warm_keys` collection, or to WARMUP_FILE when there is no database, and then
+resets them. Keys unseen for WARMUP_KEY_TTL_DAYS expire.
+
+On startup, replay() loads the top WARMUP_KEYS queries and runs them against
+the listing cache at WARMUP_RATE_PER_SECOND. It stops after
+WARMUP_MAX_SECONDS. /api/readyz reports 503 until replay finishes, so the
+load balancer only sends traffic to a warm worker and the first minutes
+after a deploy don't all go to Shopify.
+"""
+import asyncio
+import heapq
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import DESCENDING, UpdateOne
+
+from config import settings
+from write_concerns import collection
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "warm_keys"
+# Bounds memory between persists; the long tail is pruned back to 2x WARMUP_KEYS
+MAX_TRACKED = settings.WARMUP_KEYS * 10
+
+_counts: Dict[str, int] = {}
+ready = asyncio.Event()
+status: Dict[str, Any] = {"keys": 0, "warmed": 0, "failed": 0, "seconds": None}
+
+
+def normalize(params: Dict[str, Any]) -> Optional[str]:
+    """Stable key for a listing query; None for cursor pages, which can't be replayed"""
+    if params.get("after") is not None:
+        return None
+    params = {k: v for k, v in params.items() if v is not None and k != "after"}
+    if isinstance(params.get("search_query"), str):
+        params["search_query"] = params["search_query"].strip().lower()
+    return json.dumps(params, sort_keys=True, separators=(",", ":"))
+
+
+def record(params: Dict[str, Any]) -> None:
+    key = normalize(params)
+    if key is None:
+        return
+    _counts[key] = _counts.get(key, 0) + 1
+    if len(_counts) > MAX_TRACKED:
+        keep = heapq.nlargest(settings.WARMUP_KEYS * 2, _counts.items(), key=lambda item: item[1])
+        _counts.clear()
+        _counts.update(keep)
+
+
+def _read_file() -> Dict[str, int]:
+    try:
+        with open(settings.WARMUP_FILE) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+async def persist(db) -> int:
+    """Add the counts seen since the last persist; returns keys written"""
+    if not _counts:
+        return 0
+    counts = dict(_counts)
+    _counts.clear()
+    if db is None:
+        merged = _read_file()
+        for key, count in counts.items():
+            merged[key] = merged.get(key, 0) + count
+        top = dict(heapq.nlargest(MAX_TRACKED, merged.items(), key=lambda item: item[1]))
+        tmp = f"{settings.WARMUP_FILE}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(top, f)
+        os.replace(tmp, settings.WARMUP_FILE)
+        return len(counts)
+    now = datetime.utcnow()
+    await collection(db, COLLECTION).bulk_write([
+        UpdateOne({"_id": key}, {"$inc": {"n": count}, "$set": {"seen": now}}, upsert=True)
+        for key, count in counts.items()
+    ], ordered=False)
+    return len(counts)
+
+
+async def top_keys(db, limit: int) -> List[Dict[str, Any]]:
+    if db is None:
+        keys = heapq.nlargest(limit, _read_file().items(), key=lambda item: item[1])
+        return [json.loads(key) for key, _ in keys]
+    docs = await db[COLLECTION].find({}, {"_id": 1}).sort("n", DESCENDING).to_list(limit)
+    return [json.loads(doc["_id"]) for doc in docs]
+
+
+async def ensure_indexes(db) -> None:
+    await db[COLLECTION].create_index([("n", DESCENDING)], name="n")
+    await db[COLLECTION].create_index("seen", expireAfterSeconds=settings.WARMUP_KEY_TTL_DAYS * 86400)
+
+
+async def _replay(db, fetch: Callable[..., Awaitable[Any]]) -> None:
+    if db is not None:
+        await ensure_indexes(db)
+    keys = await top_keys(db, settings.WARMUP_KEYS)
+    status["keys"] = len(keys)
+
+    async def warm(params: Dict[str, Any]) -> None:
+        try:
+            await fetch(**params)
+            status["warmed"] += 1
+        except Exception as e:
+            status["failed"] += 1
+            logger.warning(f"Warmup query {params} failed: {str(e)}")
+
+    # Start queries at a fixed rate rather than all at once; they may overlap
+    tasks = []
+    for params in keys:
+        tasks.append(asyncio.create_task(warm(params)))
+        await asyncio.sleep(1 / settings.WARMUP_RATE_PER_SECOND)
+    if tasks:
+        await asyncio.wait(tasks)
+
+
+async def replay(db, fetch: Callable[..., Awaitable[Any]]) -> None:
+    """Run the top recorded queries through `fetch(**params)`, then set `ready`"""
+    started = time.monotonic()
+    try:
+        await asyncio.wait_for(_replay(db, fetch), timeout=settings.WARMUP_MAX_SECONDS)
+    except asyncio.TimeoutError:
+        logger.warning(f"Cache warmup stopped after {settings.WARMUP_MAX_SECONDS}s")
+    except Exception as e:
+        logger.error(f"Cache warmup failed: {str(e)}")
+    finally:
+        status["seconds"] = round(time.monotonic() - started, 2)
+        logger.info(f"Cache warmup: {status['warmed']}/{status['keys']} queries in {status['seconds']}s")
+        ready.set()
@@ -0,0 +1,51 @@
+"""Per-collection, per-operation write concern policy.
+
+Telemetry writes (status_checks) are fire-and-forget or single-node acked;
+anything that moves money waits for a journaled majority.
+
+    await collection(db, "orders", "payment").update_one(...)
+"""
+from typing import Dict, Optional, Tuple
+
+from pymongo.write_concern import WriteConcern
+
+from config import settings
+
+TELEMETRY = WriteConcern(w=settings.TELEMETRY_WRITE_W)
+STANDARD = WriteConcern(w=1)
+PAYMENTS = WriteConcern(w="majority", j=True)
+
+# (collection, operation) -> write concern; operation "*" is the collection default
+POLICY: Dict[Tuple[str, str], WriteConcern] = {
+    ("status_checks", "*"): TELEMETRY,
+    ("orders", "*"): STANDARD,
+    ("orders", "payment"): PAYMENTS,
+    ("orders", "migrate"): STANDARD,
+    ("payments_raw", "*"): STANDARD,
+    ("rate_limits", "*"): STANDARD,
+    ("carts", "*"): STANDARD,
+    ("outbox", "*"): STANDARD,
+    ("shipments", "*"): STANDARD,
+    # Revenue counters: acked so a lost $inc is logged (and fixable with `stats.py rebuild`)
+    ("order_stats", "*"): STANDARD,
+    ("users", "*"): STANDARD,
+    ("revoked_tokens", "*"): STANDARD,
+    ("warm_keys", "*"): TELEMETRY,
+}
+
+_collections: Dict[Tuple[int, str, str], object] = {}
+
+
+def write_concern_for(name: str, operation: str = "*") -> Optional[WriteConcern]:
+    return POLICY.get((name, operation)) or POLICY.get((name, "*"))
+
+
+def collection(db, name: str, operation: str = "*"):
+    """db[name] configured with the policy's write concern for `operation`"""
+    key = (id(db), name, operation)
+    coll = _collections.get(key)
+    if coll is None:
+        concern = write_concern_for(name, operation)
+        coll = db[name] if concern is None else db[name].with_options(write_concern=concern)
+        _collections[key] = coll
+    return coll
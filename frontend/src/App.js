@@ -6,12 +6,11 @@ function App() {
   const [collections, setCollections] = useState([]);
   const [loading, setLoading] = useState(true);
   const [currentImageIndex, setCurrentImageIndex] = useState(0);
-  const [cart, setCart] = useState([]);
+  const [cart, setCart] = useState({ items: [], item_count: 0, subtotal: 0 });
   const [showCart, setShowCart] = useState(false);
 
   // Configuration
   const SHOPIFY_DOMAIN = 'j0dktb-z1.myshopify.com';
-  const STOREFRONT_ACCESS_TOKEN = 'eeae7a5247421a8b8a14711145ecd93b'; // Fixed token
   const RAZORPAY_KEY_ID = 'rzp_live_NIogFPd28THyOF'; // Your live key
   const API_BASE_URL = process.env.REACT_APP_BACKEND_URL ? `${process.env.REACT_APP_BACKEND_URL}/api` : '/api';
 
@@ -29,8 +28,8 @@ function App() {
     };
   }, []);
 
-  // Beautiful Indian fashion hero images
-  const heroImages = [
+  // Beautiful Indian fashion hero images (replaced by the backend's hero data once loaded)
+  const [heroImages, setHeroImages] = useState([
     {
       url: "https://images.unsplash.com/photo-1617627143750-d86bc21e42bb",
       alt: "Vibrant red saree with traditional jewelry"
@@ -43,64 +42,21 @@ function App() {
       url: "https://images.unsplash.com/photo-1619715613791-89d35b51ff81",
       alt: "Green traditional outfit with modern styling"
     }
-  ];
+  ]);
 
-  // Fetch products from Shopify
+  // Fetch homepage products, collections and hero data from the backend
   const fetchShopifyProducts = async () => {
-    const query = `
-      {
-        products(first: 12) {
-          edges {
-            node {
-              id
-              title
-              handle
-              description
-              images(first: 1) {
-                edges {
-                  node {
-                    url
-                    altText
-                  }
-                }
-              }
-              variants(first: 1) {
-                edges {
-                  node {
-                    id
-                    price {
-                      amount
-                      currencyCode
-                    }
-                    compareAtPrice {
-                      amount
-                      currencyCode
-                    }
-                    availableForSale
-                  }
-                }
-              }
-              vendor
-              productType
-            }
-          }
-        }
-      }
-    `;
-
     try {
-      const response = await fetch(`https://${SHOPIFY_DOMAIN}/api/2024-01/graphql.json`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-          'X-Shopify-Storefront-Access-Token': STOREFRONT_ACCESS_TOKEN,
-        },
-        body: JSON.stringify({ query }),
-      });
-
+      const response = await fetch(`${API_BASE_URL}/homepage`);
       const data = await response.json();
-      if (data.data && data.data.products) {
-        setProducts(data.data.products.edges.map(edge => edge.node));
+      if (data.products) {
+        setProducts(data.products);
+      }
+      if (data.collections) {
+        setCollections(data.collections);
+      }
+      if (data.hero && data.hero.length > 0) {
+        setHeroImages(data.hero);
       }
     } catch (error) {
       console.error('Error fetching products:', error);
@@ -124,52 +80,57 @@ function App() {
     return () => clearInterval(interval);
   }, [heroImages.length]);
 
-  // Cart functions
-  const addToCart = (product) => {
-    setCart(prevCart => {
-      const existingItem = prevCart.find(item => item.id === product.id);
-      if (existingItem) {
-        return prevCart.map(item =>
-          item.id === product.id
-            ? { ...item, quantity: item.quantity + 1 }
-            : item
-        );
-      }
-      return [...prevCart, { ...product, quantity: 1 }];
+  // Cart functions (the cart lives on the server, keyed by our session id)
+  const cartRequest = async (method, path = '', body) => {
+    const headers = { 'Content-Type': 'application/json' };
+    const sessionId = localStorage.getItem('cartSessionId');
+    if (sessionId) {
+      headers['X-Session-ID'] = sessionId;
+    }
+    const response = await fetch(`${API_BASE_URL}/cart${path}`, {
+      method,
+      headers,
+      body: body ? JSON.stringify(body) : undefined,
     });
-    alert('Product added to cart!');
+    if (!response.ok) {
+      throw new Error(`Cart request failed: ${response.status}`);
+    }
+    const data = await response.json();
+    localStorage.setItem('cartSessionId', data.id);
+    setCart(data);
+    return data;
   };
 
-  const removeFromCart = (productId) => {
-    setCart(prevCart => prevCart.filter(item => item.id !== productId));
-  };
+  useEffect(() => {
+    cartRequest('GET').catch(error => console.error('Error loading cart:', error));
+  }, []);
 
-  const updateQuantity = (productId, newQuantity) => {
-    if (newQuantity === 0) {
-      removeFromCart(productId);
-      return;
+  const addToCart = async (product) => {
+    const variant = product.variants.edges[0]?.node;
+    try {
+      await cartRequest('POST', '', { variant_id: variant.id, quantity: 1 });
+      alert('Product added to cart!');
+    } catch (error) {
+      console.error('Error adding to cart:', error);
+      alert('Could not add this product to the cart');
     }
-
-    setCart(prevCart =>
-      prevCart.map(item =>
-        item.id === productId
-          ? { ...item, quantity: newQuantity }
-          : item
-      )
-    );
   };
 
-  const getTotalAmount = () => {
-    return cart.reduce((total, item) => {
-      const price = parseFloat(item.variants.edges[0]?.node.price.amount || 0);
-      return total + (price * item.quantity);
-    }, 0);
+  const removeFromCart = (variantId) => {
+    cartRequest('DELETE', `/items/${variantId.split('/').pop()}`)
+      .catch(error => console.error('Error removing from cart:', error));
   };
 
-  const getTotalItems = () => {
-    return cart.reduce((total, item) => total + item.quantity, 0);
+  const updateQuantity = (variantId, newQuantity) => {
+    cartRequest('PUT', '', { variant_id: variantId, quantity: Math.max(newQuantity, 0) })
+      .catch(error => console.error('Error updating cart:', error));
   };
 
+  // Amounts from the server are in paise
+  const getTotalAmount = () => cart.subtotal / 100;
+
+  const getTotalItems = () => cart.item_count;
+
   const debugLog = (message, data) => {
     console.log(`[DEBUG] ${message}:`, data);
   };
@@ -179,7 +140,7 @@ function App() {
     const totalAmount = getTotalAmount();
     debugLog('Starting payment process', {
       totalAmount,
-      cartItems: cart.length,
+      cartItems: cart.items.length,
       apiUrl: API_BASE_URL
     });
 
@@ -195,15 +156,8 @@ function App() {
           'Content-Type': 'application/json',
         },
         body: JSON.stringify({
-          amount: Math.round(totalAmount * 100),
           currency: 'INR',
-          cart: cart.map(item => ({
-            id: item.id,
-            title: item.title,
-            quantity: item.quantity,
-            price: parseFloat(item.variants.edges[0]?.node.price.amount || 0),
-            handle: item.handle
-          }))
+          cart_id: cart.id
         }),
       });
 
@@ -243,13 +197,7 @@ function App() {
                 razorpay_order_id: response.razorpay_order_id,
                 razorpay_payment_id: response.razorpay_payment_id,
                 razorpay_signature: response.razorpay_signature,
-                cart: cart.map(item => ({
-                  id: item.id,
-                  title: item.title,
-                  quantity: item.quantity,
-                  price: parseFloat(item.variants.edges[0]?.node.price.amount || 0),
-                  handle: item.handle
-                }))
+                cart_id: cart.id
               }),
             });
 
@@ -257,7 +205,7 @@ function App() {
 
             if (result.success) {
               // Clear cart and show success
-              setCart([]);
+              await cartRequest('GET');
               alert('🎉 Payment successful! Your order has been placed successfully. You will receive confirmation shortly.');
             } else {
               alert('❌ Payment verification failed. Please contact our support team with payment ID: ' + response.razorpay_payment_id);
@@ -306,6 +254,9 @@ function App() {
           <div className="relative aspect-w-3 aspect-h-4 bg-gray-200">
             <img
               src={image.url}
+              srcSet={image.srcset}
+              sizes="(min-width: 1024px) 25vw, (min-width: 640px) 50vw, 100vw"
+              loading="lazy"
               alt={image.altText || product.title}
               className="w-full h-64 object-cover group-hover:scale-105 transition-transform duration-500"
             />
@@ -389,8 +340,8 @@ function App() {
       <section className="relative h-96 md:h-[600px] overflow-hidden">
         <div className="absolute inset-0">
           <img
-            src={heroImages[currentImageIndex].url}
-            alt={heroImages[currentImageIndex].alt}
+            src={heroImages[currentImageIndex % heroImages.length].url}
+            alt={heroImages[currentImageIndex % heroImages.length].alt}
             className="w-full h-full object-cover transition-all duration-1000"
           />
           <div className="absolute inset-0 bg-gradient-to-r from-black/60 via-black/30 to-transparent"></div>
@@ -467,32 +418,32 @@ function App() {
                 </button>
               </div>
 
-              {cart.length === 0 ? (
+              {cart.items.length === 0 ? (
                 <p className="text-gray-500 text-center py-8">Your cart is empty</p>
               ) : (
                 <>
-                  {cart.map((item) => (
-                    <div key={item.id} className="flex items-center gap-4 mb-4 p-4 border rounded-lg">
+                  {cart.items.map((item) => (
+                    <div key={item.variant_id} className="flex items-center gap-4 mb-4 p-4 border rounded-lg">
                       <img
-                        src={item.images.edges[0]?.node.url}
+                        src={item.image}
                         alt={item.title}
                         className="w-16 h-16 object-cover rounded"
                       />
                       <div className="flex-1">
                         <h4 className="font-semibold text-sm">{item.title}</h4>
                         <p className="text-orange-600 font-bold">
-                          {formatPrice(item.variants.edges[0]?.node.price)}
+                          {formatPrice({ amount: item.unit_price / 100 })}
                         </p>
                         <div className="flex items-center gap-2 mt-2">
                           <button
-                            onClick={() => updateQuantity(item.id, item.quantity - 1)}
+                            onClick={() => updateQuantity(item.variant_id, item.quantity - 1)}
                             className="w-8 h-8 rounded-full bg-gray-200 flex items-center justify-center"
                           >
                             -
                           </button>
                           <span className="w-8 text-center">{item.quantity}</span>
                           <button
-                            onClick={() => updateQuantity(item.id, item.quantity + 1)}
+                            onClick={() => updateQuantity(item.variant_id, item.quantity + 1)}
                             className="w-8 h-8 rounded-full bg-gray-200 flex items-center justify-center"
                           >
                             +
@@ -500,7 +451,7 @@ function App() {
                         </div>
                       </div>
                       <button
-                        onClick={() => removeFromCart(item.id)}
+                        onClick={() => removeFromCart(item.variant_id)}
                         className="text-red-500 hover:text-red-700"
                       >
                         🗑️
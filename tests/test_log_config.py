@@ -0,0 +1,69 @@
+import asyncio
+import json
+import logging
+import queue
+
+import pytest
+from starlette.responses import PlainTextResponse
+
+from log_config import ContextQueueHandler, JsonFormatter, RequestLoggingMiddleware
+
+
+@pytest.fixture
+def log_lines():
+    """Log through the queue handler and JSON formatter, as configure_logging() does"""
+    records: "queue.Queue[logging.LogRecord]" = queue.Queue()
+    logger = logging.getLogger("test_log_config")
+    handler = ContextQueueHandler(records)
+    logger.addHandler(handler)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    formatter = JsonFormatter()
+
+    def lines():
+        out = []
+        while not records.empty():
+            out.append(json.loads(formatter.format(records.get())))
+        return out
+
+    yield logger, lines
+    logger.removeHandler(handler)
+
+
+def test_exception_traceback_survives_the_queue(log_lines):
+    logger, lines = log_lines
+    try:
+        raise ValueError("kaboom")
+    except ValueError:
+        logger.exception("boom")
+    [entry] = lines()
+    assert entry["msg"] == "boom"
+    assert "Traceback" in entry["exc"]
+    assert "ValueError: kaboom" in entry["exc"]
+
+
+def test_plain_record_has_no_exc(log_lines):
+    logger, lines = log_lines
+    logger.info("hello %s", "world", extra={"path": "/api"})
+    [entry] = lines()
+    assert entry["msg"] == "hello world"
+    assert entry["path"] == "/api"
+    assert "exc" not in entry
+
+
+def test_non_utf8_request_id_gets_a_fresh_id():
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    scope = {"type": "http", "method": "GET", "path": "/", "query_string": b"",
+             "headers": [(b"x-request-id", b"ab\xffcd")]}
+    app = RequestLoggingMiddleware(PlainTextResponse("ok"))
+    asyncio.run(app(scope, receive, send))
+    assert sent[0]["status"] == 200
+    request_id = dict(sent[0]["headers"])[b"x-request-id"]
+    assert len(request_id) == 32 and int(request_id, 16) >= 0
@@ -0,0 +1,166 @@
+"""Outbox dispatcher against in-process fake Shopify and Shiprocket servers."""
+import asyncio
+import json
+from datetime import datetime
+
+import httpx
+import pytest
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import fulfillment  # noqa: E402
+import orders  # noqa: E402
+import outbox  # noqa: E402
+
+ADDRESS = {"name": "A", "phone": "9999999999", "line1": "1 Main Road", "city": "Bengaluru",
+           "state": "Karnataka", "pincode": "560001", "country": "India"}
+
+
+class FakeShopify:
+    def __init__(self):
+        self.orders = []            # created order bodies
+        self.fail_next = 0          # respond 502 to this many create calls
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        if request.url.path.endswith("/graphql.json"):
+            tag = body["variables"]["query"].split(":", 1)[1]
+            edges = [{"node": {"id": f"gid://shopify/Order/{i + 1}", "name": f"#{1001 + i}"}}
+                     for i, order in enumerate(self.orders) if tag in order["tags"].split(",")]
+            return httpx.Response(200, json={"data": {"orders": {"edges": edges[:1]}}})
+        if self.fail_next:
+            self.fail_next -= 1
+            return httpx.Response(502, text="bad gateway")
+        if not body["order"]["line_items"]:
+            return httpx.Response(422, json={"errors": {"line_items": ["can't be blank"]}})
+        self.orders.append(body["order"])
+        return httpx.Response(201, json={"order": {"id": len(self.orders), "name": f"#{1000 + len(self.orders)}"}})
+
+
+class FakeShiprocket:
+    def __init__(self):
+        self.orders = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/auth/login"):
+            return httpx.Response(200, json={"token": "token-1"})
+        assert request.headers["authorization"] == "Bearer token-1"
+        if request.method == "GET":
+            search = request.url.params["search"]
+            data = [{"id": i + 1, "channel_order_id": order["order_id"],
+                     "shipments": [{"id": 100 + i, "awb": f"AWB{i}", "courier": "Fake"}]}
+                    for i, order in enumerate(self.orders) if order["order_id"] == search]
+            return httpx.Response(200, json={"data": data})
+        self.orders.append(json.loads(request.content))
+        n = len(self.orders)
+        return httpx.Response(200, json={"order_id": n, "shipment_id": 99 + n, "awb_code": f"AWB{n - 1}",
+                                         "courier_name": "Fake"})
+
+
+@pytest.fixture
+def env(monkeypatch):
+    monkeypatch.setattr(outbox, "collection", lambda db, name, operation="*": db[name])
+    monkeypatch.setattr(orders, "collection", lambda db, name, operation="*": db[name])
+    db = mongomock_motor.AsyncMongoMockClient()["test"]
+    shopify, shiprocket = FakeShopify(), FakeShiprocket()
+    adapters = {
+        fulfillment.SHOPIFY_ORDER: fulfillment.ShopifyOrderAdapter(
+            "http://shopify.test/admin/api/2024-01", "admin-token",
+            httpx.AsyncClient(transport=httpx.MockTransport(shopify))),
+        fulfillment.SHIPMENT: fulfillment.ShiprocketAdapter(
+            "http://shiprocket.test", "ops@example.com", "secret",
+            httpx.AsyncClient(transport=httpx.MockTransport(shiprocket))),
+    }
+    dispatcher = outbox.Dispatcher(db, adapters, retry_base_seconds=0)
+    return db, dispatcher, shopify, shiprocket
+
+
+async def paid_order(db, razorpay_order_id="order_1", items=(("11", 2, 50000),)):
+    await db.orders.insert_one(orders.new_order(razorpay_order_id, 100000, "INR", [list(i) for i in items],
+                                                shipping_address=ADDRESS))
+    payment = {"id": "pay_" + razorpay_order_id[6:], "status": "captured", "amount": 100000, "email": "a@b.co"}
+    await orders.store_raw_payment(db, razorpay_order_id, payment)
+    await outbox.mark_paid(None, db, razorpay_order_id, orders.paid_fields(payment))
+
+
+async def run(dispatcher):
+    started = await dispatcher.drain()
+    await dispatcher.wait_idle()
+    return started
+
+
+async def events(db):
+    return {event["_id"]: event for event in await db[outbox.COLLECTION].find().to_list(None)}
+
+
+def test_paid_order_creates_shopify_order_and_shipment_once(env):
+    db, dispatcher, shopify, shiprocket = env
+
+    async def scenario():
+        await paid_order(db)
+        await outbox.enqueue(db, ["order_1"])  # verify and webhook both enqueue
+        assert await run(dispatcher) == 2
+        assert await run(dispatcher) == 0
+        return await db.orders.find_one({orders.ORDER_ID: "order_1"}), await events(db)
+
+    order, stored = asyncio.run(scenario())
+    assert len(shopify.orders) == 1 and len(shiprocket.orders) == 1
+    assert shopify.orders[0]["tags"] == "razorpay,order_1"
+    assert order[orders.SHOPIFY_ORDER] == {"id": 1, "name": "#1001"}
+    assert order[orders.SHIPMENT]["awb"] == "AWB0"
+    assert {event[outbox.STATUS] for event in stored.values()} == {outbox.DONE}
+
+
+def test_requeued_events_do_not_duplicate(env):
+    db, dispatcher, shopify, shiprocket = env
+
+    async def scenario():
+        await paid_order(db)
+        await run(dispatcher)
+        await outbox.enqueue(db, ["order_1"], requeue=True)
+        assert await run(dispatcher) == 2
+
+    asyncio.run(scenario())
+    assert len(shopify.orders) == 1 and len(shiprocket.orders) == 1
+
+
+def test_retry_after_lost_update_adopts_upstream_order(env):
+    db, dispatcher, shopify, shiprocket = env
+
+    async def scenario():
+        await paid_order(db)
+        await run(dispatcher)
+        # Upstream calls succeeded but the order update was lost
+        await db.orders.update_one({orders.ORDER_ID: "order_1"},
+                                   {"$unset": {orders.SHOPIFY_ORDER: "", orders.SHIPMENT: ""}})
+        await outbox.enqueue(db, ["order_1"], requeue=True)
+        await run(dispatcher)
+        return await db.orders.find_one({orders.ORDER_ID: "order_1"})
+
+    order = asyncio.run(scenario())
+    assert len(shopify.orders) == 1 and len(shiprocket.orders) == 1
+    assert order[orders.SHOPIFY_ORDER] == {"id": 1, "name": "#1001"}
+    assert order[orders.SHIPMENT]["shipment_id"] == 100
+
+
+def test_transient_failure_retries_and_permanent_failure_is_dead(env):
+    db, dispatcher, shopify, shiprocket = env
+    shopify.fail_next = 1
+    dispatcher.retry_base_seconds = 3600
+
+    async def scenario():
+        await paid_order(db)
+        await paid_order(db, "order_2", items=(("not-a-shopify-id", 1, 100000),))
+        await run(dispatcher)
+        first = await events(db)
+        await db[outbox.COLLECTION].update_many({outbox.STATUS: outbox.PENDING}, {"$set": {outbox.DUE: datetime.utcnow()}})
+        await run(dispatcher)
+        return first, await events(db)
+
+    first, second = asyncio.run(scenario())
+    retried = first[outbox.event_id(fulfillment.SHOPIFY_ORDER, "order_1")]
+    assert retried[outbox.STATUS] == outbox.PENDING and "502" in retried[outbox.ERROR]
+    assert second[outbox.event_id(fulfillment.SHOPIFY_ORDER, "order_1")][outbox.STATUS] == outbox.DONE
+    assert second[outbox.event_id(fulfillment.SHOPIFY_ORDER, "order_1")][outbox.ATTEMPTS] == 2
+    assert first[outbox.event_id(fulfillment.SHOPIFY_ORDER, "order_2")][outbox.STATUS] == outbox.DEAD
+    assert len(shopify.orders) == 1